@@ -1,113 +1,232 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from typing import List, Optional
+from sqlalchemy import desc, func, select
+from typing import Dict, List, Optional
 from datetime import datetime
+import asyncio
 import models, schemas, auth
 from config import settings
-from database import get_db
+from database import get_async_db, SessionLocal
+from etag import compute_etag, etag_matches, not_modified, set_etag
+from github_client import GitHubPager, EVENTS_MAX_ITEMS, MAX_PER_PAGE, user_events_url, user_repos_url
+from http_client import get_http_session
+from sync_state import GITHUB_REPOS_SOURCE, get_sync_state, mark_synced, is_stale
+from logger import get_logger
 import aiohttp
 
+logger = get_logger(__name__)
+
 router = APIRouter()
 
-async def sync_github_repos(user: models.User, db: Session):
-    """同步GitHub仓库数据到数据库"""
-    if not user.github_token:
-        raise HTTPException(
-            status_code=400,
-            detail="GitHub token not configured"
-        )
-    
+# 进行中的后台仓库刷新任务，按用户ID合并并发刷新
+_refresh_tasks: Dict[int, asyncio.Task] = {}
+# 最近一次后台刷新失败的时间，失败后一段时间内不再重试
+_refresh_failures: Dict[int, datetime] = {}
+
+async def fetch_github_repos(github_username: str, github_token: str) -> List[dict]:
+    """从GitHub拉取用户的全部仓库"""
     headers = {
-        'Authorization': f'token {user.github_token}',
+        'Authorization': f'token {github_token}',
         'Accept': 'application/vnd.github.v3+json'
     }
     
     params = {
         'type': settings.github_repo_type,
         'sort': settings.github_repo_sort,
-        'direction': settings.github_repo_direction,
-        'per_page': settings.github_repo_per_page
+        'direction': settings.github_repo_direction
     }
     
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            f'https://api.github.com/users/{user.github_username}/repos',
-            headers=headers,
-            params=params
-        ) as response:
-            if response.status == 404:
-                raise HTTPException(status_code=404, detail="GitHub user not found")
-            response.raise_for_status()
-            repos = await response.json()
-            
-            # 更新数据库
-            for repo in repos:
-                db_repo = db.query(models.GitHubRepo).filter(
-                    models.GitHubRepo.user_id == user.id,
-                    models.GitHubRepo.github_id == repo['id']
-                ).first()
-                
-                repo_data = {
-                    'user_id': user.id,
-                    'github_id': repo['id'],
-                    'repo_name': repo['name'],
-                    'fork_flag': repo['fork'],
-                    'events_url': repo['events_url'],
-                    'description': repo['description'],
-                    'created_at': datetime.strptime(repo['created_at'], '%Y-%m-%dT%H:%M:%SZ'),
-                    'updated_at': datetime.strptime(repo['updated_at'], '%Y-%m-%dT%H:%M:%SZ'),
-                    'pushed_at': datetime.strptime(repo['pushed_at'], '%Y-%m-%dT%H:%M:%SZ'),
-                    'status': 1
-                }
-                
-                if db_repo:
-                    for key, value in repo_data.items():
-                        setattr(db_repo, key, value)
-                else:
-                    db_repo = models.GitHubRepo(**repo_data)
-                    db.add(db_repo)
-            
-            db.commit()
+    pager = GitHubPager(
+        await get_http_session(),
+        user_repos_url(github_username, settings.github_api_url),
+        headers=headers,
+        params=params,
+        per_page=settings.github_repo_per_page,
+        concurrency=settings.github_fetch_concurrency
+    )
+    try:
+        return await pager.fetch_all()
+    except aiohttp.ClientResponseError as e:
+        if e.status == 404:
+            raise HTTPException(status_code=404, detail="GitHub user not found")
+        raise
+
+def save_github_repos(db: Session, user_id: int, repos: List[dict]):
+    """把GitHub仓库数据集合式写入数据库并记录同步时间
+
+    一次查询读出用户已有的仓库，只写入新增的仓库和 updated_at / pushed_at
+    发生变化的仓库，GitHub上已不存在的仓库在同一事务中标记为 status=0。
+    """
+    existing = {
+        row.github_id: row
+        for row in db.query(
+            models.GitHubRepo.id,
+            models.GitHubRepo.github_id,
+            models.GitHubRepo.updated_at,
+            models.GitHubRepo.pushed_at,
+            models.GitHubRepo.status
+        ).filter(models.GitHubRepo.user_id == user_id)
+    }
+
+    new_rows = []
+    changed_rows = []
+    for repo in repos:
+        repo_data = {
+            'user_id': user_id,
+            'github_id': repo['id'],
+            'repo_name': repo['name'],
+            'fork_flag': repo['fork'],
+            'events_url': repo['events_url'],
+            'description': repo['description'],
+            'created_at': datetime.strptime(repo['created_at'], '%Y-%m-%dT%H:%M:%SZ'),
+            'updated_at': datetime.strptime(repo['updated_at'], '%Y-%m-%dT%H:%M:%SZ'),
+            'pushed_at': datetime.strptime(repo['pushed_at'], '%Y-%m-%dT%H:%M:%SZ'),
+            'status': 1
+        }
+        current = existing.get(repo['id'])
+        if current is None:
+            new_rows.append(repo_data)
+        elif (current.updated_at != repo_data['updated_at']
+              or current.pushed_at != repo_data['pushed_at']
+              or current.status != 1):
+            changed_rows.append(dict(repo_data, id=current.id))
+
+    seen_ids = {repo['id'] for repo in repos}
+    removed_ids = [
+        row.id for github_id, row in existing.items()
+        if github_id not in seen_ids and row.status != 0
+    ]
+
+    if new_rows:
+        db.bulk_insert_mappings(models.GitHubRepo, new_rows)
+    if changed_rows:
+        db.bulk_update_mappings(models.GitHubRepo, changed_rows)
+    if removed_ids:
+        db.query(models.GitHubRepo).filter(
+            models.GitHubRepo.id.in_(removed_ids)
+        ).update({'status': 0}, synchronize_session=False)
+
+    changed = bool(new_rows or changed_rows or removed_ids)
+    mark_synced(db, user_id, GITHUB_REPOS_SOURCE, changed=changed)
+    db.commit()
+    logger.info(
+        f"GitHub repos synced for user {user_id}: "
+        f"{len(new_rows)} new, {len(changed_rows)} updated, {len(removed_ids)} removed"
+    )
+
+async def sync_github_repos(user: models.User, db: Session):
+    """同步GitHub仓库数据到数据库"""
+    if not user.github_token:
+        raise HTTPException(
+            status_code=400,
+            detail="GitHub token not configured"
+        )
+    
+    repos = await fetch_github_repos(user.github_username, user.github_token)
+    save_github_repos(db, user.id, repos)
+
+async def _refresh_github_repos(user_id: int, github_username: str, github_token: str):
+    """后台刷新任务：拉取仓库后在线程中用独立会话写库"""
+    def save(repos):
+        db = SessionLocal()
+        try:
+            save_github_repos(db, user_id, repos)
+        finally:
+            db.close()
+
+    try:
+        repos = await fetch_github_repos(github_username, github_token)
+        await asyncio.to_thread(save, repos)
+        _refresh_failures.pop(user_id, None)
+        logger.info(f"Background GitHub repo refresh finished for user {user_id}: {len(repos)} repos")
+    except Exception as e:
+        _refresh_failures[user_id] = datetime.now()
+        logger.error(f"Background GitHub repo refresh failed for user {user_id}: {str(e)}")
+
+def schedule_repo_refresh(user: models.User) -> bool:
+    """为用户安排一次后台仓库刷新，已有进行中的刷新时直接复用
+
+    Returns:
+        bool: 当前是否有刷新任务在进行
+    """
+    if not user.github_token or not user.github_username:
+        return False
+
+    task = _refresh_tasks.get(user.id)
+    if task is not None and not task.done():
+        return True
+
+    failed_at = _refresh_failures.get(user.id)
+    if failed_at and (datetime.now() - failed_at).total_seconds() < settings.github_repo_retry_seconds:
+        return False
+
+    task = asyncio.create_task(
+        _refresh_github_repos(user.id, user.github_username, user.github_token)
+    )
+    _refresh_tasks[user.id] = task
+
+    def forget(done_task: asyncio.Task, user_id: int = user.id):
+        if _refresh_tasks.get(user_id) is done_task:
+            del _refresh_tasks[user_id]
+
+    task.add_done_callback(forget)
+    return True
 
 @router.get("/repos", response_model=schemas.GitHubRepoList)
 async def get_github_repos(
+    request: Request,
+    response: Response,
     page: int = Query(1, gt=0),
     per_page: int = Query(5, gt=0, le=20),
     current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """获取GitHub仓库列表，支持分页"""
-    # TODO 同步数据的部分放在 fetch_loader.py，脚本统一管理数据同步
-    # 先同步最新数据
-    await sync_github_repos(current_user, db)
+    """获取GitHub仓库列表，支持分页
+
+    直接返回库中数据；数据超过 github_repo_ttl_seconds 未同步时在后台刷新，
+    响应中的 synced_at / stale / refreshing 标明数据新鲜度，三者和仓库水位一起决定 ETag。
+    """
+    state = await db.run_sync(get_sync_state, current_user.id, GITHUB_REPOS_SOURCE)
+    stale = is_stale(state, settings.github_repo_ttl_seconds)
+    refreshing = schedule_repo_refresh(current_user) if stale else False
+
+    etag = compute_etag(
+        'github_repos', current_user.id, page, per_page,
+        state.changed_at if state else None, state.synced_at if state else None, stale, refreshing
+    )
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
     
     # 从数据库获取分页数据
-    total = db.query(models.GitHubRepo).filter(
+    total = (await db.execute(select(func.count()).select_from(models.GitHubRepo).where(
         models.GitHubRepo.user_id == current_user.id,
         models.GitHubRepo.status == 1
-    ).count()
+    ))).scalar()
     
-    repos = db.query(models.GitHubRepo).filter(
+    repos = (await db.execute(select(models.GitHubRepo).where(
         models.GitHubRepo.user_id == current_user.id,
         models.GitHubRepo.status == 1
     ).order_by(
         desc(models.GitHubRepo.updated_at)
     ).offset(
         (page - 1) * per_page
-    ).limit(per_page).all()
+    ).limit(per_page))).scalars().all()
     
     return {
         'items': repos,
         'total': total,
         'page': page,
-        'per_page': per_page
+        'per_page': per_page,
+        'synced_at': state.synced_at if state else None,
+        'stale': stale,
+        'refreshing': refreshing
     }
 
 @router.get("/events", response_model=List[schemas.GitHubEvent])
 async def get_github_events(
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(auth.get_current_user)
 ):
     if not current_user.github_token:
         raise HTTPException(
@@ -120,12 +239,19 @@ async def get_github_events(
         'Accept': 'application/vnd.github.v3+json'
     }
     
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            f'https://api.github.com/users/{current_user.github_username}/events',
-            headers=headers
-        ) as response:
-            if response.status == 404:
-                raise HTTPException(status_code=404, detail="GitHub user not found")
-            response.raise_for_status()
-            return await response.json() 
\ No newline at end of file
+    pager = GitHubPager(
+        await get_http_session(),
+        user_events_url(current_user.github_username, settings.github_api_url),
+        headers=headers,
+        per_page=MAX_PER_PAGE,
+        max_pages=EVENTS_MAX_ITEMS // MAX_PER_PAGE,
+        concurrency=settings.github_fetch_concurrency
+    )
+    try:
+        events = await pager.fetch_all()
+    except aiohttp.ClientResponseError as e:
+        if e.status == 404:
+            raise HTTPException(status_code=404, detail="GitHub user not found")
+        raise
+    # 并发拉取的页面按到达顺序合并，这里恢复为按时间倒序
+    return sorted(events, key=lambda event: int(event['id']), reverse=True)
@@ -1,11 +1,19 @@
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response, status
+from pydantic import TypeAdapter
+from sqlalchemy import Text, type_coerce
 from sqlalchemy.orm import Session
 import models, schemas, auth
 from config import settings
-from database import get_db
+from cache import dashboard_cache
+from daily_status import ACTIVE_PLAN_STATUS, materialize_recent, plan_active_range
+from database import get_db, SessionLocal
+from etag import compute_etag, etag_headers, etag_matches, not_modified, set_etag
+from rollups import get_project_seconds, local_today
+from serialization import json_fragments_response, json_response
+from sync_state import DAILY_STATUS_SOURCE, PLANS_SOURCE, get_user_versions, mark_synced
 import uuid
 from logger import get_logger
 
@@ -13,10 +21,28 @@ logger = get_logger(__name__)
 
 router = APIRouter()
 
+# 快速序列化路径使用的预构建校验器（settings.fast_serialization）
+plan_list_adapter = TypeAdapter(List[schemas.PlanResponse])
+# 影响每日状态内容的计划字段
+STATUS_CONTENT_FIELDS = ('plan_name', 'toggl_project_id', 'daily_plan_duration', 'plan_type')
+
+
+def refresh_daily_status(user_id: int, timezone: Optional[str], changed_days: Tuple[date, date]):
+    """计划变更后在后台重算每日状态，只重算变更的计划有效期内的日期"""
+    db = SessionLocal()
+    try:
+        updated = materialize_recent(db, user_id, timezone, changed_days=changed_days)
+        logger.info(f"Daily status refreshed for user {user_id}: {updated} days")
+    except Exception as e:
+        logger.error(f"Failed to refresh daily status for user {user_id}: {str(e)}")
+    finally:
+        db.close()
+
 
 @router.post("/", response_model=schemas.PlanResponse)
 def create_plan(
         plan: schemas.PlanCreate,
+        background_tasks: BackgroundTasks,
         current_user: models.User = Depends(auth.get_current_user),
         db: Session = Depends(get_db)
 ):
@@ -32,8 +58,13 @@ def create_plan(
 
     )
     db.add(db_plan)
+    mark_synced(db, current_user.id, PLANS_SOURCE, changed=True)
     db.commit()
+    dashboard_cache.invalidate(current_user.id)
     db.refresh(db_plan)
+    background_tasks.add_task(
+        refresh_daily_status, current_user.id, current_user.timezone, plan_active_range(db_plan)
+    )
     return db_plan
 
 
@@ -42,15 +73,19 @@ def get_plans(
         current_user: models.User = Depends(auth.get_current_user),
         db: Session = Depends(get_db)
 ):
-    return db.query(models.PersonalPlan).filter(
+    plans = db.query(models.PersonalPlan).filter(
         models.PersonalPlan.user_id == current_user.id
     ).all()
+    if settings.fast_serialization:
+        return json_response(plan_list_adapter, plans)
+    return plans
 
 
 @router.put("/{plan_id}", response_model=schemas.PlanResponse)
 def update_plan(
         plan_id: int,
         plan_update: schemas.PlanUpdate,
+        background_tasks: BackgroundTasks,
         current_user: models.User = Depends(auth.get_current_user),
         db: Session = Depends(get_db)
 ):
@@ -62,17 +97,42 @@ def update_plan(
     if not db_plan:
         raise HTTPException(status_code=404, detail="Plan not found")
 
+    old_start, old_end = plan_active_range(db_plan)
+    was_active = db_plan.plan_status == ACTIVE_PLAN_STATUS
+    content_changed = False
     for key, value in plan_update.dict(exclude_unset=True).items():
+        if key in STATUS_CONTENT_FIELDS and getattr(db_plan, key) != value:
+            content_changed = True
         setattr(db_plan, key, value)
-
+    # 记录离开 / 回到进行中状态的时间，历史日期的每日状态按此判断计划是否有效
+    is_active = db_plan.plan_status == ACTIVE_PLAN_STATUS
+    if was_active and not is_active:
+        db_plan.ended_at = datetime.now()
+    elif is_active:
+        db_plan.ended_at = None
+
+    new_start, new_end = plan_active_range(db_plan)
+    mark_synced(db, current_user.id, PLANS_SOURCE, changed=True)
     db.commit()
+    dashboard_cache.invalidate(current_user.id)
     db.refresh(db_plan)
+    if content_changed:
+        # 名称、项目、时长等变化影响该计划有效期内的每一天
+        changed_days = (min(old_start, new_start), max(old_end, new_end))
+    elif (old_start, old_end) != (new_start, new_end):
+        # 只有状态或截止日变化时，有效期不变的日期结果不变
+        changed_days = (min(old_end, new_end), max(old_end, new_end))
+    else:
+        changed_days = None
+    if changed_days:
+        background_tasks.add_task(refresh_daily_status, current_user.id, current_user.timezone, changed_days)
     return db_plan
 
 
 @router.delete("/{plan_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_plan(
         plan_id: int,
+        background_tasks: BackgroundTasks,
         current_user: models.User = Depends(auth.get_current_user),
         db: Session = Depends(get_db)
 ):
@@ -84,167 +144,81 @@ def delete_plan(
     if not db_plan:
         raise HTTPException(status_code=404, detail="Plan not found")
 
+    changed_days = plan_active_range(db_plan)
     db.delete(db_plan)
+    mark_synced(db, current_user.id, PLANS_SOURCE, changed=True)
     db.commit()
+    dashboard_cache.invalidate(current_user.id)
+    background_tasks.add_task(refresh_daily_status, current_user.id, current_user.timezone, changed_days)
 
 
 def get_plan_duration_from_toggl(db: Session, user_id: int, project_id: int, date: datetime) -> float:
-    """从toggl_datas表获取特定日期特定项目的时长（分钟）"""
-    # 获取最新的toggl数据
-    toggl_data = db.query(models.TogglData).filter(
-        models.TogglData.user_id == user_id
-    ).order_by(
-        models.TogglData.create_time.desc()
-    ).first()
-
-    if not toggl_data:
-        return 0
-
-    try:
-        # 解析time_entries
-        time_entries = toggl_data.time_entries
-
-        # 计算指定日期和项目的总时长
-        total_duration = 0
-        date_str = date.strftime('%Y-%m-%d')
-
-        for entry in time_entries:
-            entry_date = datetime.fromisoformat(entry['start']).date()
-
-            if (entry_date == date and
-                    entry['project_id'] == project_id and
-                    entry['duration'] > 0):
-                # Toggl API返回的duration小时
-                total_duration += entry['duration'] / 60
-
-        return round(total_duration)
-    except (KeyError, ValueError, TypeError) as e:
-        logger.error(f"Error processing Toggl data: {str(e)}")
-        return 0
+    """从toggl_daily_rollups表获取特定日期特定项目的时长（分钟）"""
+    project_seconds = get_project_seconds(db, user_id, date)
+    return round(project_seconds.get(project_id, 0) / 60)
 
 
 @router.get("/heatmap", response_model=List[schemas.DailyStatus])
 def get_heatmap_data(
+        request: Request,
+        response: Response,
         current_user: models.User = Depends(auth.get_current_user),
         db: Session = Depends(get_db),
         plan_type: Optional[int] = None,
         start_date: Optional[str] = None,
         end_date: Optional[str] = None
 ):
-    """获取用户的热力图数据"""
-    # 1. 设置日期范围
-    today = datetime.now().date()
+    """获取用户的热力图数据
+
+    只读 daily_status 表，每日状态由数据同步和计划变更后的物化任务维护；
+    物化任务写入时刷新 daily_status 水位，ETag 随之变化。
+    """
+    # 设置日期范围（按用户时区）
     if start_date and end_date:
         start = datetime.strptime(start_date, '%Y-%m-%d').date()
         end = datetime.strptime(end_date, '%Y-%m-%d').date()
     else:
-        end = today
+        end = local_today(current_user)
         start = end - timedelta(days=365)  # 默认获取过去一年的数据
 
-    # 2. 获取当前用户的有效计划
-    plans_query = db.query(models.PersonalPlan).filter(
-        models.PersonalPlan.user_id == current_user.id,
-        models.PersonalPlan.plan_status == 2 # 进行中的计划
+    # 两种序列化路径的输出字节不同，都计入 ETag
+    etag = compute_etag(
+        'heatmap', current_user.id, start, end, plan_type, settings.fast_serialization,
+        get_user_versions(db, current_user.id, [DAILY_STATUS_SOURCE])
     )
+    if etag_matches(request, etag):
+        return not_modified(etag)
 
-
-    active_plans = plans_query.all()
-
-    # 3. 获取现有的daily_status记录
-    existing_status = {
-        status.record_date: status
-        for status in db.query(models.DailyStatus).filter(
-            models.DailyStatus.user_id == current_user.id,
-            models.DailyStatus.record_date.between(start, end)
-        ).all()
-    }
-
-    # 4. 生成或更新每日状态数据
-    result_data = []
-    for record_date, d_status in existing_status.items():  # 遍历字典的键值对
-        result_data.append({
-            "record_date": record_date,  # 这里是键
-            "plan_status": d_status.plan_status,  # 这里是值的属性
-            "heat_level": d_status.heat_level  # 这里是值的属性
-        })
-
-    # 为当前日期创建新的状态记录
-    plan_status = {}
-    total_duration = 0
-    completed_core_plans = 0
-    total_core_plans = 0
-
-    for plan in active_plans:
-        # 检查计划在当前日期是否有效
-        # 从toggl_datas获取实际时长
-        actual_duration = get_plan_duration_from_toggl(
-            db,
-            current_user.id,
-            plan.toggl_project_id,
-            today
-        )
-
-        is_completed = actual_duration >= plan.daily_plan_duration
-        plan_status[plan.plan_name] = {
-            "duration": actual_duration,
-            "completed": is_completed,
-            "plan_type": plan.plan_type
-        }
-        total_duration += actual_duration
-        if plan.plan_type == 1:  # 核心计划（每日必做）
-            total_core_plans += 1
-            if is_completed:
-                completed_core_plans += 1
-
-    # 计算热力等级
-    if total_core_plans == 0:
-        heat_level = 0
-    else:
-        completion_rate = completed_core_plans / total_core_plans
-        if completion_rate == 1:
-            heat_level = 4
-        elif completion_rate >= 0.75:
-            heat_level = 3
-        elif completion_rate >= 0.5:
-            heat_level = 2
-        elif completion_rate > 0:
-            heat_level = 1
-        else:
-            heat_level = 0
-    # 创建新的daily_status记录
-    daily_status = models.DailyStatus(
-        user_id=current_user.id,
-        record_date=today,
-        plan_status=plan_status,
-        heat_level=heat_level,
-        total_duration=total_duration,
-        is_core_completed=(completed_core_plans == total_core_plans)
+    filters = (
+        models.DailyStatus.user_id == current_user.id,
+        models.DailyStatus.record_date.between(start, end)
     )
-
-    if existing_status.get(today):
-        # 更新特定记录
-        db.query(models.DailyStatus).filter(models.DailyStatus.record_date == today).update({
-            'heat_level': daily_status.heat_level,
-            'total_duration': daily_status.total_duration,
-            'is_core_completed':daily_status.is_core_completed,
-            'updated_at':datetime.now()
-        })
-    else:
-        db.add(daily_status)
-
-    # 添加到结果列表
-    result_data.append({
-        "record_date": daily_status.record_date,
-        "plan_status": daily_status.plan_status,
-        "heat_level": daily_status.heat_level
-    })
-
-    # 提交数据库更改
-    db.commit()
-
-    return result_data
-
-
-
-
-
+    if settings.fast_serialization:
+        # plan_status 按原始 JSON 文本读出直接拼接，不逐行解析；
+        # record_date 输出为与 schemas.DailyStatus (datetime) 相同的 0 点时间
+        rows = db.query(
+            models.DailyStatus.record_date,
+            type_coerce(models.DailyStatus.plan_status, Text).label('plan_status'),
+            models.DailyStatus.heat_level
+        ).filter(*filters).order_by(models.DailyStatus.record_date).all()
+        return json_fragments_response((
+            f'{{"record_date":"{row.record_date.isoformat()}T00:00:00",'
+            f'"plan_status":{row.plan_status},"heat_level":{int(row.heat_level)}}}'
+            for row in rows
+        ), headers=etag_headers(etag))
+
+    rows = db.query(
+        models.DailyStatus.record_date,
+        models.DailyStatus.plan_status,
+        models.DailyStatus.heat_level
+    ).filter(*filters).order_by(models.DailyStatus.record_date).all()
+
+    set_etag(response, etag)
+    return [
+        {
+            "record_date": row.record_date,
+            "plan_status": row.plan_status,
+            "heat_level": row.heat_level
+        }
+        for row in rows
+    ]
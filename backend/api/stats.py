@@ -1,90 +1,90 @@
 from decimal import Decimal
 
 import pytz
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, select
 from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Any
 import models, schemas, auth
-from database import get_db
+from cache import dashboard_cache
+from database import get_async_db
+from etag import compute_etag, etag_matches, not_modified, set_etag
+from rollups import get_project_seconds, local_today
+from sync_state import TOGGL_SNAPSHOT_SOURCE, get_user_versions
 
 router = APIRouter()
 
+EVENT_TYPE_KEYS = {
+    'PushEvent': 'commits',
+    'PullRequestEvent': 'pulls',
+    'IssuesEvent': 'issues',
+}
 
-@router.get("/dashboard")
-async def get_dashboard_stats(
-        current_user: models.User = Depends(auth.get_current_user),
-        db: Session = Depends(get_db)
-):
-    # 获取当前时间和本周开始时间
-    now = datetime.now()
-    week_start = now - timedelta(days=now.weekday())
-    week_start = week_start.replace(hour=0, minute=0, second=0, microsecond=0)
-
-    # 获取本周Toggl统计数据
-    toggl_data = db.query(models.TogglData).filter(
-        models.TogglData.user_id == current_user.id
-    ).order_by(desc(models.TogglData.update_time)).first()
-
-    total_duration = 0
-    project_toggl_detail = []
-    if toggl_data and toggl_data.time_entries:
-        for entry in toggl_data.time_entries:
-            entry_start = datetime.strptime(entry['start'], '%Y-%m-%dT%H:%M:%S%z')
-            week_start_aware = pytz.UTC.localize(week_start)
-
-            # 确保 week_start 是 datetime 对象
-            if entry_start >= week_start_aware and entry['duration'] > 0:
-                total_duration += entry['duration'] / 3600  # 转换为小时
-                project_toggl_detail.append({
-                    'project_id': entry['project_id'],
-                    'duration': entry['duration'] / 3600,
-                    'at': entry_start,
-                })
-    # 获取本周GitHub统计数据
-    github_events = db.query(models.GitHubEvents).filter(
-        models.GitHubEvents.user_id == current_user.id,
-        models.GitHubEvents.event_time >= week_start
-    ).all()
-
-    event_counts = {
-        'total_events': len(github_events),
-        'commits': sum(1 for e in github_events if e.event_type == 'PushEvent'),
-        'pulls': sum(1 for e in github_events if e.event_type == 'PullRequestEvent'),
-        'issues': sum(1 for e in github_events if e.event_type == 'IssuesEvent'),
-        'daily_events': []
-    }
 
-    # 统计每日事件数
-    daily_counts = {}
-    for event in github_events:
-        date_str = event.event_time.date().isoformat()
-        daily_counts[date_str] = daily_counts.get(date_str, 0) + 1
+async def get_github_event_stats(db: AsyncSession, user_id: int, since: datetime) -> Dict[str, Any]:
+    """按事件类型和日期分组统计 since 之后的GitHub事件"""
+    type_counts = dict((await db.execute(select(
+        models.GitHubEvents.event_type,
+        func.count()
+    ).where(
+        models.GitHubEvents.user_id == user_id,
+        models.GitHubEvents.event_time >= since
+    ).group_by(models.GitHubEvents.event_type))).all())
 
+    event_day = func.date(models.GitHubEvents.event_time)
+    daily_counts = (await db.execute(select(
+        event_day,
+        func.count()
+    ).where(
+        models.GitHubEvents.user_id == user_id,
+        models.GitHubEvents.event_time >= since
+    ).group_by(event_day).order_by(event_day))).all()
+
+    event_counts = {'total_events': sum(type_counts.values())}
+    for event_type, key in EVENT_TYPE_KEYS.items():
+        event_counts[key] = type_counts.get(event_type, 0)
     event_counts['daily_events'] = [
-        {'date': date, 'count': count}
-        for date, count in sorted(daily_counts.items())
+        # MySQL 返回 date，SQLite 返回字符串
+        {'date': day if isinstance(day, str) else day.isoformat(), 'count': count}
+        for day, count in daily_counts
     ]
+    return event_counts
 
-    # 获取计划统计数据
-    plans = db.query(models.PersonalPlan).filter(
-        models.PersonalPlan.user_id == current_user.id,
-    ).all()
+
+async def get_plan_stats(db: AsyncSession, user_id: int, project_seconds: Dict[int, int], total_duration: float):
+    """按状态统计计划数量，并计算各计划本周时长占比
+
+    Returns:
+        tuple: (计划统计, 每日目标时长之和)
+    """
+    status_counts = dict((await db.execute(select(
+        models.PersonalPlan.plan_status,
+        func.count()
+    ).where(
+        models.PersonalPlan.user_id == user_id
+    ).group_by(models.PersonalPlan.plan_status))).all())
+
+    plans = (await db.execute(select(
+        models.PersonalPlan.plan_name,
+        models.PersonalPlan.toggl_project_id,
+        models.PersonalPlan.daily_plan_duration,
+        models.PersonalPlan.plan_type
+    ).where(
+        models.PersonalPlan.user_id == user_id
+    ).order_by(models.PersonalPlan.id))).all()
 
     plan_stats = {
-        'total': len(plans),
-        'completed': sum(1 for p in plans if p.plan_status == 1),
-        'inProgress': sum(1 for p in plans if p.plan_status == 2),
-        'delayed': sum(1 for p in plans if p.plan_status == 0),
+        'total': sum(status_counts.values()),
+        'completed': status_counts.get(1, 0),
+        'inProgress': status_counts.get(2, 0),
+        'delayed': status_counts.get(0, 0),
         'distribution': []
     }
     target_hour = 0
     for plan in plans:
-        plan_time = sum(
-            toggl_detail['duration'] for toggl_detail in project_toggl_detail
-            if toggl_detail.get('project_id') is not None and toggl_detail['project_id'] == plan.toggl_project_id
-        )
+        plan_time = project_seconds.get(plan.toggl_project_id, 0) / 3600
         percentage = 0 if total_duration <= 0 else plan_time / total_duration * 100
         target_hour += plan.daily_plan_duration
         plan_stats['distribution'].append({
@@ -94,20 +94,64 @@ async def get_dashboard_stats(
             'plan_type': plan.plan_type,
             'color': get_plan_color(len(plan_stats['distribution']))
         })
+    return plan_stats, target_hour
+
+
+@router.get("/dashboard")
+async def get_dashboard_stats(
+        request: Request,
+        response: Response,
+        current_user: models.User = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_async_db)
+):
+    # 按用户时区的今天和本周开始时间
+    today = local_today(current_user)
+    week_start = datetime.combine(today - timedelta(days=today.weekday()), datetime.min.time())
+
+    # 同步任务写入新数据或计划增删改时水位变化，ETag 和缓存随之失效；
+    # 仪表盘不读取 Toggl 快照，快照水位不参与
+    versions = tuple(
+        version for version in await db.run_sync(get_user_versions, current_user.id)
+        if version[0] != TOGGL_SNAPSHOT_SOURCE
+    )
+    etag = compute_etag('dashboard', current_user.id, week_start.date(), today, versions)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
+    cache_version = (week_start.date(), today, versions)
+    cached = dashboard_cache.get(current_user.id, version=cache_version)
+    if cached is not None:
+        return cached
+
+    # 获取本周Toggl统计数据：从日汇总表按项目汇总时长（秒），日期按用户时区划分
+    # rollups / sync_state 中的查询函数与同步任务共用，通过 run_sync 在异步会话上执行
+    project_seconds = await db.run_sync(
+        get_project_seconds, current_user.id, week_start.date(), today
+    )
+    total_duration = sum(project_seconds.values()) / 3600  # 转换为小时
+
+    # 获取本周GitHub统计数据
+    event_counts = await get_github_event_stats(db, current_user.id, week_start)
+
+    # 获取计划统计数据
+    plan_stats, target_hour = await get_plan_stats(db, current_user.id, project_seconds, total_duration)
     week_target = target_hour * 5
 
-    return {
+    result = {
         'stats': {
             'toggl': {
                 'actual_hours': round(total_duration, 1),
                 'target_hours': week_target,  # 可以从配置或用户设置中获取
-                'completion_rate': round((total_duration / float(week_target)) * 100, 2),
+                'completion_rate': round((total_duration / float(week_target)) * 100, 2) if week_target else 0,
                 'period': '本周'
             },
             'github': event_counts,
             'plans': plan_stats
         }
     }
+    dashboard_cache.set(current_user.id, result, version=cache_version)
+    return result
 
 
 def get_plan_color(index: int) -> str:
@@ -1,10 +1,24 @@
-import requests
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from typing import List
+import asyncio
+import base64
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import desc, select
+from typing import Dict, List, Optional
 import models, schemas, auth
-from database import get_db
+from config import settings
+from database import get_async_db, get_db, SessionLocal
+from etag import compute_etag, etag_headers, etag_matches, not_modified, set_etag
+from http_client import get_http_session
+from serialization import json_response
+from sync_state import (
+    TOGGL_PROJECTS_SOURCE, TOGGL_SNAPSHOT_SOURCE, TOGGL_TAGS_SOURCE,
+    get_sync_state, get_user_versions, is_stale,
+)
+from toggl_dimensions import save_dimensions, transform_dimensions
 import json
 
 from logger import get_logger
@@ -13,16 +27,21 @@ logger = get_logger(__name__)
 
 router = APIRouter()
 
+# 快速序列化路径使用的预构建校验器（settings.fast_serialization）
+project_list_adapter = TypeAdapter(List[schemas.TogglProject])
 
-@router.get("/projects", response_model=List[schemas.TogglProject])
-def get_toggl_projects(
-        current_user: models.User = Depends(auth.get_current_user),
-        db: Session = Depends(get_db)
-):
-    """从数据库获取最新的Toggl项目列表"""
-    # 获取最新的toggl数据记录
-    latest_toggl_data = db.query(models.TogglData).filter(
-        models.TogglData.user_id == current_user.id
+# 进行中的标签刷新任务，按用户ID合并并发刷新
+_refresh_tasks: Dict[int, asyncio.Task] = {}
+# 最近一次标签刷新失败的时间，失败后一段时间内不在后台重试
+_refresh_failures: Dict[int, datetime] = {}
+
+
+def get_snapshot_projects(db: Session, user_id: int) -> List[dict]:
+    """从最新的Toggl快照读取项目列表（维度表建立之前的旧数据），只加载 project_list 列"""
+    latest_toggl_data = db.query(models.TogglData).options(
+        load_only(models.TogglData.project_list)
+    ).filter(
+        models.TogglData.user_id == user_id
     ).order_by(
         desc(models.TogglData.update_time)
     ).first()
@@ -34,26 +53,14 @@ def get_toggl_projects(
         )
 
     try:
-        # 解析project_list JSON数据
-        project_list = latest_toggl_data.project_list
-        # 提取所需字段并封装成 List[schemas.TogglProject]
-        logger.info(f"id:{project_list[0]['id']}")
-        logger.info(f"name:{project_list[0]['name']}")
-        logger.info(f"wid:{project_list[0]['wid']}")
-        projects = [
-            schemas.TogglProject(
-                id=int(project['id']),  # 确保将其转换为 int
-                name=project['name'],
-                workspace_id=int(project['wid']) if project['wid'] is not None else None  # 确保将其转换为 int
-            )
-            for project in project_list
+        return [
+            {
+                'id': int(project['id']),  # 确保将其转换为 int
+                'name': project['name'],
+                'workspace_id': int(project['wid']) if project['wid'] is not None else None
+            }
+            for project in latest_toggl_data.project_list
         ]
-        logger.info(f"projects:{projects}")
-        logger.info(f"project_list: {project_list}")
-
-
-        # 返回项目列表
-        return projects
     except (json.JSONDecodeError, ValueError) as e:
         raise HTTPException(
             status_code=500,
@@ -61,37 +68,166 @@ def get_toggl_projects(
         )
 
 
-@router.get("/tags", response_model=List[schemas.TogglTag])
-def get_toggl_tags(
+@router.get("/projects", response_model=List[schemas.TogglProject])
+def get_toggl_projects(
+        request: Request,
+        response: Response,
         current_user: models.User = Depends(auth.get_current_user),
         db: Session = Depends(get_db)
 ):
-    logger.info(f"Fetching Toggl tags for user: {current_user.username}")
+    """获取Toggl项目列表
 
-    if not current_user.toggl_api_token:
-        logger.error(f"Toggl API token not configured for user: {current_user.username}")
-        raise HTTPException(
-            status_code=400,
-            detail="Toggl API token not configured"
-        )
+    从 toggl_projects 维度表读取；同步任务只在项目内容变化时重写维度表并刷新
+    toggl_projects 水位，ETag 随之变化。还没有维度表数据的用户退回读取最新快照，
+    此时按快照水位计算 ETag，没有快照水位的旧数据不使用条件请求。
+    """
+    versions = dict(get_user_versions(db, current_user.id, [TOGGL_PROJECTS_SOURCE, TOGGL_SNAPSHOT_SOURCE]))
+    from_dimension = versions.get(TOGGL_PROJECTS_SOURCE) is not None
+    version = versions.get(TOGGL_PROJECTS_SOURCE if from_dimension else TOGGL_SNAPSHOT_SOURCE)
+    etag = None
+    if version is not None:
+        etag = compute_etag('toggl_projects', current_user.id, from_dimension, settings.fast_serialization, version)
+        if etag_matches(request, etag):
+            return not_modified(etag)
 
-    auth_string = f"{current_user.toggl_api_token}:api_token"
+    if from_dimension:
+        projects = [
+            {'id': row.project_id, 'name': row.name, 'workspace_id': row.workspace_id}
+            for row in db.query(
+                models.TogglProject.project_id,
+                models.TogglProject.name,
+                models.TogglProject.workspace_id
+            ).filter(
+                models.TogglProject.user_id == current_user.id
+            ).order_by(models.TogglProject.project_id)
+        ]
+    else:
+        projects = get_snapshot_projects(db, current_user.id)
+    logger.debug(f"用户 {current_user.id} 的Toggl项目: {len(projects)} 个")
+
+    # 返回项目列表
+    if settings.fast_serialization:
+        return json_response(project_list_adapter, projects, headers=etag_headers(etag) if etag else None)
+    if etag:
+        set_etag(response, etag)
+    return projects
+
+
+async def fetch_toggl_tags(api_token: str) -> List[dict]:
+    """从Toggl拉取用户的全部标签"""
+    auth_string = base64.b64encode(f"{api_token}:api_token".encode()).decode('ascii')
     headers = {
         'content-type': 'application/json',
         'Authorization': f'Basic {auth_string}'
     }
+    session = await get_http_session()
+    async with session.get(f'{settings.toggl_api_url}/me/tags', headers=headers) as response:
+        response.raise_for_status()
+        return await response.json()
+
+
+def save_toggl_tags(db: Session, user_id: int, tags: List[dict]) -> None:
+    """按内容哈希写入 toggl_tags 维度表，内容不变时只刷新同步时间"""
+    rows = transform_dimensions({'tags': tags})[TOGGL_TAGS_SOURCE]
+    written = save_dimensions(db, user_id, {TOGGL_TAGS_SOURCE: rows})
+    logger.info(f"Toggl tags synced for user {user_id}: {len(rows)} tags, changed={bool(written)}")
+
+
+async def _refresh_toggl_tags(user_id: int, api_token: str) -> bool:
+    """刷新任务：拉取标签后在线程中用独立会话写库，返回是否成功"""
+    def save(tags):
+        db = SessionLocal()
+        try:
+            save_toggl_tags(db, user_id, tags)
+        finally:
+            db.close()
 
     try:
-        response = requests.get(
-            'https://api.track.toggl.com/api/v9/me/tags',
-            headers=headers
-        )
-        response.raise_for_status()
-        logger.info(f"Successfully fetched {len(response.json())} Toggl tags")
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching Toggl tags: {str(e)}")
+        tags = await fetch_toggl_tags(api_token)
+        await asyncio.to_thread(save, tags)
+        _refresh_failures.pop(user_id, None)
+        return True
+    except Exception as e:
+        _refresh_failures[user_id] = datetime.now()
+        logger.error(f"Toggl tag refresh failed for user {user_id}: {str(e)}")
+        return False
+
+
+def schedule_tag_refresh(user: models.User, force: bool = False) -> Optional[asyncio.Task]:
+    """为用户安排一次标签刷新，已有进行中的刷新时直接复用
+
+    force 为 False 时，最近刷新失败的用户在 toggl_tag_retry_seconds 内不再重试。
+
+    Returns:
+        进行中的刷新任务，没有安排刷新时为 None
+    """
+    task = _refresh_tasks.get(user.id)
+    if task is not None and not task.done():
+        return task
+
+    failed_at = _refresh_failures.get(user.id)
+    if not force and failed_at and (datetime.now() - failed_at).total_seconds() < settings.toggl_tag_retry_seconds:
+        return None
+
+    task = asyncio.create_task(_refresh_toggl_tags(user.id, user.toggl_api_token))
+    _refresh_tasks[user.id] = task
+
+    def forget(done_task: asyncio.Task, user_id: int = user.id):
+        if _refresh_tasks.get(user_id) is done_task:
+            del _refresh_tasks[user_id]
+
+    task.add_done_callback(forget)
+    return task
+
+
+@router.get("/tags", response_model=List[schemas.TogglTag])
+async def get_toggl_tags(
+        request: Request,
+        response: Response,
+        refresh: bool = Query(False, description="立即从Toggl同步后再返回"),
+        current_user: models.User = Depends(auth.get_current_user),
+        db: AsyncSession = Depends(get_async_db)
+):
+    """获取Toggl标签列表
+
+    从 toggl_tags 维度表读取（同步任务随 /me 快照一起写入）。数据超过
+    toggl_tag_ttl_seconds 未同步时在后台刷新，本次仍返回库中数据；从未同步过或
+    refresh=true 时等待刷新完成后再返回。同一用户的并发刷新合并为一次请求。
+    """
+    if not current_user.toggl_api_token:
+        logger.error(f"Toggl API token not configured for user: {current_user.username}")
         raise HTTPException(
-            status_code=500,
-            detail=f"Error fetching Toggl tags: {str(e)}"
+            status_code=400,
+            detail="Toggl API token not configured"
         )
+
+    user_id = current_user.id
+    state = await db.run_sync(get_sync_state, user_id, TOGGL_TAGS_SOURCE)
+    if refresh or state is None:
+        task = schedule_tag_refresh(current_user, force=True)
+        # shield：请求被取消时不影响其他等待同一任务的请求
+        if not await asyncio.shield(task):
+            raise HTTPException(
+                status_code=500,
+                detail="Error fetching Toggl tags"
+            )
+        # 刷新在独立会话中提交，结束当前事务后重新读取水位（current_user 随之过期）
+        await db.rollback()
+        state = await db.run_sync(get_sync_state, user_id, TOGGL_TAGS_SOURCE)
+    elif is_stale(state, settings.toggl_tag_ttl_seconds):
+        schedule_tag_refresh(current_user)
+
+    etag = compute_etag('toggl_tags', user_id, state.changed_at)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
+    tags = (await db.execute(select(
+        models.TogglTag.tag_id.label('id'),
+        models.TogglTag.name,
+        models.TogglTag.workspace_id
+    ).where(
+        models.TogglTag.user_id == user_id
+    ).order_by(models.TogglTag.tag_id))).mappings().all()
+    logger.debug(f"用户 {user_id} 的Toggl标签: {len(tags)} 个")
+    return tags
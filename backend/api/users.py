@@ -40,9 +40,20 @@ def update_user(
     current_user: models.User = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
+    # current_user 可能来自令牌缓存，不在当前会话中，按 id 重新加载后再修改
+    db_user = db.get(models.User, current_user.id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
     for key, value in user_update.dict(exclude_unset=True).items():
-        setattr(current_user, key, value)
+        setattr(db_user, key, value)
     
     db.commit()
-    db.refresh(current_user)
-    return current_user 
\ No newline at end of file
+    db.refresh(db_user)
+    auth.invalidate_user_tokens(db_user.id)
+    return db_user
+
+@router.get("/auth-cache/stats")
+def read_auth_cache_stats(current_user: models.User = Depends(auth.get_current_admin_user)):
+    """令牌缓存命中情况（仅管理员）"""
+    return auth.token_cache.stats() 
\ No newline at end of file
@@ -1,13 +1,19 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional, Any, Coroutine
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
 from typing_extensions import Type
 
-from database import get_db
+from cache import TTLCache
+from database import get_async_db
 from models import User
 from config import settings
 from Cryptodome.Cipher import AES
@@ -24,11 +30,23 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# 已验证令牌 -> 用户字段快照，条目有效期不超过令牌剩余有效期
+token_cache = TTLCache(settings.auth_cache_size, settings.auth_cache_ttl_seconds)
+
+# 登录时的 bcrypt 校验和 AES 解密在专用线程池中执行，避免阻塞事件循环
+_login_executor: Optional[ThreadPoolExecutor] = None
+_login_semaphore: Optional[asyncio.Semaphore] = None
+
+
+@lru_cache()
+def get_encryption_key() -> bytes:
+    """解码Base64密钥（只在首次调用时解码）"""
+    return base64.b64decode(settings.vite_encryption_key)
+
 def decrypt_password(encrypted_password: str) -> str:
     """解密前端加密的密码"""
     try:
-        # 解码Base64密钥
-        key = base64.b64decode(settings.vite_encryption_key)
+        key = get_encryption_key()
         
         # 解码Base64密文
         combined = base64.b64decode(encrypted_password)
@@ -66,6 +84,29 @@ def authenticate_user(db: Session, username: str, password: str) -> Optional[Use
         return None
     return user
 
+def _get_login_executor() -> ThreadPoolExecutor:
+    global _login_executor, _login_semaphore
+    if _login_executor is None:
+        _login_executor = ThreadPoolExecutor(
+            max_workers=settings.login_workers,
+            thread_name_prefix="login"
+        )
+        _login_semaphore = asyncio.Semaphore(settings.login_workers)
+    return _login_executor
+
+async def run_login_task(func, *args):
+    """在登录线程池中执行阻塞任务，同时执行的任务数不超过 login_workers"""
+    executor = _get_login_executor()
+    async with _login_semaphore:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+def shutdown_login_executor() -> None:
+    global _login_executor, _login_semaphore
+    if _login_executor is not None:
+        _login_executor.shutdown(wait=False)
+        _login_executor = None
+        _login_semaphore = None
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """创建访问令牌"""
     to_encode = data.copy()
@@ -78,24 +119,53 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
     return encoded_jwt
 
+def snapshot_user(user: User) -> dict:
+    """提取用户的全部列值"""
+    return {column.key: getattr(user, column.key) for column in inspect(User).column_attrs}
+
+
+def user_from_snapshot(snapshot: dict) -> User:
+    """由快照构造一个已加载全部字段、不属于任何会话的用户对象"""
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return user
+
+
+def invalidate_user_tokens(user_id: int) -> None:
+    """用户信息或状态变化后，清除该用户所有令牌的缓存"""
+    token_cache.invalidate_where(lambda snapshot: snapshot['id'] == user_id)
+
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> Type[User]:
-    """获取当前用户"""
+    """获取当前用户
+
+    命中令牌缓存时不再解码 JWT、不查询数据库，返回的用户对象不在当前会话中；
+    需要修改用户时应按 id 重新加载。
+
+    同步（def）接口也通过本依赖鉴权：缓存命中时只创建一个未连接的异步会话，开销可以
+    忽略；未命中时用户查询走异步连接池，接口本身的查询再从同步连接池取连接，这类请求
+    会同时占用两个池各一个连接。
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
+
+    snapshot = token_cache.get(token)
+    if snapshot is not None:
+        return user_from_snapshot(snapshot)
+
     try:
         payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         
-        user = db.query(User).filter(User.username == username).first()
+        user = (await db.execute(select(User).where(User.username == username))).scalars().first()
         if user is None:
             raise credentials_exception
         
@@ -104,6 +174,12 @@ async def get_current_user(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="User is disabled"
             )
+
+        # 只缓存正常状态的用户，条目在令牌过期时一并失效
+        expires_in = payload.get("exp", 0) - datetime.utcnow().timestamp()
+        if expires_in > 0:
+            token_cache.set(token, snapshot_user(user),
+                            ttl_seconds=min(settings.auth_cache_ttl_seconds, expires_in))
         
         return user
         
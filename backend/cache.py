@@ -0,0 +1,87 @@
+"""进程内结果缓存
+
+按键缓存接口结果，每个条目带一个版本号（通常是用户数据的同步水位）。
+读取时版本号不一致或超过 TTL 都视为未命中；容量满时淘汰最久未使用的条目。
+
+多个路由共用的缓存实例（如仪表盘缓存）也定义在这里，路由之间不互相导入。
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from config import settings
+
+_MISSING = object()
+
+
+class TTLCache:
+    """带版本校验的 LRU + TTL 缓存（线程安全）"""
+
+    def __init__(self, maxsize: int = 1024, ttl_seconds: float = 300):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, Tuple[float, Any, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, version: Any = None, default: Any = None) -> Any:
+        """读取缓存；条目过期或版本号不一致时返回 default"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, entry_version, value = entry
+                if expires_at > now and entry_version == version:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, version: Any = None, ttl_seconds: Optional[float] = None) -> None:
+        """写入缓存，ttl_seconds 为空时使用默认 TTL"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Any], bool]) -> int:
+        """删除值满足 predicate 的全部条目，返回删除数量"""
+        with self._lock:
+            keys = [key for key, (_, _, value) in self._data.items() if predicate(value)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率等统计快照"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# 仪表盘结果缓存：键为用户ID，版本号为 (本周起始日, 今天, 用户各数据源的同步水位)；
+# api/stats.py 读写，api/plans.py 在计划变更后失效
+dashboard_cache = TTLCache(settings.dashboard_cache_size, settings.dashboard_cache_ttl_seconds)
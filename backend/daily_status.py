@@ -0,0 +1,193 @@
+"""每日状态（热力图）物化
+
+根据计划和 toggl_daily_rollups 计算每天的 daily_status。fetch_loader.py 在写入
+Toggl数据后调用，计划增删改后由接口在后台调用；热力图接口只读这张表。
+每一天只统计当天处于有效期（创建日 ~ 截止日 / 结束日）内的计划，重算历史日期时
+已完成或暂停的计划仍计入其有效期内的日期。计划变更只重算该计划有效期内的日期。
+数据同步和计划接口可能同时写同一天，写入使用 upsert。
+本模块与 fetch_loader.py 共用，不导入 config / logger。
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.orm import Session
+
+import models
+from rollups import get_timezone
+from sync_state import DAILY_STATUS_SOURCE, PLANS_SOURCE, get_sync_state, mark_synced
+
+# 默认补齐的天数，覆盖热力图默认展示的过去一年（含今天）
+DEFAULT_BACKFILL_DAYS = 366
+# 进行中的计划状态
+ACTIVE_PLAN_STATUS = 2
+# upsert 时更新的列
+_UPDATE_COLUMNS = ('plan_status', 'heat_level', 'total_duration', 'is_core_completed', 'updated_at')
+
+
+def plan_active_range(plan: models.PersonalPlan) -> Tuple[date, date]:
+    """计划的有效期：创建日到截止日，已结束的计划到结束当天为止"""
+    start = plan.create_time.date() if plan.create_time else date.min
+    end = plan.deadline or date.max
+    if isinstance(end, datetime):
+        # 接口更新计划后、提交之前，deadline 还是请求中的 datetime
+        end = end.date()
+    if plan.ended_at:
+        end = min(end, plan.ended_at.date())
+    elif plan.plan_status != ACTIVE_PLAN_STATUS and plan.update_time:
+        # 没有结束时间的旧数据按最后更新时间处理
+        end = min(end, plan.update_time.date())
+    return start, end
+
+
+def compute_heat_level(completed_core_plans: int, total_core_plans: int) -> int:
+    """根据核心计划完成比例计算热力等级（0-4）"""
+    if total_core_plans == 0:
+        return 0
+    completion_rate = completed_core_plans / total_core_plans
+    if completion_rate == 1:
+        return 4
+    elif completion_rate >= 0.75:
+        return 3
+    elif completion_rate >= 0.5:
+        return 2
+    elif completion_rate > 0:
+        return 1
+    return 0
+
+
+def build_daily_status(plans: List[models.PersonalPlan], project_seconds: Dict[int, int], day: date) -> dict:
+    """计算某一天的计划完成情况；只统计当天处于有效期内的计划"""
+    plan_status = {}
+    total_duration = 0
+    completed_core_plans = 0
+    total_core_plans = 0
+
+    for plan in plans:
+        # 检查计划在当前日期是否有效
+        active_start, active_end = plan_active_range(plan)
+        if not active_start <= day <= active_end:
+            continue
+
+        # 从日汇总获取实际时长（分钟）
+        actual_duration = round(project_seconds.get(plan.toggl_project_id, 0) / 60)
+        is_completed = actual_duration >= plan.daily_plan_duration
+        plan_status[plan.plan_name] = {
+            "duration": actual_duration,
+            "completed": is_completed,
+            "plan_type": plan.plan_type
+        }
+        total_duration += actual_duration
+        if plan.plan_type == 1:  # 核心计划（每日必做）
+            total_core_plans += 1
+            if is_completed:
+                completed_core_plans += 1
+
+    return {
+        'plan_status': plan_status,
+        'heat_level': compute_heat_level(completed_core_plans, total_core_plans),
+        'total_duration': total_duration,
+        'is_core_completed': completed_core_plans == total_core_plans
+    }
+
+
+def _upsert_daily_status(db: Session, rows: List[dict]) -> None:
+    """按 (user_id, record_date) 插入或更新，并发写入同一天时不会违反唯一键"""
+    table = models.DailyStatus.__table__
+    if db.get_bind().dialect.name == 'mysql':
+        statement = mysql.insert(table)
+        statement = statement.on_duplicate_key_update(
+            {column: statement.inserted[column] for column in _UPDATE_COLUMNS}
+        )
+    else:
+        # 开发环境的 SQLite
+        statement = sqlite.insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=['user_id', 'record_date'],
+            set_={column: statement.excluded[column] for column in _UPDATE_COLUMNS}
+        )
+    db.execute(statement, rows)
+
+
+def materialize_daily_status(db: Session, user_id: int, start: date, end: date,
+                             changed_days: Optional[Tuple[date, date]] = None) -> int:
+    """在一个事务内补齐并更新 [start, end] 范围内的每日状态
+
+    只重算需要的日期：还没有记录的日期、日汇总在记录生成之后有更新的日期，
+    以及 changed_days（变更的计划有效期）内的日期。计划后台重算没能执行时，
+    计划水位在记录生成之后有变化的，从变化当天起重算。
+
+    Returns:
+        int: 写入（新增或更新）的记录数
+    """
+    started_at = datetime.now()
+
+    existing = dict(db.query(
+        models.DailyStatus.record_date,
+        models.DailyStatus.updated_at
+    ).filter(
+        models.DailyStatus.user_id == user_id,
+        models.DailyStatus.record_date.between(start, end)
+    ).all())
+    rollup_changed_at = dict(db.query(
+        models.TogglDailyRollup.record_date,
+        func.max(models.TogglDailyRollup.update_time)
+    ).filter(
+        models.TogglDailyRollup.user_id == user_id,
+        models.TogglDailyRollup.record_date.between(start, end)
+    ).group_by(models.TogglDailyRollup.record_date).all())
+    plans_state = get_sync_state(db, user_id, PLANS_SOURCE)
+    plans_changed_at = plans_state.changed_at if plans_state else None
+
+    dirty_days = []
+    day = start
+    while day <= end:
+        updated_at = existing.get(day)
+        if (updated_at is None
+                or (changed_days and changed_days[0] <= day <= changed_days[1])
+                or (rollup_changed_at.get(day) and rollup_changed_at[day] > updated_at)
+                or (plans_changed_at and plans_changed_at > updated_at and day >= plans_changed_at.date())):
+            dirty_days.append(day)
+        day += timedelta(days=1)
+
+    if not dirty_days:
+        return 0
+
+    # 一次读出需要重算的日期范围内的全部日汇总
+    seconds_by_day: Dict[date, Dict[int, int]] = defaultdict(dict)
+    for record_date, project_id, seconds in db.query(
+        models.TogglDailyRollup.record_date,
+        models.TogglDailyRollup.project_id,
+        models.TogglDailyRollup.seconds
+    ).filter(
+        models.TogglDailyRollup.user_id == user_id,
+        models.TogglDailyRollup.record_date.between(dirty_days[0], dirty_days[-1])
+    ):
+        seconds_by_day[record_date][project_id] = seconds
+
+    # 全部计划按有效期逐日筛选，不按当前状态筛选
+    plans = db.query(models.PersonalPlan).filter(
+        models.PersonalPlan.user_id == user_id
+    ).all()
+
+    _upsert_daily_status(db, [
+        dict(
+            build_daily_status(plans, seconds_by_day.get(day, {}), day),
+            user_id=user_id, record_date=day, updated_at=started_at
+        )
+        for day in dirty_days
+    ])
+
+    mark_synced(db, user_id, DAILY_STATUS_SOURCE, changed=True)
+    db.commit()
+    return len(dirty_days)
+
+
+def materialize_recent(db: Session, user_id: int, timezone: Optional[str] = None,
+                       days: int = DEFAULT_BACKFILL_DAYS,
+                       changed_days: Optional[Tuple[date, date]] = None) -> int:
+    """物化用户时区下截至今天的最近 days 天"""
+    today = datetime.now(get_timezone(timezone)).date()
+    return materialize_daily_status(db, user_id, today - timedelta(days=days - 1), today, changed_days)
@@ -1,13 +1,52 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from config import settings
 
+# 同步驱动 -> 对应的异步驱动（MySQL 使用 aiomysql，本地 SQLite 使用 aiosqlite）
+ASYNC_DRIVERS = {
+    'mysql': 'mysql+aiomysql',
+    'mysql+pymysql': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+}
+
+
+def get_async_database_url(database_url: str) -> str:
+    """把同步数据库连接串转换为异步驱动的连接串"""
+    url = make_url(database_url)
+    drivername = ASYNC_DRIVERS.get(url.drivername, url.drivername)
+    return url.set(drivername=drivername).render_as_string(hide_password=False)
+
+
+def create_async_database_engine(database_url: str):
+    """创建异步引擎；异步驱动未安装时在启动阶段给出明确的错误"""
+    async_url = get_async_database_url(database_url)
+    try:
+        return create_async_engine(async_url, pool_pre_ping=True)
+    except ImportError as e:
+        raise RuntimeError(
+            f"数据库异步驱动 {make_url(async_url).drivername} 未安装（{e}），"
+            f"请执行 pip install -r requirements.txt"
+        ) from e
+
+
 engine = create_engine(settings.database_url, pool_pre_ping=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 异步引擎，供 async def 接口使用；提交后不过期对象，返回的 ORM 对象在会话关闭后仍可读取
+async_engine = create_async_database_engine(settings.database_url)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    # 会话在第一次执行语句时才从连接池取连接，没有查询的请求不占用连接
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,41 @@
+"""基于数据同步水位的 HTTP 条件请求（ETag / 304）
+
+读接口的结果只取决于用户数据和请求参数。ETag 由接口名、用户ID、请求参数和相关数据源
+的 sync_states.changed_at（get_user_versions，一次索引查询）计算；请求带 If-None-Match
+且与当前 ETag 相同时直接返回 304，不再执行统计查询。
+"""
+import hashlib
+from typing import Dict
+
+from fastapi import Request, Response
+
+# 浏览器可以缓存响应，但每次使用前都要带 If-None-Match 重新验证
+CACHE_CONTROL = 'private, no-cache'
+
+
+def compute_etag(*parts) -> str:
+    """强 ETag：各组成部分（接口名、用户ID、参数、数据版本）的摘要"""
+    digest = hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match 是否包含当前 ETag（按 RFC 9110 使用弱比较）"""
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return etag in {tag.strip().removeprefix('W/') for tag in header.split(',')}
+
+
+def etag_headers(etag: str) -> Dict[str, str]:
+    return {'ETag': etag, 'Cache-Control': CACHE_CONTROL}
+
+
+def set_etag(response: Response, etag: str) -> None:
+    response.headers.update(etag_headers(etag))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=etag_headers(etag))
@@ -0,0 +1,133 @@
+"""GitHub 列表接口的分页客户端
+
+fetch_loader.py 和 api/github.py 共用此模块，因此这里不导入 config / logger
+（两者在导入时会读取环境变量、挂载日志处理器）。
+"""
+import asyncio
+import logging
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+GITHUB_API_URL = "https://api.github.com"
+# /users/{user}/events 最多只能翻到 300 条事件
+EVENTS_MAX_ITEMS = 300
+MAX_PER_PAGE = 100
+DEFAULT_CONCURRENCY = 4
+
+_LINK_PATTERN = re.compile(r'<([^>]+)>;\s*rel="([^"]+)"')
+
+
+def parse_link_header(value: Optional[str]) -> Dict[str, str]:
+    """解析 Link 响应头，返回 {rel: url}"""
+    if not value:
+        return {}
+    return {rel: url for url, rel in _LINK_PATTERN.findall(value)}
+
+
+def last_page_number(link_header: Optional[str]) -> Optional[int]:
+    """从 Link 响应头中取出最后一页的页码，没有分页时返回 None"""
+    last_url = parse_link_header(link_header).get('last')
+    if not last_url:
+        return None
+    page = parse_qs(urlparse(last_url).query).get('page')
+    return int(page[0]) if page else None
+
+
+class GitHubPager:
+    """按 Link 头分页拉取 GitHub 列表接口
+
+    先请求第一页（可带 ETag 做条件请求），从 Link 头得到总页数后，
+    剩余页面在并发上限内同时请求，按到达顺序逐页产出。
+
+    Attributes:
+        etag: 第一页响应的 ETag
+        not_modified: 第一页返回 304 时为 True
+        last_page: 需要拉取的最后一页页码（已按 max_pages 截断）
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        params: Optional[Dict[str, Any]] = None,
+        per_page: int = MAX_PER_PAGE,
+        max_pages: Optional[int] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        etag: Optional[str] = None,
+    ):
+        self.session = session
+        self.url = url
+        self.headers = dict(headers or {})
+        self.params = dict(params or {})
+        self.params['per_page'] = min(per_page, MAX_PER_PAGE)
+        self.max_pages = max_pages
+        self.concurrency = max(1, concurrency)
+        self.request_etag = etag
+        self.etag: Optional[str] = None
+        self.not_modified = False
+        self.last_page = 1
+
+    async def _get_page(self, page: int, headers: Dict[str, str]) -> aiohttp.ClientResponse:
+        params = dict(self.params, page=page)
+        return await self.session.get(self.url, headers=headers, params=params)
+
+    async def first_page(self) -> List[Dict[str, Any]]:
+        """请求第一页；304 时返回空列表并设置 not_modified"""
+        headers = dict(self.headers)
+        if self.request_etag:
+            headers['If-None-Match'] = self.request_etag
+
+        async with await self._get_page(1, headers) as response:
+            if response.status == 304:
+                self.not_modified = True
+                self.etag = self.request_etag
+                return []
+            response.raise_for_status()
+            self.etag = response.headers.get('ETag')
+            last_page = last_page_number(response.headers.get('Link')) or 1
+            if self.max_pages:
+                last_page = min(last_page, self.max_pages)
+            self.last_page = last_page
+            return await response.json()
+
+    async def remaining_pages(self) -> AsyncIterator[List[Dict[str, Any]]]:
+        """并发请求第 2 页到最后一页，按完成顺序产出每页数据"""
+        if self.last_page <= 1:
+            return
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(page: int) -> List[Dict[str, Any]]:
+            async with semaphore:
+                async with await self._get_page(page, self.headers) as response:
+                    response.raise_for_status()
+                    return await response.json()
+
+        tasks = [asyncio.ensure_future(fetch(page)) for page in range(2, self.last_page + 1)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # 调用方提前结束迭代或出错时，取消尚未完成的请求
+            for task in tasks:
+                task.cancel()
+
+    async def fetch_all(self) -> List[Dict[str, Any]]:
+        """拉取全部页面并合并为一个列表"""
+        items = await self.first_page()
+        async for page_items in self.remaining_pages():
+            items.extend(page_items)
+        return items
+
+
+def user_events_url(username: str, api_url: str = GITHUB_API_URL) -> str:
+    return f"{api_url}/users/{username}/events"
+
+
+def user_repos_url(username: str, api_url: str = GITHUB_API_URL) -> str:
+    return f"{api_url}/users/{username}/repos"
@@ -0,0 +1,213 @@
+"""出站 HTTP 连接池
+
+FastAPI 在 lifespan 中启动一个全局连接池，所有访问 GitHub / Toggl 的请求复用同一个
+aiohttp.ClientSession（长连接、按主机限制连接数、默认连接/读取超时）。
+fetch_loader.py 也用同一个类创建自己的连接池，因此这里不导入 config / logger。
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# 每个出站请求结束时调用 callback(host, seconds, ok)，供 metrics.py 统计耗时
+_request_listeners: List[Callable[[str, float, bool], None]] = []
+
+
+def add_request_listener(callback: Callable[[str, float, bool], None]) -> None:
+    _request_listeners.append(callback)
+
+
+def _notify_listeners(host: str, seconds: float, ok: bool) -> None:
+    for callback in _request_listeners:
+        try:
+            callback(host, seconds, ok)
+        except Exception as e:
+            logger.warning(f"出站请求统计回调失败: {e}")
+
+
+class HttpClientPool:
+    """带使用统计的共享 aiohttp 会话
+
+    统计通过 aiohttp 的 TraceConfig 采集：请求数、进行中的请求、失败数、
+    新建/复用的连接数、等待空闲连接的次数，以及按主机汇总的请求耗时。
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        keepalive_timeout: float = 30.0,
+        dns_cache_ttl: int = 300,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._hosts: Dict[str, Dict[str, float]] = defaultdict(lambda: {'requests': 0, 'errors': 0, 'seconds': 0.0})
+
+    async def start(self) -> aiohttp.ClientSession:
+        if self._session is not None and not self._session.closed:
+            return self._session
+        self._connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=self.connect_timeout,
+            sock_read=self.read_timeout,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=self._connector,
+            timeout=timeout,
+            trace_configs=[self._trace_config()],
+        )
+        logger.info(
+            f"HTTP连接池已启动: limit={self.limit}, limit_per_host={self.limit_per_host}, "
+            f"connect_timeout={self.connect_timeout}s, read_timeout={self.read_timeout}s"
+        )
+        return self._session
+
+    async def warm_up(self, urls) -> int:
+        """并发向各地址发一个 HEAD 请求，提前完成 DNS 解析和 TLS 握手，返回成功的个数
+
+        响应状态码不重要（未带认证的请求通常返回 401/404），连接会留在池中复用。
+        """
+        session = await self.start()
+
+        async def head(url):
+            try:
+                async with session.head(url, allow_redirects=False):
+                    return True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"HTTP连接预热失败 {url}: {e}")
+                return False
+
+        results = await asyncio.gather(*(head(url) for url in urls))
+        return sum(results)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("HTTP连接池尚未启动")
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info(f"HTTP连接池已关闭: {self.stats()}")
+        self._session = None
+        self._connector = None
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+        counters = self._counters
+        hosts = self._hosts
+
+        async def on_request_start(session, context, params):
+            context.started = time.perf_counter()
+            context.host = urlparse(str(params.url)).netloc
+            counters['requests'] += 1
+            counters['in_flight'] += 1
+
+        async def on_request_end(session, context, params):
+            counters['in_flight'] -= 1
+            seconds = time.perf_counter() - context.started
+            host = hosts[context.host]
+            host['requests'] += 1
+            host['seconds'] += seconds
+            _notify_listeners(context.host, seconds, True)
+
+        async def on_request_exception(session, context, params):
+            counters['in_flight'] -= 1
+            counters['errors'] += 1
+            seconds = time.perf_counter() - context.started
+            host = hosts[context.host]
+            host['errors'] += 1
+            host['seconds'] += seconds
+            _notify_listeners(context.host, seconds, False)
+
+        async def on_connection_create_end(session, context, params):
+            counters['connections_created'] += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            counters['connections_reused'] += 1
+
+        async def on_connection_queued_start(session, context, params):
+            counters['connections_queued'] += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_connection_queued_start.append(on_connection_queued_start)
+        return trace_config
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池使用情况快照"""
+        acquired = len(getattr(self._connector, '_acquired', ()) or ()) if self._connector else 0
+        return {
+            'limit': self.limit,
+            'limit_per_host': self.limit_per_host,
+            'connections_in_use': acquired,
+            'requests': self._counters['requests'],
+            'in_flight': self._counters['in_flight'],
+            'errors': self._counters['errors'],
+            'connections_created': self._counters['connections_created'],
+            'connections_reused': self._counters['connections_reused'],
+            'connections_queued': self._counters['connections_queued'],
+            'hosts': {
+                host: {
+                    'requests': int(values['requests']),
+                    'errors': int(values['errors']),
+                    'seconds': round(values['seconds'], 4),
+                }
+                for host, values in self._hosts.items()
+            },
+        }
+
+
+# 应用级连接池，由 main.py 的 lifespan 启动和关闭
+_pool: Optional[HttpClientPool] = None
+
+
+async def start_http_pool(**options) -> HttpClientPool:
+    global _pool
+    if _pool is None:
+        _pool = HttpClientPool(**options)
+    await _pool.start()
+    return _pool
+
+
+async def close_http_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """获取共享会话；未经 lifespan 启动时（如脚本中直接调用）按默认参数启动"""
+    if _pool is None:
+        await start_http_pool()
+    return await _pool.start()
+
+
+def get_http_pool() -> Optional[HttpClientPool]:
+    return _pool
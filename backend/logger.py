@@ -1,37 +1,184 @@
+"""应用日志
+
+根日志记录器只挂一个 QueueHandler：记录在调用线程中整理好（合并参数、格式化异常）后
+放入有界队列，由后台 QueueListener 线程写文件和控制台，请求处理中不会等待磁盘 I/O。
+队列满时直接丢弃并计数，不会阻塞调用方。
+
+导入本模块没有副作用，也不读取 config；由进程入口（main.py）调用 setup_logging 并传入
+日志配置（见 config.py 的 log_* 配置项）：
+- json_format：每行输出一个 JSON 对象，便于日志系统采集
+- sample_rates：按日志记录器名称（含子记录器）对 WARNING 以下的记录抽样，如 {"api.toggl": 0.1}
+- rate_limits：按日志记录器名称限制每秒写入的 WARNING 以下记录数，如 {"api.github": 20}
+"""
+import atexit
+import json
 import logging
+import queue
+import random
 import sys
-from logging.handlers import RotatingFileHandler
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+from typing import Dict, Optional
+
+# 记录丢弃的原因 -> 次数，由 metrics.py 导出
+_counters_lock = threading.Lock()
+_counters: Dict[str, int] = {'dropped': 0, 'sampled': 0, 'rate_limited': 0}
+
+
+def _count(reason: str) -> None:
+    with _counters_lock:
+        _counters[reason] += 1
+
+
+def get_log_stats() -> Dict[str, int]:
+    """被丢弃的日志记录数（队列已满 / 抽样 / 限流）以及当前队列长度"""
+    with _counters_lock:
+        stats = dict(_counters)
+    stats['queued'] = log_queue.qsize() if log_queue is not None else 0
+    return stats
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = record.stack_info
+        return json.dumps(data, ensure_ascii=False)
+
+
+class ThrottleFilter(logging.Filter):
+    """按日志记录器名称对 WARNING 以下的记录抽样和限流（在调用线程中执行）"""
+
+    def __init__(self, sample_rates: Dict[str, float], rate_limits: Dict[str, int]):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.rate_limits = rate_limits
+        self._lock = threading.Lock()
+        # 日志记录器名称 -> [当前秒, 本秒已写入数]
+        self._windows: Dict[str, list] = {}
+
+    @staticmethod
+    def _match(name: str, rules: Dict) -> str:
+        """返回最具体的匹配规则名，如 api.toggl 匹配 api.toggl 和 api"""
+        while name:
+            if name in rules:
+                return name
+            name = name.rpartition('.')[0]
+        return ''
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        rule = self._match(record.name, self.sample_rates)
+        if rule and random.random() >= self.sample_rates[rule]:
+            _count('sampled')
+            return False
+
+        rule = self._match(record.name, self.rate_limits)
+        if rule:
+            second = int(time.monotonic())
+            with self._lock:
+                window = self._windows.get(rule)
+                if window is None or window[0] != second:
+                    window = self._windows[rule] = [second, 0]
+                window[1] += 1
+                allowed = window[1] <= self.rate_limits[rule]
+            if not allowed:
+                _count('rate_limited')
+                return False
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """队列满时丢弃记录并计数，不阻塞也不打印错误"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 在调用线程中合并参数、格式化异常，写入线程不再访问调用方的对象；
+        # 用 makeLogRecord 复制而不是 copy.copy，解释器退出阶段也能正常记录
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _count('dropped')
+
+
+_exception_formatter = logging.Formatter()
+
+# setup_logging 创建的队列和监听线程
+log_queue: Optional[queue.Queue] = None
+log_listener: Optional[QueueListener] = None
+
+
+def setup_logging(level: str = 'INFO', json_format: bool = False, queue_size: int = 10000,
+                  sample_rates: Optional[Dict[str, float]] = None,
+                  rate_limits: Optional[Dict[str, int]] = None,
+                  log_dir: Path = Path("logs")) -> None:
+    """配置根日志记录器：文件和控制台写入都在后台监听线程中进行（重复调用时只生效一次）"""
+    global log_queue, log_listener
+    if log_listener is not None:
+        return
+
+    # 创建logs目录（如果不存在）
+    log_dir.mkdir(exist_ok=True)
+
+    # 创建格式化器
+    if json_format:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
+
+    # 创建文件处理器
+    file_handler = RotatingFileHandler(
+        log_dir / "app.log",
+        maxBytes=10*1024*1024,  # 10MB
+        backupCount=5,
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(formatter)
+
+    # 创建控制台处理器
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(ThrottleFilter(sample_rates or {}, rate_limits or {}))
+    log_listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    log_listener.start()
+    # 进程退出前写完队列中剩余的记录
+    atexit.register(log_listener.stop)
+
+    # 配置根日志记录器
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level.upper())
+    root_logger.addHandler(queue_handler)
 
-# 创建logs目录（如果不存在）
-log_dir = Path("logs")
-log_dir.mkdir(exist_ok=True)
-
-# 创建格式化器
-formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-
-# 创建文件处理器
-file_handler = RotatingFileHandler(
-    log_dir / "app.log",
-    maxBytes=10*1024*1024,  # 10MB
-    backupCount=5,
-    encoding='utf-8'
-)
-file_handler.setFormatter(formatter)
-
-# 创建控制台处理器
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setFormatter(formatter)
-
-# 配置根日志记录器
-root_logger = logging.getLogger()
-root_logger.setLevel(logging.INFO)
-root_logger.addHandler(file_handler)
-root_logger.addHandler(console_handler)
 
 # 创建应用日志记录器
 def get_logger(name: str) -> logging.Logger:
     logger = logging.getLogger(name)
-    return logger 
\ No newline at end of file
+    return logger
@@ -1,18 +1,149 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+import asyncio
+import secrets
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy import select, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 import models
 import schemas
 import auth
-from auth import decrypt_password
-from database import engine, get_db
+import cache
+import http_client
+import metrics
+import migrations
+from config import settings
+from database import async_engine, engine, get_async_db
 from api import users, plans, github, toggl, stats
-from logger import get_logger
+from logger import get_logger, setup_logging
 
+# 日志配置在进程入口传入，logger.py 本身不读取 config
+setup_logging(
+    level=settings.log_level,
+    json_format=settings.log_json,
+    queue_size=settings.log_queue_size,
+    sample_rates=settings.log_sample_rates,
+    rate_limits=settings.log_rate_limits,
+)
 logger = get_logger(__name__)
 
-app = FastAPI(title="DataSync API")
+
+@contextmanager
+def startup_phase(timings: dict, name: str):
+    """记录启动阶段耗时（毫秒）"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+
+async def prepare_schema():
+    """默认只查询一次结构版本；开启 auto_create_tables 时建表并执行迁移（会阻塞启动）"""
+    if settings.auto_create_tables:
+        applied = await asyncio.to_thread(migrations.ensure_schema, engine)
+        logger.info(f"数据库表已创建，执行了 {applied} 个迁移")
+        return
+
+    try:
+        async with async_engine.connect() as conn:
+            version = (await conn.execute(migrations.schema_version_query())).scalar() or 0
+    except SQLAlchemyError as e:
+        # 数据库暂时不可用时照常启动，连接池会在恢复后重连
+        logger.warning(f"无法检查数据库结构版本: {e}")
+        return
+    if version < migrations.latest_version():
+        logger.warning(
+            f"数据库结构版本 {version} 低于代码要求的 {migrations.latest_version()}，"
+            f"请执行 python migrations.py"
+        )
+
+
+def warm_up_sync_pool(count: int) -> int:
+    """同步引擎预先建立 count 个连接，放回连接池供 def 接口复用"""
+    connections = []
+    try:
+        for _ in range(count):
+            connection = engine.connect()
+            connections.append(connection)
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+
+async def warm_up_async_pool(count: int) -> int:
+    """异步引擎并发建立 count 个连接，放回连接池供 async 接口复用"""
+    async def open_connection():
+        connection = await async_engine.connect()
+        await connection.execute(text("SELECT 1"))
+        return connection
+
+    results = await asyncio.gather(*(open_connection() for _ in range(count)), return_exceptions=True)
+    connections = [result for result in results if not isinstance(result, BaseException)]
+    for connection in connections:
+        await connection.close()
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        raise errors[0]
+    return len(connections)
+
+
+async def warm_up_database(count: int):
+    if count <= 0:
+        return
+    try:
+        sync_count, async_count = await asyncio.gather(
+            asyncio.to_thread(warm_up_sync_pool, count),
+            warm_up_async_pool(count)
+        )
+        logger.info(f"数据库连接已预热: 同步 {sync_count} 个，异步 {async_count} 个")
+    except (SQLAlchemyError, OSError) as e:
+        logger.warning(f"数据库连接预热失败: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    timings = {}
+    started = time.perf_counter()
+    # 启动时解码一次密码解密密钥，配置错误时尽早失败
+    with startup_phase(timings, 'encryption_key'):
+        auth.get_encryption_key()
+    with startup_phase(timings, 'schema'):
+        await prepare_schema()
+    with startup_phase(timings, 'db_pool'):
+        await warm_up_database(settings.db_warmup_connections)
+    # 启动全局出站HTTP连接池，所有GitHub/Toggl请求复用
+    with startup_phase(timings, 'http_pool'):
+        pool = await http_client.start_http_pool(
+            limit=settings.http_pool_limit,
+            limit_per_host=settings.http_pool_limit_per_host,
+            connect_timeout=settings.http_connect_timeout,
+            read_timeout=settings.http_read_timeout,
+            keepalive_timeout=settings.http_keepalive_timeout
+        )
+    # 出站连接预热在后台进行，不阻塞启动
+    http_warmup = None
+    if settings.http_warmup:
+        http_warmup = asyncio.create_task(pool.warm_up([settings.github_api_url, settings.toggl_api_url]))
+    timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+    app.state.startup_timings = timings
+    metrics.set_startup_timings(timings)
+    logger.info("启动完成: " + ", ".join(f"{name}={ms}ms" for name, ms in timings.items()))
+    yield
+    if http_warmup is not None and not http_warmup.done():
+        http_warmup.cancel()
+    await http_client.close_http_pool()
+    auth.shutdown_login_executor()
+    await async_engine.dispose()
+
+
+app = FastAPI(title="DataSync API", lifespan=lifespan)
 
 # CORS配置
 app.add_middleware(
@@ -23,9 +154,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 创建数据库表
-models.Base.metadata.create_all(bind=engine)
-logger.info("Database tables created successfully")
+# 请求指标：按路由统计延迟、SQL 条数与耗时、出站HTTP耗时，并记录慢请求
+if settings.metrics_enabled:
+    app.add_middleware(
+        metrics.MetricsMiddleware,
+        slow_request_ms=settings.slow_request_ms,
+        slow_request_top_queries=settings.slow_request_top_queries
+    )
+    metrics.instrument_engine(engine, 'sync')
+    metrics.instrument_engine(async_engine.sync_engine, 'async')
+    metrics.register_cache('auth_token', auth.token_cache)
+    metrics.register_cache('dashboard', cache.dashboard_cache)
 
 # 注册路由
 app.include_router(users.router, prefix="/api/users", tags=["users"])
@@ -36,13 +175,42 @@ app.include_router(stats.router, prefix="/api/stats", tags=["stats"])
 logger.info("All routes registered successfully")
 
 
+# 未配置 metrics_token 时允许访问 /metrics 的客户端地址
+LOCAL_HOSTS = {'127.0.0.1', '::1', 'localhost'}
+
+
+def verify_metrics_access(request: Request) -> None:
+    """/metrics 含认证缓存等内部统计：配置了 metrics_token 时校验令牌，否则只允许本机访问"""
+    if settings.metrics_token:
+        scheme, _, token = request.headers.get('authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and secrets.compare_digest(token, settings.metrics_token):
+            return
+    elif request.client and request.client.host in LOCAL_HOSTS:
+        return
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to read metrics")
+
+
+if settings.metrics_enabled:
+    @app.get("/metrics", include_in_schema=False, dependencies=[Depends(verify_metrics_access)])
+    async def read_metrics():
+        """Prometheus 格式的请求、SQL、出站HTTP和缓存指标"""
+        return Response(metrics.render_metrics(), media_type=metrics.CONTENT_TYPE)
+
+
+def check_password(encrypted_password: str, hashed_password: str) -> bool:
+    """解密前端加密的密码并校验（bcrypt，阻塞，在登录线程池中执行）"""
+    return auth.verify_password(auth.decrypt_password(encrypted_password), hashed_password)
+
+
 # 认证路由
 @app.post("/api/token", response_model=schemas.Token)
-async def login(form_data: schemas.UserLogin, db: Session = Depends(get_db)):
+async def login(form_data: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
     logger.info("userinfo successfully")
 
-    user = auth.authenticate_user(db, form_data.username, decrypt_password(form_data.password))
-    if not user:
+    user = (await db.execute(
+        select(models.User).where(models.User.username == form_data.username)
+    )).scalars().first()
+    if not user or not await auth.run_login_task(check_password, form_data.password, user.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -51,7 +219,7 @@ async def login(form_data: schemas.UserLogin, db: Session = Depends(get_db)):
 
     # 更新最后登录时间
     user.last_login_time = datetime.now()
-    db.commit()
+    await db.commit()
 
     access_token_expires = timedelta(minutes=30)
     access_token = auth.create_access_token(
@@ -0,0 +1,392 @@
+"""请求级性能指标
+
+MetricsMiddleware 为每个请求记录按路由模板汇总的延迟、SQL 条数和 SQL 耗时，
+instrument_engine 通过 SQLAlchemy 的游标事件把每条 SQL 计入当前请求（用 contextvars
+跟踪，同步接口的线程池和异步会话的 greenlet 中都能取到），http_client 的请求回调
+把访问 GitHub / Toggl 的耗时计入按主机的直方图。render_metrics 输出 Prometheus
+文本格式，由 main.py 的 /metrics 接口返回。
+
+超过 slow_request_ms 的请求写一条慢请求日志，列出该请求中总耗时最高的几条 SQL
+（相同语句合并计数），循环里逐条查询（N+1）会表现为同一语句执行了很多次。
+"""
+import re
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import http_client
+from logger import get_log_stats, get_logger
+
+logger = get_logger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+# 慢请求日志中每条 SQL 最多保留的字符数
+STATEMENT_PREVIEW_LENGTH = 300
+# 未匹配到路由的请求统一记到这个标签下，避免任意路径撑大指标数量
+UNMATCHED_ROUTE = 'unmatched'
+
+
+class Histogram:
+    """按标签分组的累积直方图"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets: Iterable[float]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # 标签值 -> [各桶计数..., 总和, 样本数]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            base = list(zip(self.label_names, labels))
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_labels(base + [('le', _number(bound))])} {int(count)}")
+            lines.append(f"{self.name}_bucket{_labels(base + [('le', '+Inf')])} {int(series[-1])}")
+            lines.append(f"{self.name}_sum{_labels(base)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(base)} {int(series[-1])}")
+        return lines
+
+
+class Counter:
+    """按标签分组的计数器"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_labels(list(zip(self.label_names, labels)))} {_number(value)}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs: List[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _gauge(name: str, help_text: str, samples: Iterable[Tuple[List[Tuple[str, str]], float]]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    lines.extend(f"{name}{_labels(pairs)} {_number(value)}" for pairs, value in samples)
+    return lines
+
+
+class RequestStats:
+    """单个请求内执行的 SQL 和出站 HTTP 请求"""
+
+    def __init__(self):
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.http_count = 0
+        self.http_seconds = 0.0
+        self.serialize_seconds = 0.0
+        # 语句 -> [执行次数, 总耗时]
+        self.statements: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def record_query(self, statement: str, seconds: float) -> None:
+        with self._lock:
+            self.query_count += 1
+            self.query_seconds += seconds
+            entry = self.statements.get(statement)
+            if entry is None:
+                self.statements[statement] = [1, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+
+    def record_http(self, seconds: float) -> None:
+        with self._lock:
+            self.http_count += 1
+            self.http_seconds += seconds
+
+    def server_timing(self) -> str:
+        """Server-Timing 响应头中的 SQL 与出站HTTP耗时"""
+        with self._lock:
+            return (
+                f'db;dur={self.query_seconds * 1000:.2f};desc="{self.query_count} queries", '
+                f'http;dur={self.http_seconds * 1000:.2f};desc="{self.http_count} requests"'
+            )
+
+    def top_statements(self, limit: int) -> List[Tuple[str, int, float]]:
+        """按总耗时排序的前 limit 条语句 (语句, 次数, 总耗时)"""
+        with self._lock:
+            items = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return [(statement, int(count), seconds) for statement, (count, seconds) in items]
+
+
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar('metrics_request', default=None)
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', '接口响应耗时（到响应体发送完毕，不含后台任务）',
+    ('method', 'route'), LATENCY_BUCKETS
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', '单个请求执行的 SQL 条数', ('method', 'route'), QUERY_COUNT_BUCKETS
+)
+REQUEST_DB_DURATION = Histogram(
+    'http_request_db_duration_seconds', '单个请求内 SQL 的总耗时', ('method', 'route'), LATENCY_BUCKETS
+)
+REQUEST_SERIALIZE_DURATION = Histogram(
+    'http_response_serialize_duration_seconds', '快速序列化路径的响应编码耗时', ('method', 'route'), LATENCY_BUCKETS
+)
+REQUESTS_TOTAL = Counter('http_requests_total', '按状态码统计的请求数', ('method', 'route', 'status'))
+SLOW_REQUESTS_TOTAL = Counter('http_slow_requests_total', '超过慢请求阈值的请求数', ('method', 'route'))
+DB_QUERY_DURATION = Histogram('db_query_duration_seconds', '每条 SQL 的执行耗时', ('engine',), LATENCY_BUCKETS)
+DB_QUERY_ERRORS = Counter('db_query_errors_total', '执行失败的 SQL 条数', ('engine',))
+OUTBOUND_DURATION = Histogram(
+    'http_client_request_duration_seconds', '出站 HTTP 请求耗时（GitHub / Toggl）', ('host', 'outcome'),
+    LATENCY_BUCKETS
+)
+
+_in_flight_lock = threading.Lock()
+_in_flight = 0
+# 名称 -> 提供 stats() 的缓存（cache.TTLCache）
+_caches: Dict[str, Any] = {}
+# 启动阶段 -> 耗时（毫秒），由 main.py 的 lifespan 设置
+_startup_timings: Dict[str, float] = {}
+
+
+def register_cache(name: str, cache: Any) -> None:
+    """导出缓存的命中、未命中、淘汰次数和当前大小"""
+    _caches[name] = cache
+
+
+def set_startup_timings(timings: Dict[str, float]) -> None:
+    _startup_timings.clear()
+    _startup_timings.update(timings)
+
+
+def record_serialization(seconds: float) -> None:
+    """把响应序列化耗时计入当前请求（serialization.json_response 调用）"""
+    stats = _current_request.get()
+    if stats is not None:
+        stats.serialize_seconds += seconds
+
+
+def _record_outbound(host: str, seconds: float, ok: bool) -> None:
+    OUTBOUND_DURATION.observe((host, 'ok' if ok else 'error'), seconds)
+    stats = _current_request.get()
+    if stats is not None:
+        stats.record_http(seconds)
+
+
+http_client.add_request_listener(_record_outbound)
+
+
+def instrument_engine(engine: Engine, name: str) -> None:
+    """在引擎上注册游标事件；异步引擎传入 async_engine.sync_engine"""
+    if getattr(engine, '_metrics_instrumented', False):
+        return
+    engine._metrics_instrumented = True
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['metrics_query_started'].pop()
+        DB_QUERY_DURATION.observe((name,), seconds)
+        stats = _current_request.get()
+        if stats is not None:
+            stats.record_query(statement, seconds)
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get('metrics_query_started'):
+            conn.info['metrics_query_started'].pop()
+        DB_QUERY_ERRORS.inc((name,))
+
+
+def _route_template(scope: Dict[str, Any]) -> str:
+    """路由模板，如 /api/plans/{plan_id}
+
+    子路由挂载后 scope['route'].path 不含前缀，这里用实际路径把路径参数换回参数名。
+    """
+    if scope.get('route') is None:
+        return UNMATCHED_ROUTE
+    path_params = scope.get('path_params') or {}
+    if not path_params:
+        return scope.get('path', '')
+    names = {str(value): name for name, value in path_params.items()}
+    return '/'.join(f"{{{names[part]}}}" if part in names else part for part in scope.get('path', '').split('/'))
+
+
+def _preview(statement: str) -> str:
+    statement = re.sub(r'\s+', ' ', statement).strip()
+    if len(statement) > STATEMENT_PREVIEW_LENGTH:
+        return statement[:STATEMENT_PREVIEW_LENGTH] + '...'
+    return statement
+
+
+class MetricsMiddleware:
+    """记录每个请求的耗时、SQL 条数和耗时，并写慢请求日志
+
+    耗时截止到响应体发送完毕，之后执行的后台任务（BackgroundTasks）不计入。
+    """
+
+    def __init__(self, app: Callable, slow_request_ms: float = 1000, slow_request_top_queries: int = 5):
+        self.app = app
+        self.slow_request_seconds = slow_request_ms / 1000
+        self.slow_request_top_queries = slow_request_top_queries
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        global _in_flight
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        started = time.perf_counter()
+        status_code = 500
+        finished = False
+
+        def finish():
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            self._observe(scope, status_code, time.perf_counter() - started, stats)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                message = self._add_server_timing(message, stats)
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                finish()
+
+        with _in_flight_lock:
+            _in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finish()
+            with _in_flight_lock:
+                _in_flight -= 1
+            _current_request.reset(token)
+
+    @staticmethod
+    def _add_server_timing(message, stats: RequestStats):
+        """在接口已有的 Server-Timing（如序列化耗时）后追加 SQL 和出站HTTP耗时"""
+        headers = list(message.get('headers', []))
+        timing = stats.server_timing().encode('latin-1')
+        for i, (name, value) in enumerate(headers):
+            if name.lower() == b'server-timing':
+                headers[i] = (name, value + b', ' + timing)
+                break
+        else:
+            headers.append((b'server-timing', timing))
+        return dict(message, headers=headers)
+
+    def _observe(self, scope, status_code: int, seconds: float, stats: RequestStats) -> None:
+        method = scope.get('method', '')
+        route = _route_template(scope)
+        labels = (method, route)
+        REQUEST_DURATION.observe(labels, seconds)
+        REQUEST_QUERIES.observe(labels, stats.query_count)
+        REQUEST_DB_DURATION.observe(labels, stats.query_seconds)
+        if stats.serialize_seconds:
+            REQUEST_SERIALIZE_DURATION.observe(labels, stats.serialize_seconds)
+        REQUESTS_TOTAL.inc((method, route, str(status_code)))
+
+        if seconds < self.slow_request_seconds:
+            return
+        SLOW_REQUESTS_TOTAL.inc(labels)
+        top = '\n'.join(
+            f"  {count} 次 {total * 1000:.1f}ms: {_preview(statement)}"
+            for statement, count, total in stats.top_statements(self.slow_request_top_queries)
+        )
+        logger.warning(
+            f"慢请求 {method} {scope.get('path', '')} ({route}) {status_code} 耗时 {seconds * 1000:.1f}ms，"
+            f"SQL {stats.query_count} 条共 {stats.query_seconds * 1000:.1f}ms，"
+            f"出站HTTP {stats.http_count} 次共 {stats.http_seconds * 1000:.1f}ms"
+            + (f"\n耗时最高的SQL:\n{top}" if top else '')
+        )
+
+
+def render_metrics() -> str:
+    """Prometheus 文本格式的全部指标"""
+    lines: List[str] = []
+    for metric in (REQUEST_DURATION, REQUEST_QUERIES, REQUEST_DB_DURATION, REQUEST_SERIALIZE_DURATION, REQUESTS_TOTAL,
+                   SLOW_REQUESTS_TOTAL, DB_QUERY_DURATION, DB_QUERY_ERRORS, OUTBOUND_DURATION):
+        lines.extend(metric.render())
+    lines.extend(_gauge('http_requests_in_flight', '正在处理的请求数', [([], _in_flight)]))
+    lines.extend(_gauge('app_startup_phase_seconds', '最近一次启动各阶段的耗时',
+                        [([('phase', phase)], ms / 1000) for phase, ms in _startup_timings.items()]))
+
+    pool = http_client.get_http_pool()
+    if pool is not None:
+        pool_stats = pool.stats()
+        lines.extend(_gauge('http_client_connections_in_use', '出站连接池中正在使用的连接数',
+                            [([], pool_stats['connections_in_use'])]))
+        lines.extend(_gauge('http_client_requests_in_flight', '进行中的出站请求数', [([], pool_stats['in_flight'])]))
+        for key, help_text in (
+            ('connections_created', '出站连接池新建的连接数'),
+            ('connections_reused', '出站连接池复用连接的次数'),
+            ('connections_queued', '等待空闲出站连接的次数'),
+        ):
+            name = f"http_client_{key}_total"
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {pool_stats[key]}"])
+
+    log_stats = get_log_stats()
+    lines.extend(_gauge('log_queue_size', '等待写入的日志记录数', [([], log_stats['queued'])]))
+    lines.extend(['# HELP log_records_discarded_total 未写入的日志记录数（队列已满 / 抽样 / 限流）',
+                  '# TYPE log_records_discarded_total counter'])
+    lines.extend(f"log_records_discarded_total{_labels([('reason', reason)])} {log_stats[reason]}"
+                 for reason in ('dropped', 'sampled', 'rate_limited'))
+
+    if _caches:
+        cache_stats = {name: cache.stats() for name, cache in sorted(_caches.items())}
+        lines.extend(_gauge('cache_entries', '缓存当前条目数',
+                            [([('cache', name)], stats['size']) for name, stats in cache_stats.items()]))
+        for key in ('hits', 'misses', 'evictions'):
+            name = f"cache_{key}_total"
+            lines.extend([f"# HELP {name} 缓存 {key} 次数", f"# TYPE {name} counter"])
+            lines.extend(f"{name}{_labels([('cache', cache)])} {stats[key]}" for cache, stats in cache_stats.items())
+    return '\n'.join(lines) + '\n'
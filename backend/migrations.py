@@ -0,0 +1,313 @@
+"""数据库结构版本迁移
+
+schema_version 表记录已执行的迁移版本。run_migrations 按版本号顺序执行尚未执行的
+迁移，每个迁移都可重复执行（已存在的索引会跳过、回填只处理空值），中途失败后重跑即可。
+fetch_loader.py / replay_loader.py 启动时调用 ensure_schema（先建表再迁移），因此这里
+不导入 config / logger。
+
+API 进程启动时默认不执行 DDL，只用 schema_version_query 检查版本；部署时先手动执行：
+    python migrations.py                       # 建表（已存在的跳过）并执行全部待执行的迁移
+    python migrations.py --partition-github-events [--months-ahead 12]
+"""
+import logging
+from datetime import date
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import func, inspect, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import models
+from toggl_dimensions import DIMENSIONS, save_dimensions, transform_dimensions
+
+logger = logging.getLogger(__name__)
+
+# 回填时每个事务处理的主键区间大小
+BACKFILL_BATCH_SIZE = 10000
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[Engine], None]
+
+
+def _create_model_index(engine: Engine, model, name: str) -> None:
+    """按模型中的定义创建索引，已存在时跳过"""
+    table = model.__table__
+    existing = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+    if name in existing:
+        return
+    index = next(index for index in table.indexes if index.name == name)
+    index.create(engine)
+    logger.info(f"已创建索引 {table.name}.{name}")
+
+
+def _index_names(engine: Engine, table_name: str) -> set:
+    """表上已有的索引与唯一约束名（SQLite 中模型的唯一约束只出现在后者）"""
+    inspector = inspect(engine)
+    names = {index['name'] for index in inspector.get_indexes(table_name)}
+    names.update(constraint['name'] for constraint in inspector.get_unique_constraints(table_name))
+    return names
+
+
+def _drop_index(engine: Engine, table_name: str, name: str) -> None:
+    statement = f"DROP INDEX {name}"
+    if engine.dialect.name == 'mysql':
+        statement += f" ON {table_name}"
+    with engine.begin() as conn:
+        conn.execute(text(statement))
+    logger.info(f"已删除索引 {table_name}.{name}")
+
+
+def _delete_duplicates(engine: Engine, table_name: str, columns: List[str], keep: str) -> int:
+    """删除 columns 相同的重复行，keep 为 'min' 时保留 id 最小的一行，'max' 时保留最大的
+
+    columns 中有空值的行不算重复（唯一键也允许多个空值）。
+    """
+    op = '>' if keep == 'min' else '<'
+    on = " AND ".join(f"t1.{column} = t2.{column}" for column in columns)
+    if engine.dialect.name == 'mysql':
+        # MySQL 不允许在 DELETE 的子查询中引用被删除的表，改用多表 DELETE
+        statement = f"DELETE t1 FROM {table_name} t1 JOIN {table_name} t2 ON {on} AND t1.id {op} t2.id"
+    else:
+        statement = (
+            f"DELETE FROM {table_name} WHERE EXISTS ("
+            f"SELECT 1 FROM {table_name} t2 WHERE "
+            + " AND ".join(f"t2.{column} = {table_name}.{column}" for column in columns)
+            + f" AND {table_name}.id {op} t2.id)"
+        )
+    with engine.begin() as conn:
+        return conn.execute(text(statement)).rowcount
+
+
+def add_time_range_indexes(engine: Engine) -> None:
+    """github_events (user_id, event_time, event_type) 与 toggl_datas (user_id, update_time)"""
+    _create_model_index(engine, models.GitHubEvents, 'idx_user_event_time')
+    _create_model_index(engine, models.TogglData, 'idx_user_update_time')
+
+
+def backfill_github_event_date(engine: Engine) -> None:
+    """把 event_date 改为普通 DATE 列，并按事件时间回填空值
+
+    create.sql 中 event_date 是 DATE(event_time) 生成列，create_all 建出的则是从未
+    写入的 DATETIME 列；两种情况都改为普通 DATE 列，之后由入库程序写入。
+    """
+    if engine.dialect.name == 'mysql':
+        with engine.begin() as conn:
+            conn.execute(text(
+                "ALTER TABLE github_events MODIFY event_date DATE NULL "
+                "COMMENT '事件日期（入库时按事件时间写入，可作为分区字段）'"
+            ))
+
+    table = models.GitHubEvents.__table__
+    with engine.connect() as conn:
+        min_id, max_id = conn.execute(select(func.min(table.c.id), func.max(table.c.id))).one()
+    if min_id is None:
+        return
+
+    filled = 0
+    for low in range(min_id, max_id + 1, BACKFILL_BATCH_SIZE):
+        with engine.begin() as conn:
+            filled += conn.execute(
+                update(table).where(
+                    table.c.id >= low,
+                    table.c.id < low + BACKFILL_BATCH_SIZE,
+                    table.c.event_date.is_(None)
+                ).values(event_date=func.date(table.c.event_time))
+            ).rowcount
+    logger.info(f"github_events.event_date 回填 {filled} 行")
+
+
+def create_toggl_dimensions(engine: Engine) -> None:
+    """创建 Toggl 项目/标签/客户/工作区维度表，并用每个用户最新的快照填充"""
+    for dimension in DIMENSIONS.values():
+        dimension.model.__table__.create(engine, checkfirst=True)
+
+    snapshots = models.TogglData.__table__
+    latest_ids = select(func.max(snapshots.c.id)).group_by(snapshots.c.user_id)
+    with engine.connect() as conn:
+        rows = conn.execute(select(
+            snapshots.c.user_id, snapshots.c.project_list, snapshots.c.tag_list,
+            snapshots.c.clients, snapshots.c.workspace_list
+        ).where(snapshots.c.id.in_(latest_ids))).all()
+
+    for row in rows:
+        dimensions = transform_dimensions({
+            'projects': row.project_list,
+            'tags': row.tag_list,
+            'clients': row.clients,
+            'workspaces': row.workspace_list,
+        })
+        with Session(engine) as db:
+            written = save_dimensions(db, row.user_id, dimensions)
+        logger.info(f"用户 {row.user_id} 的Toggl维度表已填充: {written}")
+
+
+def add_plan_ended_at(engine: Engine) -> None:
+    """personal_plans 增加 ended_at，已结束的计划按最后更新时间回填"""
+    columns = {column['name'] for column in inspect(engine).get_columns('personal_plans')}
+    if 'ended_at' not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE personal_plans ADD COLUMN ended_at DATETIME NULL"))
+
+    table = models.PersonalPlan.__table__
+    with engine.begin() as conn:
+        filled = conn.execute(
+            update(table).where(
+                table.c.plan_status != 2,
+                table.c.ended_at.is_(None)
+            ).values(
+                ended_at=table.c.update_time,
+                # 保持 update_time 不变，否则 onupdate 会把它改为当前时间
+                update_time=table.c.update_time
+            )
+        ).rowcount
+    logger.info(f"personal_plans.ended_at 回填 {filled} 行")
+
+
+def add_github_event_unique_key(engine: Engine) -> None:
+    """github_events 增加 event_id，删除重复事件（保留最早入库的一行）后加唯一键 udx_user_event
+
+    旧数据没有事件ID可回填，event_id 保持空值，不参与去重。
+    """
+    columns = {column['name'] for column in inspect(engine).get_columns('github_events')}
+    if 'event_id' not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE github_events ADD COLUMN event_id BIGINT NULL"))
+
+    if 'udx_user_event' in _index_names(engine, 'github_events'):
+        return
+    deleted = _delete_duplicates(engine, 'github_events', ['user_id', 'event_id'], keep='min')
+    logger.info(f"github_events 删除重复事件 {deleted} 行")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE UNIQUE INDEX udx_user_event ON github_events (user_id, event_id)"))
+    logger.info("已创建唯一键 github_events.udx_user_event")
+
+
+def add_github_repo_unique_key(engine: Engine) -> None:
+    """github_repos 删除重复仓库（保留最后写入的一行），(user_id, github_id) 改为唯一键 udx_user_repo"""
+    existing = _index_names(engine, 'github_repos')
+    if 'udx_user_repo' not in existing:
+        deleted = _delete_duplicates(engine, 'github_repos', ['user_id', 'github_id'], keep='max')
+        logger.info(f"github_repos 删除重复仓库 {deleted} 行")
+        with engine.begin() as conn:
+            conn.execute(text("CREATE UNIQUE INDEX udx_user_repo ON github_repos (user_id, github_id)"))
+        logger.info("已创建唯一键 github_repos.udx_user_repo")
+    # 先建唯一键再删旧索引，MySQL 中 user_id 外键始终有可用的索引
+    if 'idx_user_repo' in existing:
+        _drop_index(engine, 'github_repos', 'idx_user_repo')
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, 'github_events / toggl_datas 时间范围复合索引', add_time_range_indexes),
+    Migration(2, 'github_events.event_date 改为入库时写入并回填', backfill_github_event_date),
+    Migration(3, 'Toggl 项目/标签/客户/工作区维度表', create_toggl_dimensions),
+    Migration(4, 'personal_plans.ended_at 计划结束时间', add_plan_ended_at),
+    Migration(5, 'github_events.event_id 与 (user_id, event_id) 唯一键', add_github_event_unique_key),
+    Migration(6, 'github_repos (user_id, github_id) 改为唯一键', add_github_repo_unique_key),
+]
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1].version
+
+
+def schema_version_query():
+    """读取当前结构版本的查询，API 启动检查只执行这一条"""
+    return select(func.max(models.SchemaVersion.version))
+
+
+def current_version(engine: Engine) -> int:
+    models.SchemaVersion.__table__.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return conn.execute(schema_version_query()).scalar() or 0
+
+
+def run_migrations(engine: Engine) -> int:
+    """执行全部待执行的迁移
+
+    Returns:
+        int: 本次执行的迁移数
+    """
+    version = current_version(engine)
+    pending = [migration for migration in MIGRATIONS if migration.version > version]
+    for migration in pending:
+        logger.info(f"执行数据库迁移 {migration.version}: {migration.description}")
+        migration.apply(engine)
+        with engine.begin() as conn:
+            conn.execute(models.SchemaVersion.__table__.insert().values(
+                version=migration.version, description=migration.description
+            ))
+    return len(pending)
+
+
+def ensure_schema(engine: Engine) -> int:
+    """建表（已存在的跳过）并执行全部待执行的迁移；迁移依赖的表在空库上也已存在
+
+    Returns:
+        int: 本次执行的迁移数
+    """
+    models.Base.metadata.create_all(bind=engine)
+    return run_migrations(engine)
+
+
+def _next_month(day: date) -> date:
+    return date(day.year + (day.month == 12), day.month % 12 + 1, 1)
+
+
+def partition_github_events(engine: Engine, months_ahead: int = 12) -> None:
+    """把 github_events 改为按 event_date 月份的 RANGE 分区（仅 MySQL，可选）
+
+    MySQL 要求分区键出现在每个唯一键中，因此主键改为 (id, event_date)，
+    去重键改为 (user_id, event_id, event_date)；同一事件的 event_date 固定，
+    去重语义不变。分区覆盖最早事件所在月份到今后 months_ahead 个月，另有一个
+    MAXVALUE 分区兜底。
+    """
+    if engine.dialect.name != 'mysql':
+        raise RuntimeError("只有 MySQL 支持分区")
+
+    with engine.connect() as conn:
+        first = conn.execute(text("SELECT MIN(event_date) FROM github_events")).scalar() or date.today()
+    month = date(first.year, first.month, 1)
+    last = date.today().replace(day=1)
+    for _ in range(months_ahead):
+        last = _next_month(last)
+
+    partitions = []
+    while month <= last:
+        partitions.append(f"PARTITION p{month:%Y%m} VALUES LESS THAN ('{_next_month(month):%Y-%m-%d}')")
+        month = _next_month(month)
+    partitions.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+
+    # 唯一键由迁移 5 创建；不存在时（如上次执行到一半失败）只新建不删除
+    drop_unique = "DROP INDEX udx_user_event, " if 'udx_user_event' in _index_names(engine, 'github_events') else ""
+    statements = [
+        "UPDATE github_events SET event_date = DATE(event_time) WHERE event_date IS NULL",
+        "ALTER TABLE github_events MODIFY event_date DATE NOT NULL "
+        "COMMENT '事件日期（入库时按事件时间写入，分区字段）'",
+        "ALTER TABLE github_events DROP PRIMARY KEY, ADD PRIMARY KEY (id, event_date), "
+        f"{drop_unique}ADD UNIQUE KEY udx_user_event (user_id, event_id, event_date)",
+        "ALTER TABLE github_events PARTITION BY RANGE COLUMNS (event_date) (\n%s\n)" % ",\n".join(partitions),
+    ]
+    for statement in statements:
+        logger.info(f"执行: {statement.splitlines()[0]}")
+        with engine.begin() as conn:
+            conn.execute(text(statement))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="执行数据库结构迁移")
+    parser.add_argument('--partition-github-events', action='store_true', help="把 github_events 改为按月分区（MySQL）")
+    parser.add_argument('--months-ahead', type=int, default=12, help="预建未来几个月的分区")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    applied = ensure_schema(engine)
+    logger.info(f"执行了 {applied} 个迁移，当前版本 {current_version(engine)}")
+    if args.partition_github_events:
+        partition_github_events(engine, args.months_ahead)
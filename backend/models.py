@@ -1,8 +1,8 @@
 from sqlalchemy import Column, Integer, String, DateTime, Boolean, JSON, ForeignKey, TIMESTAMP, Float, Date, DECIMAL, \
-    Text, BigInteger, SmallInteger
+    Text, BigInteger, SmallInteger, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 
 Base = declarative_base()
 
@@ -47,6 +47,9 @@ class User(Base):
 
 class GitHubRepo(Base):
     __tablename__ = "github_repos"
+    __table_args__ = (
+        UniqueConstraint('user_id', 'github_id', name='udx_user_repo'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
@@ -64,20 +67,113 @@ class GitHubRepo(Base):
 
 class TogglData(Base):
     __tablename__ = "toggl_datas"
+    __table_args__ = (
+        # 按用户取最新快照
+        Index('idx_user_update_time', 'user_id', 'update_time'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     toggl_accounts_id = Column(String(30), nullable=False)
-    clients = Column(JSON, nullable=False)
-    time_entries = Column(JSON, nullable=False)
-    workspace_list = Column(JSON, nullable=False)
-    tag_list = Column(JSON, nullable=False)
-    project_list = Column(JSON, nullable=False)
+    # 快照中的大字段默认延迟加载，需要时用 undefer / load_only 显式读取；
+    # 项目、标签、客户、工作区另有维度表（toggl_projects 等）
+    clients = deferred(Column(JSON, nullable=False))
+    time_entries = deferred(Column(JSON, nullable=False))
+    workspace_list = deferred(Column(JSON, nullable=False))
+    tag_list = deferred(Column(JSON, nullable=False))
+    project_list = deferred(Column(JSON, nullable=False))
     create_time = Column(DateTime, nullable=False, server_default=func.now())
     update_time = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
 
     user = relationship("User", back_populates="toggl_data")
 
+class TogglProject(Base):
+    __tablename__ = "toggl_projects"
+    __table_args__ = (
+        UniqueConstraint('user_id', 'project_id', name='udx_user_project'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    project_id = Column(BigInteger, nullable=False, comment='Toggl项目ID')
+    workspace_id = Column(BigInteger, comment='Toggl工作区ID')
+    client_id = Column(BigInteger, comment='Toggl客户ID')
+    name = Column(String(255), nullable=False)
+    color = Column(String(16))
+    active = Column(Boolean, nullable=False, default=True)
+    update_time = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
+class TogglTag(Base):
+    __tablename__ = "toggl_tags"
+    __table_args__ = (
+        UniqueConstraint('user_id', 'tag_id', name='udx_user_tag'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    tag_id = Column(BigInteger, nullable=False, comment='Toggl标签ID')
+    workspace_id = Column(BigInteger, comment='Toggl工作区ID')
+    name = Column(String(255), nullable=False)
+    update_time = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
+class TogglClient(Base):
+    __tablename__ = "toggl_clients"
+    __table_args__ = (
+        UniqueConstraint('user_id', 'client_id', name='udx_user_client'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    client_id = Column(BigInteger, nullable=False, comment='Toggl客户ID')
+    workspace_id = Column(BigInteger, comment='Toggl工作区ID')
+    name = Column(String(255), nullable=False)
+    archived = Column(Boolean, nullable=False, default=False)
+    update_time = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
+class TogglWorkspace(Base):
+    __tablename__ = "toggl_workspaces"
+    __table_args__ = (
+        UniqueConstraint('user_id', 'workspace_id', name='udx_user_workspace'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    workspace_id = Column(BigInteger, nullable=False, comment='Toggl工作区ID')
+    organization_id = Column(BigInteger, comment='Toggl组织ID')
+    name = Column(String(255), nullable=False)
+    update_time = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
+class TogglTimeEntry(Base):
+    __tablename__ = "toggl_time_entries"
+    __table_args__ = (
+        UniqueConstraint('user_id', 'entry_id', name='udx_user_entry'),
+        Index('idx_user_start', 'user_id', 'start_ts'),
+        Index('idx_user_project_start', 'user_id', 'project_id', 'start_ts'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    entry_id = Column(BigInteger, nullable=False, comment='Toggl时间记录ID')
+    workspace_id = Column(BigInteger, comment='Toggl工作区ID')
+    project_id = Column(BigInteger, comment='Toggl项目ID')
+    description = Column(String(512))
+    start_ts = Column(BigInteger, nullable=False, comment='开始时间（UTC秒级时间戳）')
+    stop_ts = Column(BigInteger, comment='结束时间（UTC秒级时间戳），计时中为空')
+    duration = Column(Integer, nullable=False, comment='时长（秒），计时中为负数')
+    tags = Column(JSON, comment='标签名列表')
+    at_ts = Column(BigInteger, nullable=False, comment='Toggl最后修改时间（UTC毫秒级时间戳）')
+    deleted_at = Column(BigInteger, comment='删除时间（UTC秒级时间戳），未删除为空')
+    update_time = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
+class TogglDailyRollup(Base):
+    __tablename__ = "toggl_daily_rollups"
+
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    record_date = Column(Date, primary_key=True, comment='用户时区下的日期')
+    project_id = Column(BigInteger, primary_key=True, comment='Toggl项目ID，无项目为0')
+    seconds = Column(Integer, nullable=False, default=0, comment='当日该项目的有效时长（秒）')
+    update_time = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
 class PersonalPlan(Base):
     __tablename__ = "personal_plans"
     
@@ -95,12 +191,16 @@ class PersonalPlan(Base):
     deadline = Column(Date, nullable=False)
     plan_status = Column(Integer, nullable=False, default=2)  # 2=进行中
     plan_type = Column(Integer, nullable=False, default=0)
+    ended_at = Column(DateTime, nullable=True)  # 离开进行中状态的时间，每日状态按此判断计划在哪些天有效
     
     # 关系
     user = relationship("User", back_populates="personal_plans")
 
 class DailyStatus(Base):
     __tablename__ = "daily_status"
+    __table_args__ = (
+        UniqueConstraint('user_id', 'record_date', name='udx_user_date'),
+    )
     
     record_id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -142,16 +242,45 @@ User.personal_plans = relationship("PersonalPlan", back_populates="user")
 
 class GitHubEvents(Base):
     __tablename__ = "github_events"
+    __table_args__ = (
+        UniqueConstraint('user_id', 'event_id', name='udx_user_event'),
+        # 覆盖“某用户某时间段内按类型/按天计数”的查询
+        Index('idx_user_event_time', 'user_id', 'event_time', 'event_type'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True, comment='自增主键')
     user_id = Column(Integer, nullable=False, comment='关联本地用户系统ID')
+    event_id = Column(BigInteger, nullable=True, comment='GitHub事件ID（去重依据）')
     github_user_id = Column(BigInteger, nullable=False, comment='GitHub用户数字ID')
     event_type = Column(String(30), nullable=False, comment='事件类型（见附录）')
     repo_id = Column(BigInteger, nullable=False, comment='仓库数字ID')
     repo_name = Column(String(255), nullable=False, comment='owner/repo格式')
     repo_url = Column(String(512), nullable=False, comment='仓库HTTPS地址')
     event_time = Column(DateTime(3), nullable=False, comment='事件触发时间（含毫秒）')
-    event_date = Column(DateTime, comment='生成日期分区字段', index=True)
+    event_date = Column(Date, comment='事件日期（入库时按事件时间写入，可作为分区字段）', index=True)
     commit_count = Column(SmallInteger, default=0, nullable=True, comment='提交次数（仅PushEvent有效）')
     code_changes = Column(JSON, nullable=True, comment='代码变更统计')
     event_specific = Column(JSON, nullable=True, comment='事件特有数据')
+
+
+class SyncState(Base):
+    __tablename__ = "sync_states"
+    __table_args__ = (
+        UniqueConstraint('user_id', 'source', name='udx_user_source'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    source = Column(String(30), nullable=False, comment='数据源，如 github_events')
+    last_cursor = Column(String(64), comment='水位游标（GitHub事件为已入库的最大事件ID）')
+    etag = Column(String(255), comment='上次响应的ETag，用于条件请求')
+    synced_at = Column(DateTime, comment='最近一次成功检查的时间')
+    changed_at = Column(DateTime, comment='最近一次写入新数据的时间')
+
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True, autoincrement=False, comment='迁移版本号')
+    description = Column(String(255), nullable=False, comment='迁移说明')
+    applied_at = Column(DateTime, nullable=False, server_default=func.now(), comment='执行时间')
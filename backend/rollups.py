@@ -0,0 +1,46 @@
+from datetime import date, datetime
+from typing import Dict, Optional
+
+import pytz
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+
+DEFAULT_TIMEZONE = 'Asia/Shanghai'
+
+
+def get_timezone(name: Optional[str]):
+    """按名称获取时区，未设置或无法识别时使用默认时区"""
+    try:
+        return pytz.timezone(name or DEFAULT_TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        return pytz.timezone(DEFAULT_TIMEZONE)
+
+
+def user_timezone(user: models.User):
+    """用户时区"""
+    return get_timezone(user.timezone)
+
+
+def local_today(user: models.User) -> date:
+    """用户时区下的今天"""
+    return datetime.now(user_timezone(user)).date()
+
+
+def get_project_seconds(
+        db: Session,
+        user_id: int,
+        start_date: date,
+        end_date: Optional[date] = None
+) -> Dict[int, int]:
+    """从日汇总表读取日期范围内（含两端）各项目的时长（秒），无项目的时长记在0下"""
+    query = db.query(
+        models.TogglDailyRollup.project_id,
+        func.sum(models.TogglDailyRollup.seconds)
+    ).filter(
+        models.TogglDailyRollup.user_id == user_id,
+        models.TogglDailyRollup.record_date >= start_date,
+        models.TogglDailyRollup.record_date <= (end_date or start_date)
+    ).group_by(models.TogglDailyRollup.project_id)
+    return {project_id: int(seconds or 0) for project_id, seconds in query.all()}
@@ -91,7 +91,7 @@ class TogglProject(BaseModel):
 class TogglTag(BaseModel):
     id: int
     name: str
-    workspace_id: int
+    workspace_id: Optional[int] = None  # 维度表中的工作区ID可能为空
 
 # GitHub相关模型
 class GitHubRepo(BaseModel):
@@ -113,6 +113,9 @@ class GitHubRepoList(BaseModel):
     total: int
     page: int
     per_page: int
+    synced_at: Optional[datetime] = None  # 最近一次从GitHub同步的时间
+    stale: bool = False  # 数据是否超过刷新周期
+    refreshing: bool = False  # 是否有后台刷新在进行
 
 class GitHubEvent(BaseModel):
     id: str
@@ -0,0 +1,41 @@
+"""大列表接口的快速序列化
+
+默认情况下接口返回值先经过 response_model 校验，再由 jsonable_encoder 转成基础类型，
+最后用标准库 json 编码。开启 settings.fast_serialization 后，接口改用预先构建的
+TypeAdapter 一次完成校验，并用 pydantic-core 的原生编码器直接输出 JSON 字节串，输出内容
+与 response_model 的结果一致。
+
+字段都来自数据库且类型确定的接口（如热力图）还可以用 json_fragments_response：
+JSON 列直接读出原始文本拼接到响应中，省去逐行解析 JSON、校验、再编码的过程。
+
+序列化耗时写入 Server-Timing 响应头并计入请求指标。
+"""
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+import metrics
+
+
+def _timed_response(body: bytes, started: float, headers: Optional[Dict[str, str]]) -> Response:
+    seconds = time.perf_counter() - started
+    metrics.record_serialization(seconds)
+    headers = dict(headers or {})
+    headers['Server-Timing'] = f"serialize;dur={seconds * 1000:.2f}"
+    return Response(content=body, media_type='application/json', headers=headers)
+
+
+def json_response(adapter: TypeAdapter, data: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+    """按 adapter 的类型校验 data（可以是 ORM 对象）并编码为 JSON 响应"""
+    started = time.perf_counter()
+    body = adapter.dump_json(adapter.validate_python(data, from_attributes=True))
+    return _timed_response(body, started, headers)
+
+
+def json_fragments_response(fragments: Iterable[str], headers: Optional[Dict[str, str]] = None) -> Response:
+    """把已经是 JSON 文本的数组元素拼成 JSON 数组响应（调用方负责元素格式与 response_model 一致）"""
+    started = time.perf_counter()
+    body = ('[' + ','.join(fragments) + ']').encode('utf-8')
+    return _timed_response(body, started, headers)
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+
+# 数据源标识，与 fetch_loader.py 中的常量保持一致
+GITHUB_EVENTS_SOURCE = 'github_events'
+GITHUB_REPOS_SOURCE = 'github_repos'
+TOGGL_ENTRIES_SOURCE = 'toggl_time_entries'
+TOGGL_SNAPSHOT_SOURCE = 'toggl_snapshot'
+# Toggl维度表，last_cursor 保存内容哈希，内容不变时不重写
+TOGGL_PROJECTS_SOURCE = 'toggl_projects'
+TOGGL_TAGS_SOURCE = 'toggl_tags'
+TOGGL_CLIENTS_SOURCE = 'toggl_clients'
+TOGGL_WORKSPACES_SOURCE = 'toggl_workspaces'
+DAILY_STATUS_SOURCE = 'daily_status'
+# 计划没有外部数据源，增删改时记录 changed_at，供每日状态判断是否需要重算
+PLANS_SOURCE = 'plans'
+
+
+def get_sync_state(db: Session, user_id: int, source: str) -> Optional[models.SyncState]:
+    """获取用户某数据源的同步水位"""
+    return db.query(models.SyncState).filter(
+        models.SyncState.user_id == user_id,
+        models.SyncState.source == source
+    ).first()
+
+
+def mark_synced(db: Session, user_id: int, source: str, changed: bool) -> models.SyncState:
+    """记录一次成功的同步；changed 为 True 时同时刷新 changed_at（不提交事务）"""
+    state = get_sync_state(db, user_id, source)
+    if state is None:
+        state = models.SyncState(user_id=user_id, source=source)
+        db.add(state)
+
+    now = datetime.now()
+    state.synced_at = now
+    if changed:
+        # changed_at 可能只精确到秒，同一秒内的再次变化顺延一秒，保证每次变化都会改变版本号
+        if state.changed_at is not None and now.replace(microsecond=0) <= state.changed_at:
+            now = state.changed_at + timedelta(seconds=1)
+        state.changed_at = now
+    return state
+
+
+def is_stale(state: Optional[models.SyncState], ttl_seconds: int) -> bool:
+    """从未同步过或距上次同步超过 ttl_seconds 秒时视为过期"""
+    if state is None or state.synced_at is None:
+        return True
+    return (datetime.now() - state.synced_at).total_seconds() > ttl_seconds
+
+
+def get_user_versions(
+        db: Session, user_id: int, sources: Optional[Iterable[str]] = None
+) -> Tuple[Tuple[str, Optional[datetime]], ...]:
+    """用户各数据源最近一次数据变化的时间，可作为缓存版本号或 ETag 的一部分
+
+    一次按 user_id 的索引查询；sources 为空时返回全部数据源。
+    """
+    query = db.query(models.SyncState.source, models.SyncState.changed_at).filter(
+        models.SyncState.user_id == user_id
+    )
+    if sources is not None:
+        query = query.filter(models.SyncState.source.in_(list(sources)))
+    return tuple(sorted((source, changed_at) for source, changed_at in query))
@@ -0,0 +1,131 @@
+"""Toggl 维度表（项目、标签、客户、工作区）
+
+Toggl /me?with_related_data=true 快照中的 projects / tags / clients / workspaces
+转换为按用户划分的小表，供计划创建的下拉框等接口直接读取，不再加载整份快照。
+每个维度的内容哈希保存在 sync_states.last_cursor 中，内容不变时不重写；变化时在
+同一事务中整体替换该用户的该维度并刷新 changed_at（读接口的 ETag 随之变化）。
+
+只保存接口用到的字段，哈希也只按这些字段计算，项目的 actual_seconds 等随时间记录
+变化的统计字段不会触发重写。本模块与 fetch_loader.py / replay_loader.py /
+migrations.py 共用，不导入 config / logger。
+"""
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session
+
+import models
+from sync_state import (
+    TOGGL_CLIENTS_SOURCE, TOGGL_PROJECTS_SOURCE, TOGGL_TAGS_SOURCE, TOGGL_WORKSPACES_SOURCE,
+    get_sync_state, mark_synced,
+)
+
+
+def _workspace_id(item: Dict[str, Any]) -> Optional[int]:
+    # 新接口用 workspace_id，旧字段为 wid
+    return item.get('workspace_id') or item.get('wid')
+
+
+def transform_project(project: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'project_id': int(project['id']),
+        'workspace_id': _workspace_id(project),
+        'client_id': project.get('client_id') or project.get('cid'),
+        'name': project['name'],
+        'color': project.get('color'),
+        'active': bool(project.get('active', True)),
+    }
+
+
+def transform_tag(tag: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'tag_id': int(tag['id']),
+        'workspace_id': _workspace_id(tag),
+        'name': tag['name'],
+    }
+
+
+def transform_client(client: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'client_id': int(client['id']),
+        'workspace_id': _workspace_id(client),
+        'name': client['name'],
+        'archived': bool(client.get('archived', False)),
+    }
+
+
+def transform_workspace(workspace: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'workspace_id': int(workspace['id']),
+        'organization_id': workspace.get('organization_id'),
+        'name': workspace['name'],
+    }
+
+
+class Dimension(NamedTuple):
+    model: Any  # 维度表模型
+    payload_key: str  # Toggl /me 响应中的字段
+    transform: Callable[[Dict[str, Any]], Dict[str, Any]]
+    key: str  # 维度表中的 Toggl ID 字段，用于排序和去重
+
+
+DIMENSIONS: Dict[str, Dimension] = {
+    TOGGL_PROJECTS_SOURCE: Dimension(models.TogglProject, 'projects', transform_project, 'project_id'),
+    TOGGL_TAGS_SOURCE: Dimension(models.TogglTag, 'tags', transform_tag, 'tag_id'),
+    TOGGL_CLIENTS_SOURCE: Dimension(models.TogglClient, 'clients', transform_client, 'client_id'),
+    TOGGL_WORKSPACES_SOURCE: Dimension(models.TogglWorkspace, 'workspaces', transform_workspace, 'workspace_id'),
+}
+
+
+def transform_dimensions(data: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """把 /me 快照转换为各维度表的行（按 Toggl ID 去重排序，跳过已删除的条目）
+
+    快照中缺少某个字段时不返回该维度，避免把已有数据清空。
+    """
+    dimensions = {}
+    for source, dimension in DIMENSIONS.items():
+        items = data.get(dimension.payload_key)
+        if items is None:
+            continue
+        rows = {}
+        for item in items:
+            if item.get('server_deleted_at'):
+                continue
+            row = dimension.transform(item)
+            rows[row[dimension.key]] = row
+        dimensions[source] = [rows[key] for key in sorted(rows)]
+    return dimensions
+
+
+def content_hash(rows: List[Dict[str, Any]]) -> str:
+    body = json.dumps(rows, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def save_dimensions(db: Session, user_id: int, dimensions: Dict[str, List[Dict[str, Any]]]) -> Dict[str, int]:
+    """保存内容有变化的维度并提交
+
+    Returns:
+        dict: 本次重写的维度 -> 行数，内容未变化的维度不出现
+    """
+    now = datetime.now()
+    written = {}
+    for source, rows in dimensions.items():
+        digest = content_hash(rows)
+        state = get_sync_state(db, user_id, source)
+        if state is not None and state.last_cursor == digest:
+            mark_synced(db, user_id, source, changed=False)
+            continue
+
+        table = DIMENSIONS[source].model.__table__
+        db.execute(delete(table).where(table.c.user_id == user_id))
+        if rows:
+            db.execute(insert(table), [dict(row, user_id=user_id, update_time=now) for row in rows])
+        state = mark_synced(db, user_id, source, changed=True)
+        state.last_cursor = digest
+        written[source] = len(rows)
+    db.commit()
+    return written
@@ -0,0 +1,186 @@
+"""基准测试用的合成数据生成器
+
+按固定随机种子为 N 个用户生成 M 年的 GitHub 事件、Toggl 时间记录、计划和仓库。
+事件和时间记录先按 data/ 下真实接口响应的结构构造，再经过 fetch_loader.py 中的
+同一套转换函数入库；Toggl日汇总和每日状态按正式流程的规则计算，因此各接口读到的
+数据形态与线上一致。写库只用 SQLAlchemy Core / ORM，SQLite 和 MySQL 都可以使用。
+"""
+import json
+import random
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import pytz
+from sqlalchemy.orm import Session
+
+import models
+from daily_status import materialize_daily_status
+from fetch_loader import transform_github_event, transform_toggl_entry
+from sync_state import GITHUB_REPOS_SOURCE, TOGGL_ENTRIES_SOURCE, mark_synced
+
+# 与 data/ 中观察到的事件类型分布大致一致，补充了仪表盘统计的几种类型
+EVENT_TYPES = ['PushEvent'] * 6 + ['ForkEvent'] * 2 + ['PullRequestEvent', 'IssuesEvent', 'WatchEvent', 'CreateEvent']
+PROJECTS_PER_USER = 6
+PLANS_PER_USER = 4
+REPOS_PER_USER = 30
+TIMEZONE = 'Asia/Shanghai'
+BENCH_PASSWORD = 'bench-password'
+INSERT_BATCH_SIZE = 2000
+
+
+def github_event_payload(rng, event_id, actor, repo, created_at):
+    """构造与 /users/{user}/events 返回结构一致的事件"""
+    event_type = rng.choice(EVENT_TYPES)
+    payload = {}
+    if event_type == 'PushEvent':
+        payload = {'commits': [{'sha': f"{rng.getrandbits(160):040x}", 'message': 'update'}
+                               for _ in range(rng.randint(1, 5))]}
+    elif event_type == 'PullRequestEvent':
+        payload = {'action': rng.choice(['opened', 'closed']),
+                   'pull_request': {'number': rng.randint(1, 500), 'state': 'open', 'comments': rng.randint(0, 9)}}
+    elif event_type == 'IssuesEvent':
+        payload = {'action': 'opened', 'issue': {'number': rng.randint(1, 500), 'title': 'Bug fix'}}
+    return {
+        'id': str(event_id),
+        'type': event_type,
+        'actor': actor,
+        'repo': {'id': repo['id'], 'name': repo['name'], 'url': f"https://api.github.com/repos/{repo['name']}"},
+        'payload': payload,
+        'public': True,
+        'created_at': created_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+    }
+
+
+def toggl_entry_payload(rng, entry_id, workspace_id, project_id, start):
+    """构造与 Toggl /me?with_related_data=true 中 time_entries 结构一致的时间记录"""
+    duration = rng.randint(10, 150) * 60
+    stop = start + timedelta(seconds=duration)
+    return {
+        'id': entry_id,
+        'workspace_id': workspace_id,
+        'project_id': project_id,
+        'task_id': None,
+        'billable': False,
+        'start': start.strftime('%Y-%m-%dT%H:%M:%S+00:00'),
+        'stop': stop.strftime('%Y-%m-%dT%H:%M:%S+00:00'),
+        'duration': duration,
+        'description': '',
+        'tags': [],
+        'tag_ids': [],
+        'duronly': True,
+        'at': (stop + timedelta(seconds=2)).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+        'server_deleted_at': None,
+        'wid': workspace_id,
+        'pid': project_id,
+    }
+
+
+def insert_rows(engine, table, rows):
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        with engine.begin() as conn:
+            conn.execute(table.insert(), rows[start:start + INSERT_BATCH_SIZE])
+
+
+def generate(engine, users=1, years=1, seed=42, end_date=None, password_hash=None):
+    """生成 users 个用户、每人 years 年的数据
+
+    Returns:
+        dict: 各表生成的行数
+    """
+    rng = random.Random(seed)
+    end_date = end_date or date.today()
+    start_date = end_date - timedelta(days=365 * years - 1)
+    tz = pytz.timezone(TIMEZONE)
+    counts = defaultdict(int)
+    next_event_id = 40_000_000_000
+    next_entry_id = 3_000_000_000
+
+    for index in range(users):
+        with Session(engine) as db:
+            user = models.User(
+                username=f"bench_user_{index}",
+                password=password_hash,
+                email=f"bench_user_{index}@example.com",
+                github_username=f"bench_user_{index}",
+                timezone=TIMEZONE,
+                status=1,
+            )
+            db.add(user)
+            db.commit()
+            user_id = user.id
+        counts['users'] += 1
+
+        workspace_id = 9_000_000 + index
+        project_ids = [200_000_000 + index * 100 + p for p in range(PROJECTS_PER_USER)]
+        actor = {'id': 40_000_000 + index, 'login': f"bench_user_{index}"}
+        repos = [{'id': 600_000_000 + index * 1000 + r, 'name': f"bench_user_{index}/repo-{r}"}
+                 for r in range(REPOS_PER_USER)]
+
+        with Session(engine) as db:
+            created = datetime.combine(start_date, datetime.min.time())
+            for p in range(PLANS_PER_USER):
+                db.add(models.PersonalPlan(
+                    user_id=user_id, plan_id=f"bench-{user_id}-{p}", plan_name=f"plan-{p}",
+                    toggl_project_id=project_ids[p], repo_id=repos[p]['id'],
+                    daily_plan_duration=rng.choice([30, 60, 90]), tag_list=[], project_list=[],
+                    create_time=created, update_time=created, deadline=end_date + timedelta(days=30),
+                    plan_status=2, plan_type=1 if p < 2 else 0,
+                ))
+            for repo in repos:
+                db.add(models.GitHubRepo(
+                    user_id=user_id, github_id=repo['id'], repo_name=repo['name'].split('/')[1],
+                    fork_flag=False, events_url=f"https://api.github.com/repos/{repo['name']}/events",
+                    created_at=created, updated_at=created + timedelta(days=rng.randint(0, 365 * years - 1)),
+                    pushed_at=created, status=1,
+                ))
+            # 仓库视为刚同步过，避免基准请求触发后台刷新
+            mark_synced(db, user_id, GITHUB_REPOS_SOURCE, changed=True)
+            mark_synced(db, user_id, TOGGL_ENTRIES_SOURCE, changed=True)
+            db.commit()
+        counts['plans'] += PLANS_PER_USER
+        counts['github_repos'] += REPOS_PER_USER
+
+        events = []
+        entries = []
+        rollups = defaultdict(int)
+        day = start_date
+        while day <= end_date:
+            base = datetime(day.year, day.month, day.day)
+            for _ in range(rng.randint(0, 8)):
+                created_at = base + timedelta(seconds=rng.randint(0, 86399))
+                row = transform_github_event(
+                    github_event_payload(rng, next_event_id, actor, rng.choice(repos), created_at), user_id
+                )
+                row['code_changes'] = json.loads(row['code_changes'])
+                row['event_specific'] = json.loads(row['event_specific'])
+                events.append(row)
+                next_event_id += 1
+            for _ in range(rng.randint(0, 6)):
+                start = base + timedelta(seconds=rng.randint(0, 80000))
+                row = transform_toggl_entry(
+                    toggl_entry_payload(rng, next_entry_id, workspace_id, rng.choice(project_ids + [None]), start),
+                    user_id
+                )
+                row['tags'] = json.loads(row['tags'])
+                entries.append(row)
+                next_entry_id += 1
+                local_day = datetime.fromtimestamp(row['start_ts'], tz).date()
+                rollups[(local_day, row['project_id'] or 0)] += row['duration']
+            day += timedelta(days=1)
+
+        insert_rows(engine, models.GitHubEvents.__table__, events)
+        insert_rows(engine, models.TogglTimeEntry.__table__, entries)
+        now = datetime.now()
+        insert_rows(engine, models.TogglDailyRollup.__table__, [
+            {'user_id': user_id, 'record_date': record_date, 'project_id': project_id,
+             'seconds': seconds, 'update_time': now}
+            for (record_date, project_id), seconds in rollups.items()
+        ])
+        counts['github_events'] += len(events)
+        counts['toggl_time_entries'] += len(entries)
+        counts['toggl_daily_rollups'] += len(rollups)
+
+        with Session(engine) as db:
+            counts['daily_status'] += materialize_daily_status(db, user_id, start_date, end_date)
+
+    return dict(counts)
@@ -85,7 +85,8 @@ CREATE TABLE personal_plans
     update_time         DATETIME       NOT NULL COMMENT '更新时间',
     deadline            DATE           NOT NULL COMMENT '截止时间',
     plan_status         int            not null COMMENT '计划的状态 0-延期，1-已完成，2-进行中，3-废弃',
-    plan_type           int            not null comment '计划类型是否加入打卡计划衡量标准，1-已加入每日必做，0-未加入，2-已加入但非每日必做'
+    plan_type           int            not null comment '计划类型是否加入打卡计划衡量标准，1-已加入每日必做，0-未加入，2-已加入但非每日必做',
+    ended_at            DATETIME       DEFAULT NULL COMMENT '离开进行中状态（完成/延期/废弃）的时间，为空表示仍在进行中'
 ) ENGINE = InnoDB;
 
 
@@ -106,23 +107,119 @@ CREATE TABLE toggl_datas
     tag_list          JSON        NOT NULL,
     project_list      JSON        NOT NULL,
     create_time       DATETIME    NOT NULL,
-    update_time       DATETIME    NOT NULL COMMENT '更新时间'
+    update_time       DATETIME    NOT NULL COMMENT '更新时间',
+
+    INDEX idx_user_update_time (user_id, update_time)
 ) ENGINE = InnoDB;
 
 drop TABLE toggl_datas;
 
+-- toggl时间记录明细表：按条目ID和at增量更新，按时间范围查询走索引
+CREATE TABLE toggl_time_entries
+(
+    id           INT AUTO_INCREMENT PRIMARY KEY,
+    user_id      INT          NOT NULL COMMENT '用户ID',
+    entry_id     BIGINT       NOT NULL COMMENT 'Toggl时间记录ID',
+    workspace_id BIGINT       DEFAULT NULL COMMENT 'Toggl工作区ID',
+    project_id   BIGINT       DEFAULT NULL COMMENT 'Toggl项目ID',
+    description  VARCHAR(512) DEFAULT NULL,
+    start_ts     BIGINT       NOT NULL COMMENT '开始时间（UTC秒级时间戳）',
+    stop_ts      BIGINT       DEFAULT NULL COMMENT '结束时间（UTC秒级时间戳），计时中为空',
+    duration     INT          NOT NULL COMMENT '时长（秒），计时中为负数',
+    tags         JSON         DEFAULT NULL COMMENT '标签名列表',
+    at_ts        BIGINT       NOT NULL COMMENT 'Toggl最后修改时间（UTC毫秒级时间戳）',
+    deleted_at   BIGINT       DEFAULT NULL COMMENT '删除时间（UTC秒级时间戳），未删除为空',
+    update_time  DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    UNIQUE KEY udx_user_entry (user_id, entry_id),
+    INDEX idx_user_start (user_id, start_ts),
+    INDEX idx_user_project_start (user_id, project_id, start_ts),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+) ENGINE = InnoDB DEFAULT CHARSET = utf8mb4 COMMENT = 'Toggl时间记录明细表';
+
+-- toggl时长日汇总表：(用户, 用户时区下的日期, 项目) -> 秒，由 fetch_loader.py 在写入时间记录后增量维护
+CREATE TABLE toggl_daily_rollups
+(
+    user_id     INT      NOT NULL COMMENT '用户ID',
+    record_date DATE     NOT NULL COMMENT '用户时区下的日期',
+    project_id  BIGINT   NOT NULL COMMENT 'Toggl项目ID，无项目为0',
+    seconds     INT      NOT NULL DEFAULT 0 COMMENT '当日该项目的有效时长（秒）',
+    update_time DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    PRIMARY KEY (user_id, record_date, project_id),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+) ENGINE = InnoDB DEFAULT CHARSET = utf8mb4 COMMENT = 'Toggl时长日汇总表';
+
+-- toggl维度表：由同步任务按内容哈希（sync_states.last_cursor）刷新，内容不变时不重写
+CREATE TABLE toggl_projects
+(
+    id           INT AUTO_INCREMENT PRIMARY KEY,
+    user_id      INT          NOT NULL COMMENT '用户ID',
+    project_id   BIGINT       NOT NULL COMMENT 'Toggl项目ID',
+    workspace_id BIGINT       DEFAULT NULL COMMENT 'Toggl工作区ID',
+    client_id    BIGINT       DEFAULT NULL COMMENT 'Toggl客户ID',
+    name         VARCHAR(255) NOT NULL,
+    color        VARCHAR(16)  DEFAULT NULL,
+    active       TINYINT(1)   NOT NULL DEFAULT 1,
+    update_time  DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    UNIQUE KEY udx_user_project (user_id, project_id),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+) ENGINE = InnoDB DEFAULT CHARSET = utf8mb4 COMMENT = 'Toggl项目表';
+
+CREATE TABLE toggl_tags
+(
+    id           INT AUTO_INCREMENT PRIMARY KEY,
+    user_id      INT          NOT NULL COMMENT '用户ID',
+    tag_id       BIGINT       NOT NULL COMMENT 'Toggl标签ID',
+    workspace_id BIGINT       DEFAULT NULL COMMENT 'Toggl工作区ID',
+    name         VARCHAR(255) NOT NULL,
+    update_time  DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    UNIQUE KEY udx_user_tag (user_id, tag_id),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+) ENGINE = InnoDB DEFAULT CHARSET = utf8mb4 COMMENT = 'Toggl标签表';
+
+CREATE TABLE toggl_clients
+(
+    id           INT AUTO_INCREMENT PRIMARY KEY,
+    user_id      INT          NOT NULL COMMENT '用户ID',
+    client_id    BIGINT       NOT NULL COMMENT 'Toggl客户ID',
+    workspace_id BIGINT       DEFAULT NULL COMMENT 'Toggl工作区ID',
+    name         VARCHAR(255) NOT NULL,
+    archived     TINYINT(1)   NOT NULL DEFAULT 0,
+    update_time  DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    UNIQUE KEY udx_user_client (user_id, client_id),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+) ENGINE = InnoDB DEFAULT CHARSET = utf8mb4 COMMENT = 'Toggl客户表';
+
+CREATE TABLE toggl_workspaces
+(
+    id              INT AUTO_INCREMENT PRIMARY KEY,
+    user_id         INT          NOT NULL COMMENT '用户ID',
+    workspace_id    BIGINT       NOT NULL COMMENT 'Toggl工作区ID',
+    organization_id BIGINT       DEFAULT NULL COMMENT 'Toggl组织ID',
+    name            VARCHAR(255) NOT NULL,
+    update_time     DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    UNIQUE KEY udx_user_workspace (user_id, workspace_id),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+) ENGINE = InnoDB DEFAULT CHARSET = utf8mb4 COMMENT = 'Toggl工作区表';
+
 -- 用户Github数据表
 CREATE TABLE github_events
 (
     id             INT UNSIGNED AUTO_INCREMENT PRIMARY KEY COMMENT '自增主键',
     user_id        INT          NOT NULL COMMENT '关联本地用户系统ID',
+    event_id       BIGINT       DEFAULT NULL COMMENT 'GitHub事件ID（去重依据）',
     github_user_id BIGINT       NOT NULL COMMENT 'GitHub用户数字ID',
     event_type     VARCHAR(30)  NOT NULL COMMENT '事件类型（见附录）',
     repo_id        BIGINT       NOT NULL COMMENT '仓库数字ID',
     repo_name      VARCHAR(255) NOT NULL COMMENT 'owner/repo格式',
     repo_url       VARCHAR(512) NOT NULL COMMENT '仓库HTTPS地址',
     event_time     DATETIME(3)  NOT NULL COMMENT '事件触发时间（含毫秒）',
-    event_date     DATE GENERATED ALWAYS AS (DATE(event_time)) STORED COMMENT '生成日期分区字段',
+    event_date     DATE         DEFAULT NULL COMMENT '事件日期（入库时按事件时间写入，可作为分区字段）',
 
     -- 通用指标字段
     commit_count   SMALLINT UNSIGNED DEFAULT 0 COMMENT '提交次数（仅PushEvent有效）',
@@ -148,12 +245,40 @@ CREATE TABLE github_events
             }
         }',
 
+    UNIQUE KEY udx_user_event (user_id, event_id),
+    INDEX idx_user_event_time (user_id, event_time, event_type),
     INDEX idx_user_activity (user_id, event_date),
     INDEX idx_event_analysis (event_type, repo_id, event_date),
     INDEX idx_time_series (event_time)
 ) ENGINE = InnoDB
     COMMENT ='GitHub事件核心存储表';
 
+-- 已有库的 event_id 列、重复事件清理与 udx_user_event 唯一键由 backend/migrations.py 迁移 5 处理
+-- 之后的结构变更由 backend/migrations.py 执行并记录在 schema_version 表中
+
+-- 数据库结构版本表
+CREATE TABLE schema_version
+(
+    version     INT          NOT NULL PRIMARY KEY COMMENT '迁移版本号',
+    description VARCHAR(255) NOT NULL COMMENT '迁移说明',
+    applied_at  DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '执行时间'
+) ENGINE = InnoDB DEFAULT CHARSET = utf8mb4 COMMENT = '数据库结构版本表';
+
+-- 数据同步水位表：每个用户每个数据源一行，记录已入库的最大游标和上次响应的ETag
+CREATE TABLE sync_states
+(
+    id          INT AUTO_INCREMENT PRIMARY KEY,
+    user_id     INT          NOT NULL COMMENT '用户ID',
+    source      VARCHAR(30)  NOT NULL COMMENT '数据源，如 github_events',
+    last_cursor VARCHAR(64)  DEFAULT NULL COMMENT '水位游标（GitHub事件为已入库的最大事件ID）',
+    etag        VARCHAR(255) DEFAULT NULL COMMENT '上次响应的ETag，用于条件请求',
+    synced_at   DATETIME     DEFAULT NULL COMMENT '最近一次成功检查的时间',
+    changed_at  DATETIME     DEFAULT NULL COMMENT '最近一次写入新数据的时间',
+
+    UNIQUE KEY udx_user_source (user_id, source),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+) ENGINE = InnoDB DEFAULT CHARSET = utf8mb4 COMMENT = '数据同步水位表';
+
 
 # -- 简化Anki记录
 # CREATE TABLE anki_logs
@@ -294,7 +419,9 @@ CREATE TABLE github_repos (
     pushed_at       DATETIME     NOT NULL COMMENT '最后推送时间',
     status          TINYINT      NOT NULL DEFAULT 1 COMMENT '状态：1-正常，0-已删除',
     
-    INDEX idx_user_repo (user_id, github_id),
+    UNIQUE KEY udx_user_repo (user_id, github_id),
     INDEX idx_updated_at (updated_at),
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-) ENGINE = InnoDB DEFAULT CHARSET = utf8mb4 COMMENT = 'GitHub仓库信息表';
\ No newline at end of file
+) ENGINE = InnoDB DEFAULT CHARSET = utf8mb4 COMMENT = 'GitHub仓库信息表';
+
+-- 已有库的重复仓库清理与 idx_user_repo 改为唯一键 udx_user_repo 由 backend/migrations.py 迁移 6 处理
\ No newline at end of file
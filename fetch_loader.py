@@ -1,14 +1,39 @@
-import aiohttp
 import asyncio
 import json
 import base64
 import requests
 import logging
-from datetime import datetime
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import islice
 from pathlib import Path
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy.orm import Session
 import pytz
 
+sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+from github_client import GitHubPager, EVENTS_MAX_ITEMS, MAX_PER_PAGE, DEFAULT_CONCURRENCY, user_events_url
+from http_client import HttpClientPool
+from raw_archive import default_archive
+from daily_status import materialize_recent
+from rollups import get_timezone
+from toggl_dimensions import content_hash, save_dimensions, transform_dimensions
+from migrations import ensure_schema
+
+# 数据同步水位中的数据源标识
+GITHUB_EVENTS_SOURCE = 'github_events'
+TOGGL_ENTRIES_SOURCE = 'toggl_time_entries'
+TOGGL_SNAPSHOT_SOURCE = 'toggl_snapshot'
+# 单用户模式下数据归属的本地用户
+DEFAULT_USER_ID = 1
+# 批量写入时每批的行数
+DEFAULT_BATCH_SIZE = 500
+TOGGL_API_URL = 'https://api.track.toggl.com/api/v9'
+# Toggl /me 响应中每次请求都可能变化、不参与归档去重的顶层字段
+TOGGL_VOLATILE_KEYS = ('at',)
+
 def setup_logging():
     """配置日志系统"""
     # 获取当前文件所在目录
@@ -74,50 +99,82 @@ def get_database_engine(logger):
     try:
         config = load_config()
         db_config = config['database']
+        pool_size = config.get('loader', {}).get('db_pool_size', 5)
         
         url = f"mysql+pymysql://{db_config['username']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}?charset={db_config['charset']}"
-        engine = create_engine(url, echo=False)
+        engine = create_engine(url, echo=False, pool_size=pool_size, pool_pre_ping=True)
         logger.info("数据库连接成功")
         return engine
     except Exception as e:
         logger.error(f"获取数据库引擎失败: {e}", exc_info=True)
         raise
 
-async def fetch_github_data(user, api_type='events', logger=None):
-    """获取GitHub数据"""
-    logger.info(f"开始获取GitHub用户 {user} 的{api_type}数据")
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-    
-    api_urls = {
-        'events': f'https://api.github.com/users/{user}/events'
+def iter_batches(rows, batch_size):
+    """把任意可迭代对象切分成固定大小的列表"""
+    iterator = iter(rows)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def bulk_write(engine, sql, rows, logger, batch_size=DEFAULT_BATCH_SIZE):
+    """在单个事务内分批写入多行数据
+
+    每批以参数列表执行一次 executemany，PyMySQL 会把 INSERT ... VALUES
+    改写为一条多行插入语句（ON DUPLICATE KEY UPDATE 同样适用），
+    整个写入只提交一次。
+
+    Args:
+        engine: SQLAlchemy数据库引擎
+        sql: 带命名参数的 INSERT / UPSERT 语句
+        rows: 参数字典的可迭代对象，可以是生成器
+        logger: 日志记录器
+        batch_size: 每批的行数
+
+    Returns:
+        list: 每批的统计信息 {'rows': 行数, 'seconds': 耗时}
+    """
+    statement = text(sql)
+    batch_stats = []
+    with engine.begin() as conn:
+        for batch in iter_batches(rows, batch_size):
+            started = time.perf_counter()
+            conn.execute(statement, batch)
+            elapsed = time.perf_counter() - started
+            batch_stats.append({'rows': len(batch), 'seconds': round(elapsed, 4)})
+            logger.debug(f"批次写入 {len(batch)} 行，耗时 {elapsed:.3f}s")
+    return batch_stats
+
+def summarize_batches(batch_stats):
+    """汇总批量写入统计"""
+    total_rows = sum(stat['rows'] for stat in batch_stats)
+    total_seconds = sum(stat['seconds'] for stat in batch_stats)
+    return {
+        'batches': len(batch_stats),
+        'rows': total_rows,
+        'seconds': round(total_seconds, 4),
+        'rows_per_second': round(total_rows / total_seconds, 1) if total_seconds > 0 else None
     }
-    
-    if api_type not in api_urls:
-        logger.error(f"不支持的API类型: {api_type}")
-        return None
-    
-    async with aiohttp.ClientSession() as session:
-        try:
-            logger.debug(f"发送请求到GitHub API: {api_urls[api_type]}")
-            async with session.get(api_urls[api_type], headers=headers) as response:
-                response.raise_for_status()
-                data = await response.json()
-                
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                date = datetime.now().strftime("%Y%m%d")
-                data_dir = setup_data_directory('github', date)
-                
-                filename = data_dir / f"{api_type}_{timestamp}.json"
-                with open(filename, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, indent=2, ensure_ascii=False)
-                logger.info(f"GitHub {api_type} 数据已保存到文件: {filename}")
-                
-                return data
-        except Exception as e:
-            logger.error(f"获取GitHub {api_type} 数据失败: {e}", exc_info=True)
-            return None
-
-def fetch_toggl_data(api_token, logger):
+
+def save_raw_data(data, source, name, logger=None, ignore_keys=(), user_id=None):
+    """把接口原始响应归档到 data/YYYY/MM/DD/<source>.ndjson.gz，同一用户当天内容相同的响应只保存一次
+
+    压缩和写文件是阻塞操作，异步代码中用 asyncio.to_thread 调用。
+
+    Returns:
+        Path: 归档段文件路径
+    """
+    scope = f'u{user_id}' if user_id is not None else None
+    result = default_archive.write(source, name, data, ignore_keys=ignore_keys, scope=scope)
+    if logger:
+        if result.duplicate:
+            logger.info(f"{name} 与当天已归档内容相同（{result.digest[:12]}），跳过写入")
+        else:
+            logger.info(f"{name} 已归档到 {result.path}（{result.digest[:12]}）")
+    return result.path
+
+async def fetch_toggl_data(session, api_token, logger, user_id=DEFAULT_USER_ID):
     """获取Toggl用户数据，包含相关数据"""
     logger.info("开始获取Toggl用户数据")
     auth = base64.b64encode(f"{api_token}:api_token".encode()).decode("ascii")
@@ -129,64 +186,277 @@ def fetch_toggl_data(api_token, logger):
     try:
         logger.debug("发送请求到Toggl API，获取用户完整信息")
         params = {'with_related_data': 'true'}
-        response = requests.get(
-            'https://api.track.toggl.com/api/v9/me',
-            headers=headers,
-            params=params
-        )
-        response.raise_for_status()
-        data = response.json()
+        async with session.get(f'{TOGGL_API_URL}/me', headers=headers, params=params) as response:
+            response.raise_for_status()
+            data = await response.json()
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        date = datetime.now().strftime("%Y%m%d")
-        data_dir = setup_data_directory('toggl', date)
-        
-        filename = data_dir / f"user_data_{timestamp}.json"
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        logger.info(f"Toggl用户数据已保存到文件: {filename}")
+        filename = await asyncio.to_thread(
+            save_raw_data, data, 'toggl', f'user_data_u{user_id}', logger, TOGGL_VOLATILE_KEYS, user_id
+        )
         
         return data, filename  # 返回数据和文件路径
     except Exception as e:
         logger.error(f"获取Toggl数据失败: {e}", exc_info=True)
         return None, None
 
-def save_toggl_data_to_db(data, engine, logger):
-    """将Toggl数据保存到MySQL数据库"""
+TOGGL_SNAPSHOT_INSERT_SQL = """
+INSERT INTO toggl_datas (
+    user_id, toggl_accounts_id, clients, time_entries, 
+    workspace_list, tag_list, project_list, 
+    create_time, update_time
+) VALUES (
+    :user_id, :toggl_accounts_id, :clients, :time_entries,
+    :workspace_list, :tag_list, :project_list,
+    :create_time, :update_time
+)
+"""
+
+# 回放时先删除当天已有的快照再写入，重复回放同一天不会产生重复行
+TOGGL_SNAPSHOT_DELETE_DAY_SQL = """
+DELETE FROM toggl_datas
+WHERE user_id IN :user_ids AND update_time >= :day_start AND update_time < :day_end
+"""
+
+def transform_toggl_snapshot(data, user_id=DEFAULT_USER_ID, fetched_at=None):
+    """把Toggl /me 快照转换为 toggl_datas 表的一行"""
+    fetched_at = fetched_at or datetime.now()
+    return {
+        'user_id': user_id,
+        'toggl_accounts_id': data.get('toggl_accounts_id'),
+        'clients': json.dumps(data.get('clients', []), ensure_ascii=False),
+        'time_entries': json.dumps(data.get('time_entries', []), ensure_ascii=False),
+        'workspace_list': json.dumps(data.get('workspaces', []), ensure_ascii=False),
+        'tag_list': json.dumps(data.get('tags', []), ensure_ascii=False),
+        'project_list': json.dumps(data.get('projects', []), ensure_ascii=False),
+        'create_time': fetched_at,
+        'update_time': fetched_at
+    }
+
+def toggl_snapshot_hash(data, user_id=DEFAULT_USER_ID):
+    """快照内容哈希（不含抓取时间），用于判断快照是否需要重新写入"""
+    row = transform_toggl_snapshot(data, user_id)
+    del row['create_time'], row['update_time']
+    return content_hash([row])
+
+def save_toggl_data_to_db(data, engine, logger, user_id=DEFAULT_USER_ID, batch_size=DEFAULT_BATCH_SIZE):
+    """将Toggl数据保存到MySQL数据库
+
+    Returns:
+        list: 批量写入的每批统计信息
+    """
     try:
-        insert_data = {
-            'user_id':1,            
-            'toggl_accounts_id': data.get('toggl_accounts_id'),
-            'clients': json.dumps(data.get('clients', []), ensure_ascii=False),
-            'time_entries': json.dumps(data.get('time_entries', []), ensure_ascii=False),
-            'workspace_list': json.dumps(data.get('workspaces', []), ensure_ascii=False),
-            'tag_list': json.dumps(data.get('tags', []), ensure_ascii=False),
-            'project_list': json.dumps(data.get('projects', []), ensure_ascii=False),
-            'create_time': datetime.now(),
-            'update_time': datetime.now()
-        }
-        
-        insert_sql = """
-        INSERT INTO toggl_datas (
-            user_id, toggl_accounts_id, clients, time_entries, 
-            workspace_list, tag_list, project_list, 
-            create_time, update_time
-        ) VALUES (
-            :user_id, :toggl_accounts_id, :clients, :time_entries,
-            :workspace_list, :tag_list, :project_list,
-            :create_time, :update_time
-        )
-        """
-        
-        with engine.connect() as conn:
-            result = conn.execute(text(insert_sql), insert_data)
-            conn.commit()
-            logger.info(f"Toggl数据已保存到数据库，ID: {result.lastrowid}")
+        insert_data = transform_toggl_snapshot(data, user_id)
+        batch_stats = bulk_write(engine, TOGGL_SNAPSHOT_INSERT_SQL, [insert_data], logger, batch_size)
+        logger.info(f"Toggl数据已保存到数据库: {summarize_batches(batch_stats)}")
+        return batch_stats
             
     except Exception as e:
         logger.error(f"保存Toggl数据到数据库失败: {e}", exc_info=True)
         raise
 
+def save_toggl_dimensions(dimensions, engine, logger, user_id=DEFAULT_USER_ID):
+    """按内容哈希刷新Toggl维度表（项目、标签、客户、工作区），内容不变的维度不重写
+
+    Returns:
+        int: 本次重写的行数
+    """
+    with Session(engine) as db:
+        written = save_dimensions(db, user_id, dimensions)
+    if written:
+        logger.info(f"用户 {user_id} 的Toggl维度表已更新: {written}")
+    return sum(written.values())
+
+def parse_toggl_time(value):
+    """把Toggl的ISO时间字符串转换为UTC datetime，空值返回None"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).astimezone(pytz.UTC)
+
+def transform_toggl_entry(entry, user_id=DEFAULT_USER_ID):
+    """把一条Toggl时间记录转换为 toggl_time_entries 表的一行"""
+    stop = parse_toggl_time(entry.get('stop'))
+    deleted = parse_toggl_time(entry.get('server_deleted_at'))
+    return {
+        'user_id': user_id,
+        'entry_id': entry['id'],
+        'workspace_id': entry.get('workspace_id') or entry.get('wid'),
+        'project_id': entry.get('project_id'),
+        'description': (entry.get('description') or '')[:512],
+        'start_ts': int(parse_toggl_time(entry['start']).timestamp()),
+        'stop_ts': int(stop.timestamp()) if stop else None,
+        'duration': entry.get('duration', 0),
+        'tags': json.dumps(entry.get('tags') or [], ensure_ascii=False),
+        'at_ts': int(parse_toggl_time(entry['at']).timestamp() * 1000),
+        'deleted_at': int(deleted.timestamp()) if deleted else None,
+        'update_time': datetime.now()
+    }
+
+_TOGGL_ENTRY_UPDATE_COLUMNS = ['workspace_id', 'project_id', 'description', 'start_ts',
+                               'stop_ts', 'duration', 'tags', 'deleted_at', 'update_time']
+# 只在新数据的 at 不早于库中数据时覆盖；at_ts 放在最后更新，前面的 IF 比较的仍是旧值
+TOGGL_ENTRIES_UPSERT_SQL = """
+INSERT INTO toggl_time_entries (
+    user_id, entry_id, workspace_id, project_id, description,
+    start_ts, stop_ts, duration, tags, at_ts, deleted_at, update_time
+) VALUES (
+    :user_id, :entry_id, :workspace_id, :project_id, :description,
+    :start_ts, :stop_ts, :duration, :tags, :at_ts, :deleted_at, :update_time
+)
+ON DUPLICATE KEY UPDATE
+    %s,
+    at_ts = GREATEST(at_ts, VALUES(at_ts))
+""" % ",\n    ".join(
+    f"{column} = IF(VALUES(at_ts) >= at_ts, VALUES({column}), {column})"
+    for column in _TOGGL_ENTRY_UPDATE_COLUMNS
+)
+
+def upsert_toggl_time_entries(time_entries, engine, logger, user_id=DEFAULT_USER_ID, batch_size=DEFAULT_BATCH_SIZE):
+    """把Toggl时间记录增量写入 toggl_time_entries
+
+    只写入新增或 at 发生变化的条目；ON DUPLICATE KEY UPDATE 只在新数据的 at
+    不早于库中数据时覆盖，避免旧快照回写。接口返回的是一段时间窗口内的全部
+    记录，窗口内库里存在而本次未返回的条目视为已在Toggl删除。
+
+    Returns:
+        dict: 写入、删除的条目数和受影响条目的开始时间戳（含修改前的时间）
+    """
+    rows = [transform_toggl_entry(entry, user_id) for entry in time_entries]
+    result = {'written': 0, 'deleted': 0, 'affected_start_ts': set()}
+    if not rows:
+        return result
+
+    window_start = min(row['start_ts'] for row in rows)
+    select_sql = """
+    SELECT entry_id, at_ts, start_ts, deleted_at FROM toggl_time_entries
+    WHERE user_id = :user_id AND start_ts >= :window_start
+    """
+    with engine.connect() as conn:
+        existing = {
+            row.entry_id: row
+            for row in conn.execute(text(select_sql), {'user_id': user_id, 'window_start': window_start})
+        }
+
+    changed_rows = []
+    for row in rows:
+        current = existing.get(row['entry_id'])
+        if current is None or current.at_ts != row['at_ts']:
+            changed_rows.append(row)
+            result['affected_start_ts'].add(row['start_ts'])
+            if current is not None:
+                result['affected_start_ts'].add(current.start_ts)
+
+    seen_ids = {row['entry_id'] for row in rows}
+    vanished = [
+        current for entry_id, current in existing.items()
+        if entry_id not in seen_ids and current.deleted_at is None
+    ]
+
+    try:
+        if changed_rows:
+            batch_stats = bulk_write(engine, TOGGL_ENTRIES_UPSERT_SQL, changed_rows, logger, batch_size)
+            result['written'] = len(changed_rows)
+            logger.info(f"Toggl时间记录增量写入完成: {summarize_batches(batch_stats)}")
+
+        if vanished:
+            delete_sql = """
+            UPDATE toggl_time_entries SET deleted_at = :deleted_at, update_time = :update_time
+            WHERE user_id = :user_id AND entry_id = :entry_id
+            """
+            now = datetime.now()
+            deleted_rows = [
+                {'user_id': user_id, 'entry_id': current.entry_id,
+                 'deleted_at': int(now.timestamp()), 'update_time': now}
+                for current in vanished
+            ]
+            bulk_write(engine, delete_sql, deleted_rows, logger, batch_size)
+            result['deleted'] = len(vanished)
+            result['affected_start_ts'].update(current.start_ts for current in vanished)
+            logger.info(f"标记 {len(vanished)} 条已在Toggl删除的时间记录")
+
+        if not changed_rows and not vanished:
+            logger.info("Toggl时间记录没有变化")
+        return result
+    except Exception as e:
+        logger.error(f"写入Toggl时间记录失败: {e}", exc_info=True)
+        raise
+
+def local_day_bounds(day, tz):
+    """返回某时区下一天开始和结束的UTC秒级时间戳"""
+    start = tz.localize(datetime(day.year, day.month, day.day))
+    end = tz.localize(datetime(day.year, day.month, day.day) + timedelta(days=1))
+    return int(start.timestamp()), int(end.timestamp())
+
+def refresh_toggl_rollups(engine, logger, user_id, affected_start_ts, timezone=None, batch_size=DEFAULT_BATCH_SIZE):
+    """重算受影响日期的 (用户, 日期, 项目) 时长汇总
+
+    日期按用户时区划分，时间记录归入其开始时间所在的日期。只重算
+    affected_start_ts 涉及的日期；这些日期上已不再有时长的项目写为0，
+    保证 update_time 能反映变化。
+
+    Returns:
+        int: 写入的汇总行数
+    """
+    # 未设置或无法识别的时区使用默认时区，不中断汇总
+    tz = get_timezone(timezone)
+    dates = {datetime.fromtimestamp(ts, tz).date() for ts in affected_start_ts}
+    if not dates:
+        return 0
+
+    range_start, _ = local_day_bounds(min(dates), tz)
+    _, range_end = local_day_bounds(max(dates), tz)
+    entries_sql = """
+    SELECT start_ts, project_id, duration FROM toggl_time_entries
+    WHERE user_id = :user_id AND start_ts >= :range_start AND start_ts < :range_end
+      AND duration > 0 AND deleted_at IS NULL
+    """
+    existing_sql = text("""
+    SELECT record_date, project_id FROM toggl_daily_rollups
+    WHERE user_id = :user_id AND record_date IN :dates
+    """).bindparams(bindparam('dates', expanding=True))
+
+    totals = defaultdict(int)
+    with engine.connect() as conn:
+        for row in conn.execute(text(entries_sql), {
+            'user_id': user_id, 'range_start': range_start, 'range_end': range_end
+        }):
+            day = datetime.fromtimestamp(row.start_ts, tz).date()
+            if day in dates:
+                totals[(day, row.project_id or 0)] += row.duration
+        for row in conn.execute(existing_sql, {'user_id': user_id, 'dates': sorted(dates)}):
+            totals.setdefault((row.record_date, row.project_id), 0)
+
+    now = datetime.now()
+    rows = [
+        {'user_id': user_id, 'record_date': day, 'project_id': project_id,
+         'seconds': seconds, 'update_time': now}
+        for (day, project_id), seconds in totals.items()
+    ]
+    upsert_sql = """
+    INSERT INTO toggl_daily_rollups (user_id, record_date, project_id, seconds, update_time)
+    VALUES (:user_id, :record_date, :project_id, :seconds, :update_time)
+    ON DUPLICATE KEY UPDATE seconds = VALUES(seconds), update_time = VALUES(update_time)
+    """
+    if rows:
+        bulk_write(engine, upsert_sql, rows, logger, batch_size)
+    logger.info(f"用户 {user_id} 的Toggl日汇总已更新: {len(dates)} 天，{len(rows)} 行")
+    return len(rows)
+
+def rebuild_toggl_rollups(engine, logger, user_id, timezone=None, batch_size=DEFAULT_BATCH_SIZE):
+    """按用户全部时间记录重建日汇总（首次启用或修改时区后使用）"""
+    select_sql = """
+    SELECT start_ts FROM toggl_time_entries WHERE user_id = :user_id AND deleted_at IS NULL
+    """
+    with engine.connect() as conn:
+        start_ts = {row.start_ts for row in conn.execute(text(select_sql), {'user_id': user_id})}
+    return refresh_toggl_rollups(engine, logger, user_id, start_ts, timezone, batch_size)
+
+def has_toggl_rollups(engine, user_id):
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT 1 FROM toggl_daily_rollups WHERE user_id = :user_id LIMIT 1"),
+            {'user_id': user_id}
+        ).first() is not None
+
 def update_config_token(email, password):
     """更新配置文件中的API token"""
     auth = base64.b64encode(f"{email}:{password}".encode()).decode("ascii")
@@ -214,84 +484,371 @@ def update_config_token(email, password):
         print(f"获取API token失败: {e}")
         return False
 
-def save_github_events_to_db(events_data, engine, logger):
-    """将GitHub事件数据保存到数据库
+def bootstrap_single_user(engine, config, logger, user_id=DEFAULT_USER_ID):
+    """旧版单用户安装的迁移：把 config.json 中的GitHub用户名和Toggl token写入默认用户
+
+    同步任务按用户表运行，只补充默认用户还没有配置的字段，不覆盖用户表中已有的值。
+    config.json 中只有Toggl邮箱和密码时，先换取 token 并写回配置文件（与旧版行为一致）。
+
+    Returns:
+        int: 更新的用户数（0 或 1）
+    """
+    github_username = config.get('github', {}).get('username')
+    toggl_config = config.get('toggl', {})
+    if not toggl_config.get('api_token') and toggl_config.get('email') and toggl_config.get('password'):
+        logger.info("Toggl API token不存在，尝试获取新token")
+        if update_config_token(toggl_config['email'], toggl_config['password']):
+            logger.info("Token更新成功")
+            toggl_config = load_config()['toggl']
+        else:
+            logger.error("Token更新失败")
+    api_token = toggl_config.get('api_token')
+    if not github_username and not api_token:
+        return 0
+
+    update_sql = """
+    UPDATE users
+    SET github_username = COALESCE(NULLIF(github_username, ''), :github_username),
+        toggl_api_token = COALESCE(NULLIF(toggl_api_token, ''), :toggl_api_token)
+    WHERE id = :user_id
+      AND (COALESCE(github_username, '') = '' OR COALESCE(toggl_api_token, '') = '')
+    """
+    with engine.begin() as conn:
+        updated = conn.execute(text(update_sql), {
+            'github_username': github_username or None,
+            'toggl_api_token': api_token or None,
+            'user_id': user_id,
+        }).rowcount
+    if updated:
+        logger.info(f"已把 config.json 中的GitHub / Toggl 账号写入用户 {user_id}")
+    return updated
+
+def load_sync_state(engine, user_id, source):
+    """读取用户某数据源的同步水位
+
+    Returns:
+        dict: 包含 last_cursor 和 etag，没有记录时均为 None
+    """
+    select_sql = """
+    SELECT last_cursor, etag FROM sync_states
+    WHERE user_id = :user_id AND source = :source
+    """
+    with engine.connect() as conn:
+        row = conn.execute(text(select_sql), {'user_id': user_id, 'source': source}).mappings().first()
+    if not row:
+        return {'last_cursor': None, 'etag': None}
+    return dict(row)
+
+def save_sync_state(engine, user_id, source, last_cursor, etag, changed):
+    """保存同步水位
+
+    synced_at 每次成功检查都会刷新；changed_at 只在本次确实写入了新数据时刷新，
+    读取端可以据此判断用户数据是否有更新。
+    """
+    now = datetime.now()
+    upsert_sql = """
+    INSERT INTO sync_states (user_id, source, last_cursor, etag, synced_at, changed_at)
+    VALUES (:user_id, :source, :last_cursor, :etag, :synced_at, :changed_at)
+    ON DUPLICATE KEY UPDATE
+        last_cursor = VALUES(last_cursor),
+        etag = VALUES(etag),
+        synced_at = VALUES(synced_at),
+        changed_at = COALESCE(VALUES(changed_at), changed_at)
+    """
+    with engine.connect() as conn:
+        conn.execute(text(upsert_sql), {
+            'user_id': user_id,
+            'source': source,
+            'last_cursor': last_cursor,
+            'etag': etag,
+            'synced_at': now,
+            'changed_at': now if changed else None
+        })
+        conn.commit()
+
+def filter_new_github_events(events_data, last_cursor):
+    """过滤出水位之后的新事件
+
+    GitHub事件ID单调递增，ID不大于上次已入库最大ID的事件都已处理过。
+
+    Returns:
+        (new_events, cursor): 新事件列表和更新后的水位
+    """
+    last_id = int(last_cursor) if last_cursor else 0
+    new_events = [event for event in events_data if int(event['id']) > last_id]
+    if new_events:
+        last_id = max(int(event['id']) for event in new_events)
+    return new_events, (str(last_id) if last_id else last_cursor)
+
+def transform_github_event(event, user_id=DEFAULT_USER_ID):
+    """把一条GitHub API事件转换为 github_events 表的一行"""
+    # 转换时间格式
+    event_time = datetime.strptime(
+        event['created_at'], 
+        '%Y-%m-%dT%H:%M:%SZ'
+    ).replace(tzinfo=pytz.UTC).astimezone(pytz.timezone('Asia/Shanghai'))
+    
+    # 准备基础数据
+    row = {
+        'user_id': user_id,
+        'event_id': int(event['id']),
+        'github_user_id': event['actor']['id'],
+        'event_type': event['type'],
+        'repo_id': event['repo']['id'],
+        'repo_name': event['repo']['name'],
+        'repo_url': f"https://github.com/{event['repo']['name']}",
+        'event_time': event_time,  # 使用转换后的时间
+        'event_date': event_time.date(),
+        'commit_count': 0,
+        'code_changes': '{}',
+        'event_specific': '{}'
+    }
+    
+    # 处理特定事件类型的数据
+    if event['type'] == 'PushEvent':
+        row['commit_count'] = len(event['payload'].get('commits', []))
+        # 这里可以添加代码变更统计的处理
+        
+    # 保存事件特有数据
+    event_specific = {}
+    if event['type'] == 'PullRequestEvent':
+        pr_data = event['payload']['pull_request']
+        event_specific['PullRequest'] = {
+            'action': event['payload']['action'],
+            'number': pr_data['number'],
+            'state': pr_data['state'],
+            'comments': pr_data.get('comments', 0)
+        }
+    elif event['type'] == 'IssuesEvent':
+        issue_data = event['payload']['issue']
+        event_specific['Issue'] = {
+            'number': issue_data['number'],
+            'title': issue_data['title']
+        }
+    
+    row['event_specific'] = json.dumps(event_specific)
+    return row
+
+# 已存在的事件保持不变
+GITHUB_EVENTS_INSERT_SQL = """
+INSERT INTO github_events (
+    user_id, event_id, github_user_id, event_type, repo_id, 
+    repo_name, repo_url, event_time, event_date, commit_count,
+    code_changes, event_specific
+) VALUES (
+    :user_id, :event_id, :github_user_id, :event_type, :repo_id,
+    :repo_name, :repo_url, :event_time, :event_date, :commit_count,
+    :code_changes, :event_specific
+)
+ON DUPLICATE KEY UPDATE id = id
+"""
+
+def save_github_events_to_db(events_data, engine, logger, user_id=DEFAULT_USER_ID, batch_size=DEFAULT_BATCH_SIZE):
+    """将GitHub事件数据批量保存到数据库
+
+    以 (user_id, event_id) 唯一键去重，重复的事件不会再次写入。
     
     Args:
-        events_data: GitHub API返回的事件数据列表
+        events_data: GitHub API返回的事件数据（任意可迭代对象）
         engine: SQLAlchemy数据库引擎
         logger: 日志记录器
+        user_id: 数据归属的本地用户ID
+        batch_size: 每批写入的行数
+
+    Returns:
+        list: 批量写入的每批统计信息
     """
     try:
-        for event in events_data:
-            # 转换时间格式
-            event_time = datetime.strptime(
-                event['created_at'], 
-                '%Y-%m-%dT%H:%M:%SZ'
-            ).replace(tzinfo=pytz.UTC).astimezone(pytz.timezone('Asia/Shanghai'))
-            
-            # 准备基础数据
-            insert_data = {
-                'user_id': 1,  # 这里需要替换为实际的用户ID
-                'github_user_id': event['actor']['id'],
-                'event_type': event['type'],
-                'repo_id': event['repo']['id'],
-                'repo_name': event['repo']['name'],
-                'repo_url': f"https://github.com/{event['repo']['name']}",
-                'event_time': event_time,  # 使用转换后的时间
-                'commit_count': 0,
-                'code_changes': '{}',
-                'event_specific': '{}'
-            }
-            
-            # 处理特定事件类型的数据
-            if event['type'] == 'PushEvent':
-                insert_data['commit_count'] = len(event['payload'].get('commits', []))
-                # 这里可以添加代码变更统计的处理
-                
-            # 保存事件特有数据
-            event_specific = {}
-            if event['type'] == 'PullRequestEvent':
-                pr_data = event['payload']['pull_request']
-                event_specific['PullRequest'] = {
-                    'action': event['payload']['action'],
-                    'number': pr_data['number'],
-                    'state': pr_data['state'],
-                    'comments': pr_data.get('comments', 0)
-                }
-            elif event['type'] == 'IssuesEvent':
-                issue_data = event['payload']['issue']
-                event_specific['Issue'] = {
-                    'number': issue_data['number'],
-                    'title': issue_data['title']
-                }
-            
-            insert_data['event_specific'] = json.dumps(event_specific)
-            
-            # 执行插入
-            insert_sql = """
-            INSERT INTO github_events (
-                user_id, github_user_id, event_type, repo_id, 
-                repo_name, repo_url, event_time, commit_count,
-                code_changes, event_specific
-            ) VALUES (
-                :user_id, :github_user_id, :event_type, :repo_id,
-                :repo_name, :repo_url, :event_time, :commit_count,
-                :code_changes, :event_specific
-            )
-            """
-            
-            with engine.connect() as conn:
-                result = conn.execute(text(insert_sql), insert_data)
-                conn.commit()
-                logger.debug(f"GitHub事件已保存到数据库，ID: {result.lastrowid}")
-        
-        logger.info(f"成功保存 {len(events_data)} 条GitHub事件数据")
+        rows = (transform_github_event(event, user_id) for event in events_data)
+        batch_stats = bulk_write(engine, GITHUB_EVENTS_INSERT_SQL, rows, logger, batch_size)
+        logger.info(f"GitHub事件批量写入完成: {summarize_batches(batch_stats)}")
+        return batch_stats
             
     except Exception as e:
         logger.error(f"保存GitHub事件数据到数据库失败: {e}", exc_info=True)
         raise
 
+def reached_watermark(events_data, last_cursor):
+    """本页是否已包含水位之前（已入库）的事件"""
+    if not last_cursor:
+        return False
+    return any(int(event['id']) <= int(last_cursor) for event in events_data)
+
+async def sync_github_events(session, user, engine, logger, user_id=DEFAULT_USER_ID, batch_size=DEFAULT_BATCH_SIZE,
+                             concurrency=DEFAULT_CONCURRENCY, token=None):
+    """按水位增量同步GitHub事件
+
+    首页带 ETag 发送条件请求，304 时直接结束；首页已经翻到水位时不再请求
+    后续页面，否则并发拉取剩余页面（最多到API的300条上限）。每页到达后
+    立即落盘并写库，全部完成后推进水位。请求失败时抛出异常，水位保持不变。
+
+    Returns:
+        int: 本次写入的新事件数
+    """
+    logger.info(f"开始获取GitHub用户 {user} 的events数据")
+    state = await asyncio.to_thread(load_sync_state, engine, user_id, GITHUB_EVENTS_SOURCE)
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+    if token:
+        headers['Authorization'] = f'token {token}'
+    cursor = state['last_cursor']
+    written = 0
+    pages = 0
+
+    async def handle_page(events_data):
+        nonlocal cursor, written, pages
+        pages += 1
+        await asyncio.to_thread(
+            save_raw_data, events_data, 'github', f'events_u{user_id}_p{pages}', logger, (), user_id
+        )
+        new_events, page_cursor = filter_new_github_events(events_data, state['last_cursor'])
+        if new_events:
+            await asyncio.to_thread(save_github_events_to_db, new_events, engine, logger, user_id, batch_size)
+            written += len(new_events)
+            cursor = str(max(int(cursor or 0), int(page_cursor)))
+
+    pager = GitHubPager(
+        session,
+        user_events_url(user),
+        headers=headers,
+        per_page=MAX_PER_PAGE,
+        max_pages=EVENTS_MAX_ITEMS // MAX_PER_PAGE,
+        concurrency=concurrency,
+        etag=state['etag']
+    )
+    first_page = await pager.first_page()
+    if pager.not_modified:
+        logger.info(f"GitHub用户 {user} 的events数据自上次同步后无变化")
+    else:
+        await handle_page(first_page)
+        if not reached_watermark(first_page, state['last_cursor']):
+            async for events_data in pager.remaining_pages():
+                await handle_page(events_data)
+
+    if not written:
+        logger.info(f"GitHub用户 {user} 没有新的事件需要写入")
+    await asyncio.to_thread(
+        save_sync_state, engine, user_id, GITHUB_EVENTS_SOURCE, cursor, pager.etag, bool(written)
+    )
+    return written
+
+def save_toggl_sync(toggl_data, engine, logger, user_id=DEFAULT_USER_ID, batch_size=DEFAULT_BATCH_SIZE,
+                    timezone=None):
+    """保存Toggl快照、增量写入时间记录、维护日汇总和每日状态并更新水位
+
+    快照的内容哈希记在 toggl_snapshot 水位的 last_cursor 中，内容不变时不再写入 toggl_datas。
+
+    Returns:
+        int: 本次写入的行数
+    """
+    snapshot_hash = toggl_snapshot_hash(toggl_data, user_id)
+    snapshot_changed = load_sync_state(engine, user_id, TOGGL_SNAPSHOT_SOURCE)['last_cursor'] != snapshot_hash
+    if snapshot_changed:
+        save_toggl_data_to_db(toggl_data, engine, logger, user_id, batch_size)
+    save_sync_state(engine, user_id, TOGGL_SNAPSHOT_SOURCE, snapshot_hash, None, changed=snapshot_changed)
+    dimension_rows = save_toggl_dimensions(transform_dimensions(toggl_data), engine, logger, user_id)
+    entry_result = upsert_toggl_time_entries(
+        toggl_data.get('time_entries') or [], engine, logger, user_id, batch_size
+    )
+    changed = entry_result['written'] + entry_result['deleted']
+    if not has_toggl_rollups(engine, user_id):
+        changed += rebuild_toggl_rollups(engine, logger, user_id, timezone, batch_size)
+    elif changed:
+        changed += refresh_toggl_rollups(
+            engine, logger, user_id, entry_result['affected_start_ts'], timezone, batch_size
+        )
+    save_sync_state(engine, user_id, TOGGL_ENTRIES_SOURCE, None, None, changed=bool(changed))
+    # 只重算日汇总或计划有变化的日期，首次同步时补齐过去一年
+    with Session(engine) as db:
+        days = materialize_recent(db, user_id, timezone)
+    if days:
+        logger.info(f"用户 {user_id} 更新每日状态 {days} 天")
+    return int(snapshot_changed) + dimension_rows + changed + days
+
+async def sync_toggl_data(session, api_token, engine, logger, user_id=DEFAULT_USER_ID, batch_size=DEFAULT_BATCH_SIZE,
+                          timezone=None):
+    """同步一个用户的Toggl数据
+
+    Returns:
+        int: 本次写入的行数
+    """
+    toggl_data, _ = await fetch_toggl_data(session, api_token, logger, user_id)
+    if toggl_data is None:
+        raise RuntimeError("获取Toggl数据失败")
+    return await asyncio.to_thread(save_toggl_sync, toggl_data, engine, logger, user_id, batch_size, timezone)
+
+def load_active_users(engine):
+    """读取所有状态正常、配置了GitHub或Toggl账号的用户"""
+    select_sql = """
+    SELECT id, username, github_username, github_token, toggl_api_token, timezone
+    FROM users
+    WHERE status = 1
+      AND (github_username IS NOT NULL OR toggl_api_token IS NOT NULL)
+    """
+    with engine.connect() as conn:
+        return [dict(row) for row in conn.execute(text(select_sql)).mappings()]
+
+async def run_sync(engine, logger, loader_config=None):
+    """并发同步所有活跃用户的GitHub和Toggl数据
+
+    每个数据源各有一个并发上限（loader.github_concurrency / loader.toggl_concurrency），
+    单个用户单个数据源失败只记录错误，不影响其他任务。
+
+    Returns:
+        dict: 本次同步的汇总统计
+    """
+    loader_config = loader_config or {}
+    batch_size = loader_config.get('batch_size', DEFAULT_BATCH_SIZE)
+    limits = {
+        'github': asyncio.Semaphore(loader_config.get('github_concurrency', 8)),
+        'toggl': asyncio.Semaphore(loader_config.get('toggl_concurrency', 4)),
+    }
+    page_concurrency = loader_config.get('github_page_concurrency', DEFAULT_CONCURRENCY)
+
+    started = time.perf_counter()
+    users = await asyncio.to_thread(load_active_users, engine)
+    logger.info(f"共 {len(users)} 个活跃用户待同步")
+
+    summary = {'users': len(users), 'tasks': 0, 'failed': 0, 'rows': 0, 'failures': []}
+
+    async def run_task(source, user, make_coroutine):
+        async with limits[source]:
+            try:
+                rows = await make_coroutine()
+                summary['rows'] += rows
+            except Exception as e:
+                summary['failed'] += 1
+                summary['failures'].append({'user_id': user['id'], 'source': source, 'error': str(e)})
+                logger.error(f"用户 {user['id']} 的{source}同步失败: {e}", exc_info=True)
+            finally:
+                summary['tasks'] += 1
+
+    # 所有用户共用一个HTTP连接池，配置项见 loader.http；先启动连接池再创建任务，
+    # 启动后紧接 try，任何异常都会关闭连接池
+    http_pool = HttpClientPool(**loader_config.get('http', {}))
+    session = await http_pool.start()
+    try:
+        tasks = []
+        for user in users:
+            if user['github_username']:
+                tasks.append(run_task('github', user, lambda user=user: sync_github_events(
+                    session, user['github_username'], engine, logger, user['id'], batch_size,
+                    page_concurrency, user['github_token']
+                )))
+            if user['toggl_api_token']:
+                tasks.append(run_task('toggl', user, lambda user=user: sync_toggl_data(
+                    session, user['toggl_api_token'], engine, logger, user['id'], batch_size, user['timezone']
+                )))
+        await asyncio.gather(*tasks)
+    finally:
+        summary['http'] = http_pool.stats()
+        await http_pool.close()
+
+    elapsed = time.perf_counter() - started
+    summary['seconds'] = round(elapsed, 2)
+    summary['users_per_second'] = round(len(users) / elapsed, 2) if elapsed > 0 else None
+    summary['rows_per_second'] = round(summary['rows'] / elapsed, 1) if elapsed > 0 else None
+    return summary
+
 if __name__ == "__main__":
     try:
         # 设置日志
@@ -302,35 +859,21 @@ if __name__ == "__main__":
         config = load_config()
         logger.debug("配置文件加载成功")
         
-        # 创建数据库引擎
+        # 创建数据库引擎，并确认表结构已迁移到最新版本
         engine = get_database_engine(logger)
+        ensure_schema(engine)
+
+        # 旧版单用户安装的账号配置在 config.json 中，写入默认用户后按用户表同步
+        bootstrap_single_user(engine, config, logger)
         
-        # 如果API token为空，则尝试获取
-        if not config['toggl'].get('api_token'):
-            logger.info("Toggl API token不存在，尝试获取新token")
-            if update_config_token(
-                config['toggl']['email'],
-                config['toggl']['password']
-            ):
-                logger.info("Token更新成功")
-                config = load_config()
-            else:
-                logger.error("Token更新失败")
-                exit(1)
-        
-        # GitHub数据获取和保存
-        github_events = asyncio.run(fetch_github_data(
-            config['github']['username'],
-            api_type='events',
-            logger=logger
-        ))
-        if github_events:
-            save_github_events_to_db(github_events, engine, logger)
-        
-        # Toggl数据获取和保存
-        toggl_data, toggl_file = fetch_toggl_data(config['toggl']['api_token'], logger)
-        if toggl_data:
-            save_toggl_data_to_db(toggl_data, engine, logger)
+        # 按用户表并发同步所有用户的GitHub和Toggl数据
+        summary = asyncio.run(run_sync(engine, logger, config.get('loader', {})))
+        logger.info(f"HTTP连接池统计: {summary['http']}")
+        logger.info(
+            f"同步汇总: 用户 {summary['users']} 个，任务 {summary['tasks']} 个（失败 {summary['failed']} 个），"
+            f"写入 {summary['rows']} 行，耗时 {summary['seconds']}s，"
+            f"{summary['users_per_second']} 用户/秒，{summary['rows_per_second']} 行/秒"
+        )
         
         logger.info("数据同步任务完成")
     
@@ -0,0 +1,165 @@
+"""接口原始响应归档
+
+每条原始响应按内容计算 SHA-256，同一天同一数据源、同一去重范围（如用户）内内容相同
+的响应只保存一次（可以指定计算哈希时忽略的顶层字段，如每次请求都会变化的时间戳）。
+不同用户的响应即使内容相同（如空的事件页）也各自保存，回放时按记录名归属用户。
+记录以独立的 gzip 成员追加到按天、按数据源划分的 NDJSON 段文件中，另有一个索引文件
+记录每条记录的名称、哈希、偏移和长度，便于按记录随机读取或整体回放：
+
+    data/YYYY/MM/DD/<source>.ndjson.gz    归档段（多个 gzip 成员首尾相接，可直接 zcat）
+    data/YYYY/MM/DD/<source>.index.ndjson 索引，每行一个 JSON 对象
+
+旧版本写入的 data/YYYY/MM/DD/<source>/*.json 文件保持原样，可用 iter_legacy_files 读取。
+"""
+import gzip
+import hashlib
+import json
+import threading
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, NamedTuple, Optional, Set, Tuple
+
+DEFAULT_ROOT = Path(__file__).parent / 'data'
+SEGMENT_SUFFIX = '.ndjson.gz'
+INDEX_SUFFIX = '.index.ndjson'
+
+
+class ArchiveResult(NamedTuple):
+    path: Path  # 归档段文件
+    digest: str  # 内容哈希
+    duplicate: bool  # 内容与当天同一去重范围内已归档的记录相同，未重复写入
+
+
+def canonical_json(payload: Any) -> bytes:
+    """紧凑、键有序的 JSON，同一内容总是得到相同的字节串"""
+    return json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def parse_day(value) -> date:
+    """接受 date、datetime 或 YYYYMMDD / YYYY-MM-DD 字符串"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value.replace('-', ''), '%Y%m%d').date()
+
+
+def iter_days(start: date, end: date) -> Iterator[date]:
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
+
+class RawArchive:
+    """按天分段的去重归档（同一进程内线程安全）"""
+
+    def __init__(self, root: Path = DEFAULT_ROOT, compresslevel: int = 6):
+        self.root = Path(root)
+        self.compresslevel = compresslevel
+        self._lock = threading.Lock()
+        # (日期, 数据源) -> 当天已归档的 (去重范围, 内容哈希)
+        self._digests: Dict[Tuple[date, str], Set[Tuple[Optional[str], str]]] = {}
+
+    def day_dir(self, day: date) -> Path:
+        return self.root / f"{day:%Y}" / f"{day:%m}" / f"{day:%d}"
+
+    def segment_path(self, source: str, day: date) -> Path:
+        return self.day_dir(day) / f"{source}{SEGMENT_SUFFIX}"
+
+    def index_path(self, source: str, day: date) -> Path:
+        return self.day_dir(day) / f"{source}{INDEX_SUFFIX}"
+
+    def _known_digests(self, source: str, day: date) -> Set[Tuple[Optional[str], str]]:
+        key = (day, source)
+        if key not in self._digests:
+            # 只保留当天的哈希集合，跨天后释放前一天的；旧索引条目没有去重范围
+            self._digests = {k: v for k, v in self._digests.items() if k[0] == day}
+            self._digests[key] = {(entry.get('scope'), entry['sha256']) for entry in self.read_index(source, day)}
+        return self._digests[key]
+
+    def write(self, source: str, name: str, payload: Any, when: Optional[datetime] = None,
+              ignore_keys: Iterable[str] = (), scope: Optional[str] = None) -> ArchiveResult:
+        """归档一条原始响应；当天同一 scope 内已有相同内容时只返回已有记录的信息
+
+        ignore_keys 中的顶层字段不参与内容哈希，但仍随记录完整保存。
+        scope 为去重范围（如 u3 表示用户3），只与同一范围内的记录比较，并写入索引。
+        """
+        when = when or datetime.now()
+        day = when.date()
+        body = canonical_json(payload)
+        if ignore_keys and isinstance(payload, dict):
+            hashed = canonical_json({k: v for k, v in payload.items() if k not in ignore_keys})
+        else:
+            hashed = body
+        digest = hashlib.sha256(hashed).hexdigest()
+        segment = self.segment_path(source, day)
+
+        with self._lock:
+            known = self._known_digests(source, day)
+            if (scope, digest) in known:
+                return ArchiveResult(segment, digest, True)
+
+            member = gzip.compress(body + b'\n', compresslevel=self.compresslevel)
+            segment.parent.mkdir(parents=True, exist_ok=True)
+            with open(segment, 'ab') as f:
+                offset = f.tell()
+                f.write(member)
+            entry = {
+                'name': name,
+                'sha256': digest,
+                'offset': offset,
+                'length': len(member),
+                'size': len(body),
+                'archived_at': when.isoformat(timespec='seconds'),
+            }
+            if scope is not None:
+                entry['scope'] = scope
+            with open(self.index_path(source, day), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            known.add((scope, digest))
+        return ArchiveResult(segment, digest, False)
+
+    def read_index(self, source: str, day: date) -> list:
+        path = self.index_path(source, day)
+        if not path.exists():
+            return []
+        with open(path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def read_record(self, source: str, day: date, entry: Dict[str, Any]) -> Any:
+        """按索引条目读取单条记录"""
+        with open(self.segment_path(source, day), 'rb') as f:
+            f.seek(entry['offset'])
+            return json.loads(gzip.decompress(f.read(entry['length'])))
+
+    def iter_records(self, source: str, start, end=None) -> Iterator[Tuple[Dict[str, Any], Any]]:
+        """按日期和写入顺序回放 [start, end] 内某数据源的全部记录，产出 (索引条目, 原始响应)"""
+        start = parse_day(start)
+        end = parse_day(end) if end else start
+        for day in iter_days(start, end):
+            entries = self.read_index(source, day)
+            if not entries:
+                continue
+            with open(self.segment_path(source, day), 'rb') as f:
+                for entry in entries:
+                    f.seek(entry['offset'])
+                    yield dict(entry, day=day.isoformat()), json.loads(gzip.decompress(f.read(entry['length'])))
+
+    def iter_legacy_files(self, source: str, start, end=None) -> Iterator[Tuple[Dict[str, Any], Any]]:
+        """读取旧版本按文件保存的 data/YYYY/MM/DD/<source>/*.json，产出格式与 iter_records 相同"""
+        start = parse_day(start)
+        end = parse_day(end) if end else start
+        for day in iter_days(start, end):
+            legacy_dir = self.day_dir(day) / source
+            if not legacy_dir.is_dir():
+                continue
+            # 文件名以 _YYYYMMDD_HHMMSS 结尾，按时间排序
+            for path in sorted(legacy_dir.glob('*.json'), key=lambda p: p.stem[-15:]):
+                with open(path, encoding='utf-8') as f:
+                    payload = json.load(f)
+                yield {'name': path.stem, 'file': str(path), 'day': day.isoformat()}, payload
+
+
+# 默认归档位置：项目根目录下的 data/
+default_archive = RawArchive()
@@ -0,0 +1,377 @@
+"""从 data/ 下保存的原始响应重建数据库
+
+按日期范围回放归档段（data/YYYY/MM/DD/<source>.ndjson.gz）和旧版本的 JSON 文件，
+使用与 fetch_loader.py 相同的转换函数生成 github_events / toggl_time_entries /
+toggl_datas 的行。各天的解析和转换在多个进程中并行完成，写库按日期顺序串行执行，
+每写完一天更新一次检查点，中断后可用 --resume 从下一天继续（数据源、旧文件和默认用户
+等设置从检查点恢复）。快照按天整体替换、GitHub事件和时间记录按唯一键写入，重复回放
+同一天结果不变。全部写完后为涉及的用户重建Toggl日汇总和每日状态。
+
+用法:
+    python replay_loader.py --start 2025-01-01 --end 2025-03-31 --workers 4
+    python replay_loader.py --resume
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import bindparam, func, select, text
+from sqlalchemy.orm import Session
+
+from fetch_loader import (
+    DEFAULT_BATCH_SIZE, DEFAULT_USER_ID, GITHUB_EVENTS_INSERT_SQL, GITHUB_EVENTS_SOURCE, TOGGL_ENTRIES_SOURCE,
+    TOGGL_ENTRIES_UPSERT_SQL, TOGGL_SNAPSHOT_DELETE_DAY_SQL, TOGGL_SNAPSHOT_INSERT_SQL, TOGGL_SNAPSHOT_SOURCE,
+    bulk_write, get_database_engine, iter_batches, load_config, load_sync_state,
+    rebuild_toggl_rollups, save_sync_state, save_toggl_dimensions, setup_logging, summarize_batches,
+    transform_github_event, transform_toggl_entry, transform_toggl_snapshot,
+)
+from raw_archive import DEFAULT_ROOT, RawArchive, iter_days, parse_day
+import models
+from daily_status import materialize_recent
+from migrations import ensure_schema
+from toggl_dimensions import transform_dimensions
+
+DEFAULT_CHECKPOINT = DEFAULT_ROOT / 'replay_checkpoint.json'
+SOURCES = ('github', 'toggl')
+# 记录名中的用户ID，如 events_u3_p1、user_data_u3；旧文件没有用户ID，归属默认用户
+_USER_PATTERN = re.compile(r'_u(\d+)(?:_|$)')
+
+
+def record_user_id(name, default_user_id):
+    match = _USER_PATTERN.search(name)
+    return int(match.group(1)) if match else default_user_id
+
+
+def record_time(meta, day):
+    """记录的抓取时间：归档条目取 archived_at，旧文件取文件名末尾的时间戳"""
+    if meta.get('archived_at'):
+        return datetime.fromisoformat(meta['archived_at'])
+    try:
+        return datetime.strptime(meta['name'][-15:], '%Y%m%d_%H%M%S')
+    except ValueError:
+        return datetime.combine(day, datetime.min.time())
+
+
+def iter_day_records(archive, source, day, include_legacy):
+    """按抓取时间顺序产出某天某数据源的全部记录（旧文件在前，归档段在后）"""
+    if include_legacy:
+        yield from archive.iter_legacy_files(source, day)
+    yield from archive.iter_records(source, day)
+
+
+def transform_day(root, day_iso, sources, default_user_id, include_legacy):
+    """解析并转换一天的原始数据（在工作进程中执行）
+
+    每次只在内存中保留一条原始记录，转换结果按唯一键去重：GitHub事件按
+    (user_id, event_id)，Toggl时间记录按 (user_id, entry_id) 保留 at 最新的一条，
+    Toggl快照每个用户只保留当天最后一份。
+
+    Returns:
+        dict: 当天的待写入行和记录数统计
+    """
+    archive = RawArchive(Path(root))
+    day = parse_day(day_iso)
+    events = {}
+    entries = {}
+    snapshots = {}
+    dimensions = {}
+    records = 0
+
+    for source in sources:
+        for meta, payload in iter_day_records(archive, source, day, include_legacy):
+            records += 1
+            user_id = record_user_id(meta['name'], default_user_id)
+            if source == 'github':
+                for event in payload:
+                    events[(user_id, int(event['id']))] = transform_github_event(event, user_id)
+                continue
+
+            # Toggl：/me 快照（含 time_entries）或旧版本单独保存的时间记录列表
+            if isinstance(payload, dict):
+                snapshots[user_id] = transform_toggl_snapshot(payload, user_id, record_time(meta, day))
+                dimensions[user_id] = transform_dimensions(payload)
+                time_entries = payload.get('time_entries') or []
+            else:
+                time_entries = payload
+            for entry in time_entries:
+                row = transform_toggl_entry(entry, user_id)
+                key = (user_id, row['entry_id'])
+                if key not in entries or entries[key]['at_ts'] <= row['at_ts']:
+                    entries[key] = row
+
+    return {
+        'day': day_iso,
+        'records': records,
+        'github_events': list(events.values()),
+        'toggl_entries': list(entries.values()),
+        'toggl_snapshots': list(snapshots.values()),
+        'toggl_dimensions': dimensions,
+    }
+
+
+def replace_day_snapshots(engine, day_iso, rows, batch_size):
+    """在同一事务中删除这些用户当天已有的快照并写入回放的快照"""
+    day_start = datetime.combine(parse_day(day_iso), datetime.min.time())
+    delete = text(TOGGL_SNAPSHOT_DELETE_DAY_SQL).bindparams(bindparam('user_ids', expanding=True))
+    insert = text(TOGGL_SNAPSHOT_INSERT_SQL)
+    with engine.begin() as conn:
+        conn.execute(delete, {
+            'user_ids': sorted({row['user_id'] for row in rows}),
+            'day_start': day_start,
+            'day_end': day_start + timedelta(days=1),
+        })
+        for batch in iter_batches(rows, batch_size):
+            conn.execute(insert, batch)
+
+
+def load_day(engine, logger, result, batch_size):
+    """写入一天的转换结果
+
+    Returns:
+        (written, latest_users): 写入行数，以及回放的快照是其最新快照的用户
+    """
+    written = 0
+    for sql, key in (
+        (GITHUB_EVENTS_INSERT_SQL, 'github_events'),
+        (TOGGL_ENTRIES_UPSERT_SQL, 'toggl_entries'),
+    ):
+        rows = result[key]
+        if rows:
+            batch_stats = bulk_write(engine, sql, rows, logger, batch_size)
+            logger.debug(f"{result['day']} {key}: {summarize_batches(batch_stats)}")
+            written += len(rows)
+    # 快照表没有唯一键，按天整体替换保证重复回放（或 --resume 重做中断的一天）不产生重复行
+    if result['toggl_snapshots']:
+        replace_day_snapshots(engine, result['day'], result['toggl_snapshots'], batch_size)
+        written += len(result['toggl_snapshots'])
+    # 维度表反映的是当前状态，只用该用户最新的快照刷新；回放较早的日期时不回退线上数据。
+    # 维度表按内容哈希比较，与前一天相同时不重写
+    snapshot_times = {row['user_id']: row['update_time'] for row in result['toggl_snapshots']}
+    latest_times = latest_snapshot_times(engine, snapshot_times)
+    latest_users = {
+        user_id for user_id, update_time in snapshot_times.items()
+        if update_time >= latest_times.get(user_id, update_time)
+    }
+    for user_id, dimensions in result['toggl_dimensions'].items():
+        if user_id in latest_users:
+            written += save_toggl_dimensions(dimensions, engine, logger, user_id)
+    return written, latest_users
+
+
+def latest_snapshot_times(engine, snapshot_times):
+    """各用户 toggl_datas 中最新快照的时间"""
+    if not snapshot_times:
+        return {}
+    table = models.TogglData.__table__
+    with engine.connect() as conn:
+        rows = conn.execute(select(
+            table.c.user_id, func.max(table.c.update_time)
+        ).where(
+            table.c.user_id.in_(sorted(snapshot_times))
+        ).group_by(table.c.user_id)).all()
+    return {user_id: latest for user_id, latest in rows if latest is not None}
+
+
+def mark_source_changed(engine, user_id, source):
+    """刷新数据源的 changed_at，保留同步任务记录的游标和 ETag"""
+    state = load_sync_state(engine, user_id, source)
+    save_sync_state(engine, user_id, source, state['last_cursor'], state['etag'], changed=True)
+
+
+def read_checkpoint(path):
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_checkpoint(path, checkpoint):
+    """先写临时文件再替换，避免中断时留下不完整的检查点"""
+    path = Path(path)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    tmp_path.replace(path)
+
+
+def find_first_day(root):
+    """data/ 下最早的日期目录"""
+    days = sorted(
+        path for path in Path(root).glob('[0-9][0-9][0-9][0-9]/[0-9][0-9]/[0-9][0-9]') if path.is_dir()
+    )
+    if not days:
+        return None
+    year, month, day = days[0].parts[-3:]
+    return parse_day(f"{year}{month}{day}")
+
+
+def replay(engine, logger, start, end, sources=SOURCES, workers=4, batch_size=DEFAULT_BATCH_SIZE,
+           root=DEFAULT_ROOT, checkpoint_path=DEFAULT_CHECKPOINT, default_user_id=DEFAULT_USER_ID,
+           include_legacy=True, timezones=None, checkpoint=None):
+    """回放 [start, end] 内的原始数据
+
+    工作进程最多同时转换 workers * 2 天的数据，写库严格按日期顺序进行，
+    每写完一天更新检查点。
+
+    Returns:
+        dict: 回放统计
+    """
+    started = time.perf_counter()
+    checkpoint = checkpoint or {
+        'start': start.isoformat(), 'end': end.isoformat(), 'users': [],
+        # --resume 时恢复这些设置，保证前后两段按相同的规则回放
+        'sources': list(sources), 'default_user_id': default_user_id, 'include_legacy': include_legacy,
+    }
+    touched_users = set(checkpoint.get('users', []))
+    github_users = set(checkpoint.get('github_users', []))
+    snapshot_users = set(checkpoint.get('snapshot_users', []))
+    summary = {'days': 0, 'records': 0, 'rows': 0}
+    days = [day.isoformat() for day in iter_days(start, end)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        window = max(1, workers * 2)
+        pending = []
+        next_index = 0
+        while next_index < len(days) or pending:
+            # 保持固定数量的天在转换中，限制内存占用
+            while next_index < len(days) and len(pending) < window:
+                pending.append(executor.submit(
+                    transform_day, str(root), days[next_index], tuple(sources), default_user_id, include_legacy
+                ))
+                next_index += 1
+            result = pending.pop(0).result()
+
+            rows, latest_users = load_day(engine, logger, result, batch_size)
+            touched_users.update(row['user_id'] for row in result['toggl_entries'])
+            github_users.update(row['user_id'] for row in result['github_events'])
+            snapshot_users.update(latest_users)
+            summary['days'] += 1
+            summary['records'] += result['records']
+            summary['rows'] += rows
+            if result['records']:
+                logger.info(f"{result['day']}: {result['records']} 条原始记录，写入 {rows} 行")
+
+            checkpoint.update(
+                last_completed_day=result['day'], users=sorted(touched_users),
+                github_users=sorted(github_users), snapshot_users=sorted(snapshot_users)
+            )
+            write_checkpoint(checkpoint_path, checkpoint)
+
+    # 只有最新快照被回放替换的用户才刷新快照水位；只回放较早日期时读接口的缓存不失效
+    for user_id in sorted(snapshot_users):
+        save_sync_state(engine, user_id, TOGGL_SNAPSHOT_SOURCE, None, None, changed=True)
+    # 写入过事件 / 时间记录的用户刷新对应数据源的水位，依赖它们的 ETag 和缓存随之失效
+    for source, user_ids in ((GITHUB_EVENTS_SOURCE, github_users), (TOGGL_ENTRIES_SOURCE, touched_users)):
+        for user_id in sorted(user_ids):
+            mark_source_changed(engine, user_id, source)
+
+    # 时间记录全部写入后，为涉及的用户重建日汇总和每日状态
+    timezones = timezones or {}
+    for user_id in sorted(touched_users):
+        timezone = timezones.get(user_id)
+        summary['rows'] += rebuild_toggl_rollups(engine, logger, user_id, timezone, batch_size)
+        with Session(engine) as db:
+            summary['rows'] += materialize_recent(db, user_id, timezone)
+
+    checkpoint['finished'] = True
+    write_checkpoint(checkpoint_path, checkpoint)
+    summary['users'] = len(touched_users)
+    summary['seconds'] = round(time.perf_counter() - started, 2)
+    return summary
+
+
+def load_user_timezones(engine):
+    with engine.connect() as conn:
+        return {row.id: row.timezone for row in conn.execute(text("SELECT id, timezone FROM users"))}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="从 data/ 下的原始数据回放重建数据库")
+    parser.add_argument('--start', help="开始日期 YYYY-MM-DD，默认 data/ 下最早的日期")
+    parser.add_argument('--end', help="结束日期 YYYY-MM-DD，默认今天")
+    parser.add_argument('--sources', help=f"回放的数据源，逗号分隔，默认 {','.join(SOURCES)}")
+    parser.add_argument('--workers', type=int, default=4, help="解析转换的进程数")
+    parser.add_argument('--batch-size', type=int, help="每批写入的行数，默认取 config.json 的 loader.batch_size")
+    parser.add_argument('--user-id', type=int, help=f"旧文件（名称不含用户ID）归属的用户，默认 {DEFAULT_USER_ID}")
+    parser.add_argument('--no-legacy', action='store_true', help="不读取旧版本的 JSON 文件")
+    parser.add_argument('--checkpoint', default=str(DEFAULT_CHECKPOINT), help="检查点文件路径")
+    parser.add_argument('--resume', action='store_true', help="从检查点记录的下一天继续")
+    return parser.parse_args()
+
+
+def replay_settings(args, checkpoint=None):
+    """回放设置：--resume 时取检查点中的设置，命令行显式指定了不同的值时报错
+
+    Returns:
+        tuple: (数据源列表, 默认用户ID, 是否读取旧文件)
+    """
+    requested = {
+        'sources': [source.strip() for source in args.sources.split(',') if source.strip()] if args.sources else None,
+        'default_user_id': args.user_id,
+        'include_legacy': False if args.no_legacy else None,
+    }
+    defaults = {'sources': list(SOURCES), 'default_user_id': DEFAULT_USER_ID, 'include_legacy': True}
+    settings = {}
+    for key, value in requested.items():
+        # 旧检查点没有记录设置时沿用命令行参数
+        saved = checkpoint.get(key) if checkpoint else None
+        if saved is not None and value is not None and value != saved:
+            raise SystemExit(f"参数与检查点不一致: {key} 为 {value!r}，检查点中为 {saved!r}")
+        settings[key] = next(item for item in (saved, value, defaults[key]) if item is not None)
+    return settings['sources'], settings['default_user_id'], settings['include_legacy']
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logger = setup_logging()
+    try:
+        config = load_config()
+        batch_size = args.batch_size or config.get('loader', {}).get('batch_size', DEFAULT_BATCH_SIZE)
+
+        checkpoint = None
+        if args.resume:
+            checkpoint = read_checkpoint(args.checkpoint)
+            if not checkpoint:
+                raise SystemExit(f"检查点不存在: {args.checkpoint}")
+            if checkpoint.get('finished'):
+                logger.info("检查点记录的回放已完成，无需继续")
+                raise SystemExit(0)
+            start = parse_day(checkpoint['start'])
+            end = parse_day(checkpoint['end'])
+            if checkpoint.get('last_completed_day'):
+                start = parse_day(checkpoint['last_completed_day']) + timedelta(days=1)
+        else:
+            start = parse_day(args.start) if args.start else find_first_day(DEFAULT_ROOT)
+            end = parse_day(args.end) if args.end else datetime.now().date()
+            if start is None:
+                raise SystemExit("data/ 下没有可回放的数据")
+        sources, default_user_id, include_legacy = replay_settings(args, checkpoint)
+
+        engine = get_database_engine(logger)
+        ensure_schema(engine)
+        logger.info(f"开始回放 {start} ~ {end}，数据源 {','.join(sources)}，进程数 {args.workers}")
+        summary = replay(
+            engine, logger, start, end,
+            sources=sources,
+            workers=args.workers,
+            batch_size=batch_size,
+            checkpoint_path=args.checkpoint,
+            default_user_id=default_user_id,
+            include_legacy=include_legacy,
+            timezones=load_user_timezones(engine),
+            checkpoint=checkpoint,
+        )
+        logger.info(
+            f"回放完成: {summary['days']} 天，{summary['records']} 条原始记录，"
+            f"{summary['users']} 个用户，写入 {summary['rows']} 行，耗时 {summary['seconds']}s"
+        )
+    except Exception as e:
+        logger.error(f"回放失败: {e}", exc_info=True)
+        # 以非零状态退出，定时任务和 CI 能发现失败
+        sys.exit(1)
@@ -0,0 +1,11 @@
+"""后端冒烟测试的公共设置：后端模块按 backend/ 顶层导入，数据库使用临时 SQLite"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{Path(tempfile.mkdtemp()) / 'test.db'}")
+os.environ.setdefault('VITE_ENCRYPTION_KEY', 'MDEyMzQ1Njc4OWFiY2RlZjAxMjM0NTY3ODlhYmNkZWY=')
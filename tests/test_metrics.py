@@ -0,0 +1,31 @@
+"""metrics.py 冒烟测试：指标能够输出，请求经过 MetricsMiddleware 后计入各项指标"""
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import metrics
+
+
+def test_render_metrics():
+    body = metrics.render_metrics()
+    assert '# TYPE http_requests_total counter' in body
+    assert '# TYPE http_slow_requests_total counter' in body
+    assert '# TYPE http_response_serialize_duration_seconds histogram' in body
+
+
+def test_middleware_records_request():
+    app = FastAPI()
+
+    @app.get('/items/{item_id}')
+    def read_item(item_id: int):
+        return {'id': item_id}
+
+    # 阈值为 0，每个请求都按慢请求处理
+    app.add_middleware(metrics.MetricsMiddleware, slow_request_ms=0)
+    with TestClient(app) as client:
+        response = client.get('/items/1')
+
+    assert response.status_code == 200
+    assert 'db;dur=' in response.headers['server-timing']
+    body = metrics.render_metrics()
+    assert 'http_requests_total{method="GET",route="/items/{item_id}",status="200"} 1' in body
+    assert 'http_slow_requests_total{method="GET",route="/items/{item_id}"} 1' in body